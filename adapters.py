@@ -4,17 +4,22 @@ import requests
 
 from utils import (
     now_ts_ms, SESSION, BINANCE_FUTURES_BASE, TIME_OFFSET_MS,
-    EXCHANGE_INFO, load_exchange_info, log
+    EXCHANGE_INFO, load_exchange_info, conform_to_filters
 )
 import config
 from config import USE_TESTNET, ORDER_TIMEOUT_SEC, STOP_BUFFER_PCT, LIMIT_BUFFER_PCT
 import logging
 from journal import log_trade
+from rate_governor import governed_request, PRIO_ORDER, PRIO_ACCOUNT, PRIO_MARKET
 
 try:
     from ws_client import ws_best_price as _ws_best_price
 except Exception:
     _ws_best_price = None
+try:
+    from ws_client import ws_mark_price as _ws_mark_price
+except Exception:
+    _ws_mark_price = None
 
 from risk_frame import compute_stop_limit as rf_compute_stop_limit, compute_bracket
 compute_stop_limit = rf_compute_stop_limit
@@ -56,18 +61,30 @@ def _final_align(symbol: str, price: float, qty: float):
 
 # ================================== 模擬 Adapter ==================================
 class SimAdapter:
-    def __init__(self):
+    def __init__(self, price_source=None):
         self.open = None
         self.base = "" # SimAdapter 不需要 base
+        self.price_source = price_source   # 可選：fn(symbol) -> 價格或 None（例如 replay 的逐筆成交價）
 
     def has_open(self): return self.open is not None
 
     # <--- 修正：SimAdapter 的 get_mark_price 不應該呼叫 API，直接回傳 best_price
     def get_mark_price(self, symbol: str) -> float:
-        """獲取當前標記價格 (Mark Price) 用於風控輪詢 - 模擬版"""
+        """獲取當前標記價格 (Mark Price) 用於風控輪詢 - 模擬版（WS mark，沒有就用 best_price）"""
+        if _ws_mark_price:
+            p = _ws_mark_price(symbol)
+            if p is not None:
+                return float(p)
         return self.best_price(symbol)
 
     def best_price(self, symbol: str) -> float:
+        if self.price_source is not None:
+            try:
+                p = self.price_source(symbol)
+                if p:
+                    return float(p)
+            except Exception:
+                pass
         if _ws_best_price:
             try:
                 p = _ws_best_price(symbol)
@@ -110,7 +127,7 @@ class SimAdapter:
             "symbol": symbol, "side": side_u, "qty": qty_f,
             "entry": entry_f, "sl": sl_f, "tp": tp_f, "entry_stop": stop_f
         }
-        log.info(f"[SIM OPEN] {side_u} {symbol} entry={entry_f} stop={stop_f} sl={sl_f} tp={tp_f} qty={qty_f}")
+        logger.info(f"[SIM OPEN] {side_u} {symbol} entry={entry_f} stop={stop_f} sl={sl_f} tp={tp_f} qty={qty_f}")
         return "SIM_ORDER"
 
     # --- 偵測命中 TP/SL 後，強制收倉、清殘單、記帳 ---
@@ -124,7 +141,10 @@ class SimAdapter:
         
         # ⬇️ *** 修正點 1：改用 self.get_mark_price (模擬版) ***
         p = self.get_mark_price(symbol)
-        
+        if not p or p <= 0:
+            # 沒有價格來源時不能拿 0 去比 TP/SL（SHORT 會被當成 TP 命中）
+            return False, None, None, None, None
+
         hit_tp = (p >= self.open["tp"]) if side == "LONG" else (p <= self.open["tp"])
         hit_sl = (p <= self.open["sl"]) if side == "LONG" else (p >= self.open["sl"])
 
@@ -198,7 +218,31 @@ class LiveAdapter:
         self.open = None
         self._placing = False  # 簡單鎖，避免同時打單
 
-    # --- 基礎 HTTP 簽名/請求 ---
+        # 使用者資料串流：成交/倉位改由事件推送（失敗或未啟用時退回 REST 輪詢）
+        self.stream = None
+        if getattr(config, "USE_USER_STREAM", True) and self.key:
+            try:
+                from user_stream import UserDataStream
+                self.stream = UserDataStream(self.key, self.base, USE_TESTNET, snapshot=self._stream_snapshot)
+                self.stream.start()
+            except Exception as e:
+                logger.warning(f"user data stream disabled: {e}")
+                self.stream = None
+
+    def _stream_ok(self) -> bool:
+        return self.stream is not None and self.stream.alive()
+
+    def _stream_snapshot(self):
+        """串流（重）連線時的 REST 快照：(positionRisk, openOrders)"""
+        return self._get("/fapi/v2/positionRisk", {}), self._get("/fapi/v1/openOrders", {})
+
+    # --- 基礎 HTTP 簽名/請求（全部經過 rate_governor，下單優先） ---
+    @staticmethod
+    def _prio(path: str, method: str) -> int:
+        if method != "GET" and path in ("/fapi/v1/order", "/fapi/v1/allOpenOrders"):
+            return PRIO_ORDER
+        return PRIO_ACCOUNT
+
     def _sign(self, params: dict):
         from urllib.parse import urlencode
         q = urlencode(sorted(params.items()), doseq=True)
@@ -210,7 +254,8 @@ class LiveAdapter:
         params["timestamp"] = now_ts_ms() + int(TIME_OFFSET_MS)
         params.setdefault("recvWindow", 60000)
         qs = self._sign(params)
-        r = SESSION.post(f"{self.base}{path}?{qs}", headers={"X-MBX-APIKEY": self.key}, timeout=10)
+        r = governed_request(SESSION, "POST", f"{self.base}{path}?{qs}", prio=self._prio(path, "POST"),
+                             headers={"X-MBX-APIKEY": self.key}, timeout=10)
         r.raise_for_status()
         return r.json()
 
@@ -219,7 +264,8 @@ class LiveAdapter:
         params["timestamp"] = now_ts_ms() + int(TIME_OFFSET_MS)
         params.setdefault("recvWindow", 60000)
         qs = self._sign(params)
-        r = SESSION.get(f"{self.base}{path}?{qs}", headers={"X-MBX-APIKEY": self.key}, timeout=10)
+        r = governed_request(SESSION, "GET", f"{self.base}{path}?{qs}", prio=self._prio(path, "GET"),
+                             headers={"X-MBX-APIKEY": self.key}, timeout=10)
         r.raise_for_status()
         return r.json()
 
@@ -228,7 +274,8 @@ class LiveAdapter:
         params["timestamp"] = now_ts_ms() + int(TIME_OFFSET_MS)
         params.setdefault("recvWindow", 60000)
         qs = self._sign(params)
-        r = SESSION.delete(f"{self.base}{path}?{qs}", headers={"X-MBX-APIKEY": self.key}, timeout=10)
+        r = governed_request(SESSION, "DELETE", f"{self.base}{path}?{qs}", prio=self._prio(path, "DELETE"),
+                             headers={"X-MBX-APIKEY": self.key}, timeout=10)
         r.raise_for_status()
         return r.json()
     def _get_order(self, symbol: str, order_id: str):
@@ -251,7 +298,11 @@ class LiveAdapter:
         return True
 
     def _get_avg_filled_price(self, symbol: str, order_id: str) -> float | None:
-        """[新增] 透過 userTrades 查詢訂單的平均成交價"""
+        """[新增] 查詢訂單的平均成交價（先看串流訂單簿，沒有才查 userTrades）"""
+        if self.stream is not None:
+            rec = self.stream.get_order(order_id)
+            if rec and rec.get("avgPrice"):
+                return float(rec["avgPrice"])
         try:
             trades = self._get("/fapi/v1/userTrades", {"symbol": symbol, "limit": 20})
             for t in trades:
@@ -261,6 +312,26 @@ class LiveAdapter:
             logger.error(f"Failed to get userTrades for {symbol}: {e}")
         return None
 
+    def _close_fill_price(self, symbol: str, side: str, since: float) -> float:
+        """串流等不到平倉回報時：userTrades 裡 since 之後、平倉方向成交的加權均價；查不到用標記價"""
+        close_side = "SELL" if side == "LONG" else "BUY"
+        try:
+            trades = self._get("/fapi/v1/userTrades", {"symbol": symbol, "startTime": int(since * 1000), "limit": 50})
+            qty = notional = 0.0
+            for t in trades:
+                if t.get("side") == close_side:
+                    q = float(t.get("qty", 0))
+                    qty += q
+                    notional += q * float(t.get("price", 0))
+            if qty > 0:
+                return notional / qty
+        except Exception as e:
+            logger.error(f"Failed to get userTrades for {symbol}: {e}")
+        try:
+            return self.get_mark_price(symbol)
+        except Exception:
+            return self.best_price(symbol)
+
     # --- 資訊 ---
     def balance_usdt(self) -> float:
         arr = self._get("/fapi/v2/balance", {})
@@ -284,15 +355,21 @@ class LiveAdapter:
                     return float(p)
             except Exception:
                 pass
-        r = SESSION.get(f"{self.base}/fapi/v1/ticker/price", params={"symbol": symbol}, timeout=5)
+        r = governed_request(SESSION, "GET", f"{self.base}/fapi/v1/ticker/price", params={"symbol": symbol},
+                             prio=PRIO_MARKET, timeout=5)
         r.raise_for_status()
         return float(r.json()["price"])
     
     # ⬇️ *** 修正：get_mark_price 函式必須放在 LiveAdapter class 內部 ***
     def get_mark_price(self, symbol: str) -> float:
-        """獲取當前標記價格 (Mark Price) 用於風控輪詢"""
+        """獲取當前標記價格 (Mark Price) 用於風控輪詢：WS 快取夠新就直接用，過期才打 REST"""
+        if _ws_mark_price:
+            p = _ws_mark_price(symbol)
+            if p is not None:
+                return float(p)
         try:
-            r = SESSION.get(f"{self.base}/fapi/v1/premiumIndex", params={"symbol": symbol}, timeout=3)
+            r = governed_request(SESSION, "GET", f"{self.base}/fapi/v1/premiumIndex", params={"symbol": symbol},
+                                 prio=PRIO_ACCOUNT, timeout=3)
             r.raise_for_status()
             return float(r.json()["markPrice"])
         except Exception as e:
@@ -320,13 +397,21 @@ class LiveAdapter:
         return 0.0
 
     def _wait_filled(self, symbol: str, want_side: str, want_qty: float, timeout_ms=2000) -> bool:
-        """輪詢等待倉位建立（最多 2 秒）"""
+        """等待倉位建立（最多 2 秒）：串流在線就等 ACCOUNT_UPDATE，否則輪詢 positionRisk"""
         t0 = now_ts_ms()
         sign = 1.0 if want_side.upper() == "LONG" else -1.0
         target = sign * want_qty * 0.98  # 放寬 98% 避免精度差
+        ok = lambda pos: (sign > 0 and pos >= target) or (sign < 0 and pos <= target)
+        if self._stream_ok():
+            if self.stream.wait_position(symbol, ok, timeout=timeout_ms / 1000.0):
+                return True
+            # ACCOUNT_UPDATE 漏了或晚到：回 False 前用 REST 確認一次
+            try:
+                return ok(self._position_size(symbol))
+            except Exception:
+                return False
         while now_ts_ms() - t0 <= timeout_ms:
-            pos = self._position_size(symbol)
-            if (sign > 0 and pos >= target) or (sign < 0 and pos <= target):
+            if ok(self._position_size(symbol)):
                 return True
             time.sleep(0.08)
         return False
@@ -378,7 +463,8 @@ class LiveAdapter:
             # 這樣即使掛單失敗，程式也知道自己有倉位，不會造成幽靈倉
             self.open = {
                 "symbol": symbol, "side": side_u, "qty": float(qty_s),
-                "entry": float(entry_s), "sl": float(sl_s_fmt), "tp": float(tp_s_fmt)
+                "entry": float(entry_s), "sl": float(sl_s_fmt), "tp": float(tp_s_fmt),
+                "opened_at": time.time(),
             }
             logger.info(f"[STATE SET] {symbol} position locked internally.") # 新增日誌
 
@@ -432,6 +518,23 @@ class LiveAdapter:
         side   = self.open["side"]
         entry  = float(self.open["entry"])
 
+        # === 串流已回報倉位歸零（交易所端 TP/SL 已成交）：直接同步狀態 ===
+        if self._stream_ok():
+            amt = self.stream.position_amt(symbol)
+            if amt is not None and abs(amt) < float(self.open["qty"]) * 0.01 \
+                    and self.stream.position_ts(symbol) >= float(self.open.get("opened_at", 0)):
+                opened_at = float(self.open.get("opened_at", 0))
+                fill = self.stream.wait_close_fill(symbol, opened_at,
+                                                   float(getattr(config, "CLOSE_FILL_WAIT_S", 1.0))) or {}
+                exit_price = fill.get("avgPrice") or self._close_fill_price(symbol, side, opened_at)
+                reason = "TP" if fill.get("origType") == "TAKE_PROFIT_MARKET" else \
+                         "SL" if fill.get("origType") == "STOP_MARKET" else "EXCHANGE"
+                pct = (exit_price - entry) / entry
+                if side == "SHORT":
+                    pct = -pct
+                logger.info(f"[CLOSE] {symbol} closed on exchange ({reason}) @ {exit_price}, syncing state.")
+                return self._finish_close(day_guard, symbol, pct, reason, exit_price)
+
         # === 修正 1：使用 Mark Price (防假跳動) ===
         try:
             p = self.get_mark_price(symbol)
@@ -469,7 +572,7 @@ class LiveAdapter:
             # 2. 市價平倉失敗 (最可能的原因：實體 SL/TP 單已成交)
             logger.warning(f"[CLOSE] Force market close FAILED for {symbol}: {e}")
 
-            # 3. 立即反查倉位
+            # 3. 立即反查倉位（一律問 REST：串流的倉位數量可能是斷線前的舊值）
             try:
                 current_pos = self._position_size(symbol)
                 # 檢查倉位是否 "幾乎為 0"
@@ -486,7 +589,10 @@ class LiveAdapter:
                 return False, None, None, None, None # 不確定狀態，返回 False 重試
 
         # --- 平倉成功 (不論是 Bot 還是交易所平的) ---
+        return self._finish_close(day_guard, symbol, pct, reason, exit_price)
 
+    def _finish_close(self, day_guard, symbol, pct, reason, exit_price):
+        """平倉後共用收尾：清殘單、記帳、清空內部狀態"""
         # 4. 清理殘單 (例如剩下的 TP 單)
         try:
             logger.info(f"Cancelling remaining orders for {symbol}...")
@@ -561,9 +667,16 @@ class LiveAdapter:
                         logger.info(f"[ENTRY] MAKER {symbol} {side_u} qty={qty_s} @ {entry_s} (ID: {order_id})")
 
                         # === 步驟 2: 等待 Maker 單成交 ===
-                        time.sleep(maker_timeout_ms / 1000.0) # 等待 1.5 秒
-                        
-                        status_resp = self._get_order(symbol, order_id)
+                        # 串流在線：等 ORDER_TRADE_UPDATE（成交當下就返回）；逾時或離線才查一次 REST
+                        status_resp = None
+                        if self._stream_ok():
+                            status_resp = self.stream.wait_order(order_id, timeout=maker_timeout_ms / 1000.0)
+                            if status_resp and status_resp.get("status") != "FILLED":
+                                status_resp = None
+                        else:
+                            time.sleep(maker_timeout_ms / 1000.0) # 等待 1.5 秒
+                        if status_resp is None:
+                            status_resp = self._get_order(symbol, order_id)
                         status = status_resp.get("status") if status_resp else "UNKNOWN"
 
                         if status == "FILLED":
@@ -623,7 +736,8 @@ class LiveAdapter:
                     self.open = {
                         "symbol": symbol, "side": side_u, "qty": float(qty_s),
                         "entry": avg_filled_price, # <-- 使用真實成交均價
-                        "sl": float(sl_s_fmt), "tp": float(tp_s_fmt)
+                        "sl": float(sl_s_fmt), "tp": float(tp_s_fmt),
+                        "opened_at": time.time(),
                     }
                     logger.info(f"[STATE SET] {symbol} position locked internally @ {avg_filled_price:.{price_prec}f}")
 
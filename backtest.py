@@ -0,0 +1,643 @@
+# backtest.py
+# 量價突破（多）/跌破（空）歷史回測：讀本機 5m K 線檔，整段序列一次用 NumPy 陣列算完全部條件，
+# 再逐 bar 模擬 compute_bracket 的 TP/SL 出場，輸出與 journal.csv 相同欄位的成交紀錄。
+# - 條件與 signal_core 一致：前高/前低（不含當根）、量能中位數尖峰 + 降溫、滾動 VWAP 距離/超伸、
+#   EMA 快慢 + 斜率（第一根為種子，同 indicators 引擎）、箱體寬度 / ATR、疲勞
+# - 便宜的條件先整段算成遮罩，疲勞與量能中位數只在候選 bar 上算
+# - armed → 回測狀態機只沿候選 bar 推進（RETEST_EXPIRE_N 以收盤時間計 bar 數，與 RetestMachine 相同）
+# - 進場價 = 回測那根的收盤；之後逐根檢查高低點，同一根同時碰到 TP/SL 時保守算 SL；
+#   跳空越過觸發價時以開盤價成交
+# - 預設模擬實盤限制：全部 symbol 同時只持有 1 筆、DayGuard 日停利/日停損；--independent 則每檔各自獨立
+# - 參數預設讀 config，可用 params 覆寫（掃參數用，見 sweep.py）
+# - 另有兩個只用 K 線的 1m scalp 策略（--strategy scalp_vwap / scalp_breakout）：收盤立即進場，套 TIME_STOP_SEC
+#
+# 資料：<root>/<interval>/ 下的 CSV（data.binance.vision 的月檔 BTCUSDT-5m-2024-01.csv，或 BTCUSDT.csv），
+# 欄位 open_time,open,high,low,close,volume,close_time,...（有無表頭皆可）。
+# 第一次讀會在 <root>/<interval>/.npy/ 存一份解析好的陣列，之後直接載入。
+#
+# 用法：
+#   python backtest.py                                   # data/klines/5m 下全部 symbol
+#   python backtest.py --symbols BTCUSDT,ETHUSDT --start 2024-01-01 --end 2025-01-01
+#   python backtest.py --independent --workers 8 --out bt_journal.csv
+#   python backtest.py --set HH_N=48 --set VOL_SPIKE_K=2.0
+#   python backtest.py --strategy scalp_vwap --set SCALP_Z_THR=1.5       # data/klines/1m
+
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+import journal
+from risk_frame import DayGuard, DayState, compute_bracket, position_size_notional
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:  # pragma: no cover - 選配依賴
+    np = None
+
+DATA_DIR = getattr(config, "BACKTEST_DIR", "data/klines")
+INTERVAL = getattr(config, "KLINE_INTERVAL", "5m")
+
+# 回測會用到的 config 參數（名稱同 config.py；預設值同 signal_core / indicators）
+PARAM_DEFAULTS = {
+    "KLINE_LIMIT": 120,            # 5m 滾動 VWAP 視窗（indicators 引擎同值）
+    "HH_N": 60,
+    "LL_N": 60,
+    "OVEREXTEND_CAP": 0.012,
+    "VOL_BASE_WIN": 48,
+    "VOL_SPIKE_K": 1.5,
+    "VOL_LOOKBACK_CONFIRM": 3,
+    "VOL_COOLDOWN_ALPHA": 0.80,
+    "EMA_FAST": 20,
+    "EMA_SLOW": 50,
+    "EMA_SLOPE_N": 50,
+    "VWAP_DIST_MAX": 0.008,
+    "BASE_MIN_BARS": 12,
+    "BASE_MAX_ATR_Q": 0.35,
+    "FATIGUE_LOOKBACK": 4,
+    "FATIGUE_MIN_STREAK": 2,
+    "FATIGUE_TOTAL_MOVE": 0.015,
+    "RETEST_BUFFER_PCT": 0.001,
+    "RETEST_EXPIRE_N": 6,
+    "IND_ATR_N": 14,
+    "TP_PCT": 0.015,
+    "SL_PCT": 0.0075,
+    "SCALP_Z_THR": 1.0,           # scalp_vwap
+    "IND_Z_N": 21,
+    "IND_VWAP_N_1M": 21,          # scalp_breakout 的 VWAP 視窗
+}
+_INT_PARAMS = {"KLINE_LIMIT", "HH_N", "LL_N", "VOL_BASE_WIN", "VOL_LOOKBACK_CONFIRM", "EMA_FAST", "EMA_SLOW",
+               "EMA_SLOPE_N", "BASE_MIN_BARS", "FATIGUE_LOOKBACK", "FATIGUE_MIN_STREAK", "RETEST_EXPIRE_N",
+               "IND_ATR_N", "IND_Z_N", "IND_VWAP_N_1M"}
+STRATEGIES = ("volume", "scalp_vwap", "scalp_breakout")
+SCALP_HL_N = 20                   # scalp_breakout：前 20 根高低點（訊號內寫死）
+SCALP_MIN_BARS = 25               # scalp 訊號的最少根數
+
+def available() -> bool:
+    return np is not None
+
+def _need_numpy():
+    if np is None:
+        raise RuntimeError("backtest 需要 numpy（pip install numpy）")
+
+def default_params(**overrides) -> dict:
+    """config 目前的值（沒有就用預設）＋ overrides；未知的名稱直接報錯，避免打錯字默默沒生效"""
+    p = {k: getattr(config, k, v) for k, v in PARAM_DEFAULTS.items()}
+    for k, v in overrides.items():
+        if k not in PARAM_DEFAULTS:
+            raise KeyError(f"unknown backtest param: {k}")
+        p[k] = v
+    for k in p:
+        p[k] = int(p[k]) if k in _INT_PARAMS else float(p[k])
+    return p
+
+def _interval_seconds(interval: str) -> int:
+    unit = {"m": 60, "h": 3600, "d": 86400, "w": 604800}[interval[-1]]
+    return int(interval[:-1]) * unit
+
+# ==== 資料 ====
+def _symbol_of(path: str) -> str:
+    base = os.path.basename(path)
+    return base.split("-")[0].split(".")[0].upper()
+
+def _files(symbol: str, root: str, interval: str) -> List[str]:
+    d = os.path.join(root, interval)
+    out = glob.glob(os.path.join(d, f"{symbol}-*.csv")) + glob.glob(os.path.join(d, f"{symbol}.csv"))
+    return sorted(set(out))
+
+def list_symbols(root: str = DATA_DIR, interval: str = INTERVAL) -> List[str]:
+    return sorted({_symbol_of(f) for f in glob.glob(os.path.join(root, interval, "*.csv"))})
+
+def _parse_csv(path: str):
+    """→ (n, 6) 陣列：close_ts(秒), open, high, low, close, volume"""
+    with open(path, "r") as f:
+        first = f.readline()
+    skip = 0 if first[:1].isdigit() else 1
+    try:
+        a = np.loadtxt(path, delimiter=",", skiprows=skip, usecols=(6, 1, 2, 3, 4, 5), ndmin=2)
+    except Exception:
+        return np.empty((0, 6))
+    a[:, 0] /= 1000.0
+    return a
+
+def load_klines(symbol: str, root: str = DATA_DIR, interval: str = INTERVAL) -> Optional[dict]:
+    """
+    一個 symbol 的全部本機 K 線 → {ts, o, h, l, c, v}（依收盤時間排序、去重）；沒有檔案回 None。
+    解析結果快取在 .npy/，任一 CSV 比快取新就重建。
+    """
+    _need_numpy()
+    files = _files(symbol, root, interval)
+    if not files:
+        return None
+    cache = os.path.join(root, interval, ".npy", f"{symbol}.npy")
+    arr = None
+    try:
+        if os.path.getmtime(cache) >= max(os.path.getmtime(f) for f in files):
+            arr = np.load(cache)
+    except OSError:
+        pass
+    if arr is None:
+        parts = [_parse_csv(f) for f in files]
+        arr = np.concatenate(parts) if parts else np.empty((0, 6))
+        arr = arr[np.argsort(arr[:, 0], kind="stable")]
+        if len(arr):
+            keep = np.ones(len(arr), dtype=bool)
+            keep[1:] = arr[1:, 0] != arr[:-1, 0]
+            arr = arr[keep]
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            np.save(cache, arr)
+        except OSError:
+            pass
+    if not len(arr):
+        return None
+    return {"ts": arr[:, 0], "o": arr[:, 1], "h": arr[:, 2], "l": arr[:, 3], "c": arr[:, 4], "v": arr[:, 5]}
+
+# ==== 向量化小工具（整段序列；out[t] 對應「第 t 根收盤時」的值） ====
+def _win_reduce(x, n: int, op):
+    """out[s] = op(x[s:s+n])，s = 0..len-n；倍增法（2、4、8… 根）O(T log n)，每步都是連續記憶體運算"""
+    m = x
+    w = 1
+    while w * 2 <= n:
+        m = op(m[:-w], m[w:])
+        w *= 2
+    # 兩個長度 w 的視窗重疊蓋滿長度 n
+    L = len(x) - n + 1
+    return op(m[:L], m[n - w:n - w + L])
+
+def _prev_max(x, n: int):
+    """out[t] = max(x[t-n:t])（不含當根）；t < n 為 nan"""
+    out = np.full(len(x), np.nan)
+    if len(x) > n:
+        out[n:] = _win_reduce(x[:-1], n, np.maximum)
+    return out
+
+def _prev_min(x, n: int):
+    out = np.full(len(x), np.nan)
+    if len(x) > n:
+        out[n:] = _win_reduce(x[:-1], n, np.minimum)
+    return out
+
+def _rolling_sum(x, n: int):
+    """out[t] = sum(x[t-n+1..t])；開頭不足 n 根就用現有的"""
+    cs = np.concatenate(([0.0], np.cumsum(x)))
+    idx = np.arange(1, len(x) + 1)
+    return cs[idx] - cs[np.maximum(idx - n, 0)]
+
+def _ema(x, n: int):
+    """
+    EMA(n)，以第一根為種子（同 indicators 引擎）。遞推拆成固定長度的區塊：
+    區塊內用 cumsum 的封閉解一次算完，只有區塊間的銜接是 Python 迴圈（T/B 步）。
+    """
+    k = 2.0 / (n + 1.0)
+    a = 1.0 - k
+    T = len(x)
+    if T == 0:
+        return np.empty(0)
+    B = int(min(256, max(4, 6.0 / -np.log10(a)))) if a > 0 else 1   # a^-B ≤ 1e6，避免精度流失
+    nb = -(-T // B)
+    pad = np.empty(nb * B)
+    pad[:T] = x
+    pad[T:] = x[-1]
+    X = pad.reshape(nb, B)
+    j = np.arange(B)
+    y = k * np.cumsum(X * a ** (-j), axis=1) * a ** j
+    apow = a ** (j + 1)
+    carry = np.empty(nb)
+    e = float(x[0])
+    last = y[:, -1]
+    aB = apow[-1]
+    for b in range(nb):
+        carry[b] = e
+        e = last[b] + aB * e
+    return (y + apow[None, :] * carry[:, None]).ravel()[:T]
+
+def _atr(h, l, c, n: int):
+    """out[t] = 最近 min(t, n) 根 TR 的平均（TR 從第二根開始）；t=0 為 0"""
+    T = len(c)
+    tr = np.zeros(T)
+    if T > 1:
+        pc = c[:-1]
+        tr[1:] = np.maximum(h[1:] - l[1:], np.maximum(np.abs(h[1:] - pc), np.abs(l[1:] - pc)))
+    cnt = np.minimum(np.arange(T), n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(cnt > 0, _rolling_sum(tr, n) / np.maximum(cnt, 1), 0.0)
+
+def _fatigue(c, idx, m: int, min_streak: int, total_move: float, bullish: bool):
+    """同 signal_core._fatigue_exhausted，只算 idx 這些 bar（看 c[t-m..t]）；迴圈只有 m 步"""
+    hit = np.zeros(len(idx), dtype=bool)
+    if m < 1:
+        return hit
+    ok = idx >= m
+    t = idx[ok]
+    streak = np.zeros(len(t))
+    acc = np.zeros(len(t))
+    out = np.zeros(len(t), dtype=bool)
+    for i in range(1, m + 1):
+        prev = c[t - m + i - 1]
+        d = c[t - m + i] - prev
+        up = (d > 0) if bullish else (d < 0)
+        streak = np.where(up, streak + 1, 0.0)
+        acc = np.where(up, acc + np.abs(d) / np.maximum(prev, 1e-9), 0.0)
+        out |= (streak >= min_streak) & (acc >= total_move)
+    hit[ok] = out
+    return hit
+
+def _vwap(c, v, n: int):
+    pv = _rolling_sum(c * v, n)
+    vv = _rolling_sum(v, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(vv > 0, pv / np.where(vv > 0, vv, 1.0), c)
+
+def _zscore(c, n: int):
+    """同 indicators 引擎：最近 n 根收盤（含當根）的 z；以第一根平移降低平方和誤差，變異數 ≈0 或不足 2 根為 nan"""
+    d = c - c[0]
+    cnt = np.minimum(np.arange(1, len(c) + 1), n)
+    mean = _rolling_sum(d, n) / cnt
+    var = _rolling_sum(d * d, n) / cnt - mean * mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((cnt >= 2) & (var > 1e-18), (d - mean) / np.sqrt(np.maximum(var, 1e-300)), np.nan)
+
+# 只依 bars + 單一整數參數的中間陣列：(名稱, n) → 計算函式。掃參數時可先算好存檔共用（見 sweep.py）
+INDICATORS = {
+    "prev_high": lambda b, n: _prev_max(b["h"], n),
+    "prev_low": lambda b, n: _prev_min(b["l"], n),
+    "vwap": lambda b, n: _vwap(b["c"], b["v"], n),
+    "ema": lambda b, n: _ema(b["c"], n),
+    "atr": lambda b, n: _atr(b["h"], b["l"], b["c"], n),
+    "box": lambda b, n: _prev_max(b["h"], n) - _prev_min(b["l"], n),
+    "zscore": lambda b, n: _zscore(b["c"], n),
+}
+
+def indicator_keys(p: dict, strategy: str = "volume") -> List[Tuple[str, int]]:
+    """這組參數 + 策略會用到的 (名稱, n)"""
+    if strategy == "scalp_vwap":
+        return [("zscore", p["IND_Z_N"])]
+    if strategy == "scalp_breakout":
+        return [("prev_high", SCALP_HL_N), ("prev_low", SCALP_HL_N), ("vwap", p["IND_VWAP_N_1M"])]
+    return [("prev_high", p["HH_N"]), ("prev_low", p["LL_N"]), ("vwap", p["KLINE_LIMIT"]),
+            ("ema", p["EMA_FAST"]), ("ema", p["EMA_SLOW"]), ("ema", p["EMA_SLOPE_N"]),
+            ("atr", p["IND_ATR_N"]), ("box", p["BASE_MIN_BARS"])]
+
+def _ind(bars: dict, cache, name: str, n: int):
+    """cache：同一份 bars 換參數重跑時共用（dict 或任何有 get / __setitem__ 的物件）"""
+    if cache is None:
+        return INDICATORS[name](bars, n)
+    key = (name, int(n))
+    v = cache.get(key)
+    if v is None:
+        v = cache[key] = INDICATORS[name](bars, n)
+    return v
+
+# ==== 條件 ====
+def arm_masks(bars: dict, p: dict, cache: Optional[dict] = None):
+    """
+    整段序列的 armed 條件（= signal_core.arm_ok）→ (long_mask, short_mask, prev_high, prev_low)。
+    """
+    _need_numpy()
+    c, v = bars["c"], bars["v"]
+    T = len(c)
+    conf = p["VOL_LOOKBACK_CONFIRM"]
+    W = p["VOL_BASE_WIN"]
+    t_idx = np.arange(T)
+
+    prev_high = _ind(bars, cache, "prev_high", p["HH_N"])
+    prev_low = _ind(bars, cache, "prev_low", p["LL_N"])
+    need = max(p["HH_N"], p["LL_N"], W) + conf + 2
+    enough = t_idx + 1 >= need
+
+    # 量能降溫
+    vp = np.concatenate(([v[0]], v[:-1]))
+    peak = np.maximum(vp, v)
+    a = p["VOL_COOLDOWN_ALPHA"]
+    cool = (v <= a * peak) | (vp <= a * peak)
+    cool[0] = True
+
+    # VWAP 距離
+    vwap = _ind(bars, cache, "vwap", p["KLINE_LIMIT"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = np.where(c == 0, 0.0, np.abs(c - vwap) / np.where(c == 0, 1.0, c))
+    dist_ok = (dist <= p["VWAP_DIST_MAX"]) & (dist <= p["OVEREXTEND_CAP"])
+
+    # EMA 結構 + 斜率（引擎：ema{n} 在 count ≥ n 才有值，斜率在 count ≥ n+2 才非 0）
+    ef = _ind(bars, cache, "ema", p["EMA_FAST"])
+    es = _ind(bars, cache, "ema", p["EMA_SLOW"])
+    sn = p["EMA_SLOPE_N"]
+    en = _ind(bars, cache, "ema", sn)
+    slope = np.zeros(T)
+    slope[1:] = en[1:] - en[:-1]
+    slope[t_idx + 1 < sn + 2] = 0.0
+    ema_ok = t_idx + 1 >= max(p["EMA_FAST"], p["EMA_SLOW"])
+
+    # 箱體：前 m 根（不含當根）寬度 / ATR
+    m = p["BASE_MIN_BARS"]
+    atr = _ind(bars, cache, "atr", p["IND_ATR_N"])
+    width = _ind(bars, cache, "box", m)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        base_ok = (atr > 0) & (t_idx + 1 >= m + 2) & (width / np.where(atr > 0, atr, 1.0) <= p["BASE_MAX_ATR_Q"] / 0.5)
+
+    common = enough & cool & dist_ok & ema_ok & base_ok
+    with np.errstate(invalid="ignore"):
+        long_m = common & (c > prev_high) & (ef > es) & (slope > 0.0)
+        short_m = common & (c < prev_low) & (ef < es) & (slope < 0.0)
+
+    # 疲勞與量能尖峰（中位數）只在候選 bar 上算
+    fat = (p["FATIGUE_LOOKBACK"], p["FATIGUE_MIN_STREAK"], p["FATIGUE_TOTAL_MOVE"])
+    for mask, bullish in ((long_m, True), (short_m, False)):
+        idx = np.flatnonzero(mask)
+        if len(idx):
+            mask[idx[_fatigue(c, idx, *fat, bullish=bullish)]] = False
+    cand = np.flatnonzero(long_m | short_m)
+    if len(cand):
+        start = cand - W - conf + 1
+        med = np.median(sliding_window_view(v, W)[start], axis=1)
+        recent = _rolling_sum(v, conf)[cand]
+        spike = np.zeros(T, dtype=bool)
+        spike[cand] = recent >= p["VOL_SPIKE_K"] * med * conf
+        long_m &= spike
+        short_m &= spike
+    return long_m, short_m, prev_high, prev_low
+
+def retest_entries(arm, level, c, ts, p: dict, bar_s: float) -> List[Tuple[int, int]]:
+    """
+    armed → 回測（同 RetestMachine.step）：armed 那根不進；之後 expire_n 根內收盤回到 level ± buffer
+    才進場；超時那根只做失效、不重新 armed。回傳 [(armed_idx, entry_idx)]。
+    """
+    cands = np.flatnonzero(arm)
+    out = []
+    buf = p["RETEST_BUFFER_PCT"]
+    span = (p["RETEST_EXPIRE_N"] + 0.5) * bar_s     # round((ts - armed_ts) / bar_s) ≤ N
+    free = 0
+    j = 0
+    n = len(cands)
+    T = len(c)
+    while j < n:
+        t0 = int(cands[j])
+        if t0 < free:
+            j = int(np.searchsorted(cands, free))
+            continue
+        lvl = level[t0]
+        hi = int(np.searchsorted(ts, ts[t0] + span, side="left"))
+        seg = c[t0 + 1:hi]
+        ok = np.abs(seg - lvl) / np.maximum(seg, 1e-9) <= buf
+        if ok.any():
+            k = t0 + 1 + int(np.argmax(ok))
+            out.append((t0, k))
+            free = k + 1
+        else:
+            free = hi + 1
+        if free >= T:
+            break
+    return out
+
+def _exit(bars: dict, k: int, side: str, sl: float, tp: float, max_bars: int):
+    """從第 k+1 根起找第一根碰到 SL/TP 的 bar → (idx, exit_price, reason)"""
+    o, h, l, c = bars["o"], bars["h"], bars["l"], bars["c"]
+    T = len(c)
+    end = T if max_bars <= 0 else min(T, k + 1 + max_bars)
+    a = k + 1
+    step = 32
+    while a < end:
+        b = min(end, a + step)
+        if side == "LONG":
+            s_hit = l[a:b] <= sl
+            t_hit = h[a:b] >= tp
+        else:
+            s_hit = h[a:b] >= sl
+            t_hit = l[a:b] <= tp
+        hit = s_hit | t_hit
+        if hit.any():
+            i = int(np.argmax(hit))
+            x = a + i
+            if s_hit[i]:     # 同一根兩邊都碰到 → 保守算 SL
+                px = min(sl, o[x]) if side == "LONG" else max(sl, o[x])
+                return x, px, "SL"
+            px = max(tp, o[x]) if side == "LONG" else min(tp, o[x])
+            return x, px, "TP"
+        a = b
+        step *= 2
+    if max_bars > 0 and k + max_bars < T:
+        return k + max_bars, float(c[k + max_bars]), "TIME"
+    return T - 1, float(c[T - 1]), "EOD"
+
+def scalp_masks(bars: dict, p: dict, strategy: str, cache=None):
+    """
+    1m scalp 訊號（只用 K 線的那兩個）→ (long_mask, short_mask)，收盤立即進場、不等回測：
+    - scalp_vwap：z ≤ -SCALP_Z_THR 做多、≥ SCALP_Z_THR 做空（z 同 indicators 引擎）
+    - scalp_breakout：收盤 ≥ 前 20 根高點做多、≤ 前低做空；離 VWAP 超過 VWAP_DIST_MAX 不做
+    """
+    _need_numpy()
+    c = bars["c"]
+    enough = np.arange(len(c)) + 1 >= SCALP_MIN_BARS
+    with np.errstate(invalid="ignore"):
+        if strategy == "scalp_vwap":
+            z = _ind(bars, cache, "zscore", p["IND_Z_N"])
+            thr = p["SCALP_Z_THR"]
+            return enough & (z <= -thr), enough & (z >= thr)
+        vw = _ind(bars, cache, "vwap", p["IND_VWAP_N_1M"])
+        dist_ok = ~(np.abs(c - vw) / np.where(vw != 0, vw, 1.0) > p["VWAP_DIST_MAX"])
+        ok = enough & dist_ok
+        long_m = ok & (c >= _ind(bars, cache, "prev_high", SCALP_HL_N))
+        short_m = ok & ~long_m & (c <= _ind(bars, cache, "prev_low", SCALP_HL_N))
+    return long_m, short_m
+
+def entry_signals(bars: dict, p: dict, bar_s: float, strategy: str = "volume", cache=None) -> List[tuple]:
+    """[(entry_idx, side, armed_idx)]，依進場 bar 排序；同一根多空都有時先做多（同 main：breakout 在前）"""
+    if strategy == "volume":
+        long_m, short_m, prev_high, prev_low = arm_masks(bars, p, cache)
+        c, ts = bars["c"], bars["ts"]
+        ev = [(k, "LONG", t0) for t0, k in retest_entries(long_m, prev_high, c, ts, p, bar_s)]
+        ev += [(k, "SHORT", t0) for t0, k in retest_entries(short_m, prev_low, c, ts, p, bar_s)]
+    elif strategy in STRATEGIES:
+        long_m, short_m = scalp_masks(bars, p, strategy, cache)
+        ev = [(int(k), "LONG", int(k)) for k in np.flatnonzero(long_m)]
+        ev += [(int(k), "SHORT", int(k)) for k in np.flatnonzero(short_m)]
+    else:
+        raise ValueError(f"unknown strategy: {strategy}")
+    ev.sort(key=lambda e: (e[0], e[1] != "LONG"))
+    return ev
+
+def default_time_stop(strategy: str, bar_s: float) -> int:
+    """main 只在 scalp 模式套 TIME_STOP_SEC；換算成 bar 數（無條件進位）"""
+    if strategy == "volume":
+        return 0
+    sec = float(getattr(config, "TIME_STOP_SEC", 180))
+    return max(1, int(-(-sec // bar_s)))
+
+def simulate(symbol: str, bars: dict, p: dict, bar_s: float, time_stop_bars: int = 0,
+             cache=None, strategy: str = "volume") -> List[dict]:
+    """單一 symbol 的成交：同一時間只有 1 筆（出場那根收盤之後才能再進）"""
+    c, ts = bars["c"], bars["ts"]
+    trades = []
+    busy = -1
+    for k, side, t0 in entry_signals(bars, p, bar_s, strategy, cache):
+        if k <= busy:
+            continue
+        entry = float(c[k])
+        sl, tp = compute_bracket(entry, side, p["SL_PCT"], p["TP_PCT"])
+        x, px, reason = _exit(bars, k, side, sl, tp, time_stop_bars)
+        pct = (px - entry) / entry
+        if side == "SHORT":
+            pct = -pct
+        trades.append({"symbol": symbol, "side": side, "armed_ts": float(ts[t0]), "entry_ts": float(ts[k]),
+                       "exit_ts": float(ts[x]), "entry": entry, "exit": float(px), "ret_pct": pct,
+                       "reason": reason})
+        busy = x
+    return trades
+
+def clip_trades(trades: List[dict], start_ts: Optional[float], end_ts: Optional[float]) -> List[dict]:
+    """只留進場時間落在 [start_ts, end_ts) 的成交（指標仍用整段資料暖機）"""
+    if start_ts is None and end_ts is None:
+        return trades
+    lo = start_ts if start_ts is not None else float("-inf")
+    hi = end_ts if end_ts is not None else float("inf")
+    return [t for t in trades if lo <= t["entry_ts"] < hi]
+
+def run_symbol(symbol: str, root: str = DATA_DIR, interval: str = INTERVAL, params: Optional[dict] = None,
+               start_ts: Optional[float] = None, end_ts: Optional[float] = None,
+               time_stop_bars: int = 0, strategy: str = "volume") -> Tuple[List[dict], int]:
+    """載入 + 模擬一個 symbol → (trades, bars)"""
+    bars = load_klines(symbol, root, interval)
+    if bars is None:
+        return [], 0
+    p = params or default_params()
+    trades = simulate(symbol, bars, p, _interval_seconds(interval), time_stop_bars, strategy=strategy)
+    return clip_trades(trades, start_ts, end_ts), len(bars["c"])
+
+# ==== 組合層 ====
+def portfolio(trades: Iterable[dict], equity: float, independent: bool = False) -> List[dict]:
+    """
+    依進場時間排序並填 qty（main 的 sizing：position_size_notional(權益) / entry）。
+    預設套實盤限制：同時只持有 1 筆、DayGuard 停機後當日不再進場；independent=True 則全收、權益固定。
+    """
+    out = []
+    day = DayGuard()
+    day.state = DayState(key="")
+    busy_until = float("-inf")
+    for t in sorted(trades, key=lambda x: (x["entry_ts"], x["symbol"])):
+        t = dict(t)
+        if independent:
+            t["qty"] = position_size_notional(equity) / max(t["entry"], 1e-9)
+            out.append(t)
+            continue
+        if t["entry_ts"] < busy_until:
+            continue
+        key = datetime.fromtimestamp(t["entry_ts"]).date().isoformat()
+        if key != day.state.key:
+            day.state = DayState(key=key)
+        if not day.can_trade():
+            continue
+        t["qty"] = position_size_notional(equity * (1.0 + day.state.pnl_pct)) / max(t["entry"], 1e-9)
+        key = datetime.fromtimestamp(t["exit_ts"]).date().isoformat()
+        if key != day.state.key:
+            day.state = DayState(key=key)
+        day.on_trade_close(t["ret_pct"])
+        busy_until = t["exit_ts"]
+        out.append(t)
+    return out
+
+def summarize(trades: List[dict]) -> dict:
+    """{trades, wins, win_rate, pnl_pct, max_dd_pct, by_reason}；pnl 與回撤以每筆 ret_pct 累加（同 DayGuard）"""
+    rets = [t["ret_pct"] for t in sorted(trades, key=lambda x: x["exit_ts"])]
+    wins = sum(1 for r in rets if r > 0)
+    eq = peak = dd = 0.0
+    for r in rets:
+        eq += r
+        peak = max(peak, eq)
+        dd = max(dd, peak - eq)
+    reasons: Dict[str, int] = {}
+    for t in trades:
+        reasons[t["reason"]] = reasons.get(t["reason"], 0) + 1
+    return {"trades": len(rets), "wins": wins, "win_rate": (wins / len(rets)) if rets else 0.0,
+            "pnl_pct": eq, "max_dd_pct": dd, "by_reason": reasons}
+
+def write_journal(trades: List[dict], path: str):
+    """journal.csv 同欄位/同格式；ts 為出場時間（journal 在平倉時寫入）"""
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(journal.HEAD)
+        for t in sorted(trades, key=lambda x: x["exit_ts"]):
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t["exit_ts"]))
+            w.writerow([ts, t["symbol"], t["side"], f"{t.get('qty', 0.0):.6g}", f"{t['entry']:.10g}",
+                        f"{t['exit']:.10g}", f"{t['ret_pct'] * 100:.4f}", t["reason"]])
+
+def _run_one(args):
+    return run_symbol(*args)
+
+def run(symbols: Optional[List[str]] = None, root: str = DATA_DIR, interval: Optional[str] = None,
+        params: Optional[dict] = None, workers: int = 1, start_ts: Optional[float] = None,
+        end_ts: Optional[float] = None, time_stop_bars: Optional[int] = None, equity: float = 10000.0,
+        independent: bool = False, strategy: str = "volume") -> Tuple[List[dict], dict]:
+    """
+    多個 symbol 回測（workers > 1 用行程池，每個 symbol 一個工作）→ (trades, summary)。
+    interval / time_stop_bars 不給就依策略：volume 用 KLINE_INTERVAL、不限時；scalp 用 1m + TIME_STOP_SEC。
+    """
+    _need_numpy()
+    t0 = time.perf_counter()
+    interval = interval or default_interval(strategy)
+    if time_stop_bars is None:
+        time_stop_bars = default_time_stop(strategy, _interval_seconds(interval))
+    symbols = symbols or list_symbols(root, interval)
+    p = params or default_params()
+    jobs = [(s, root, interval, p, start_ts, end_ts, time_stop_bars, strategy) for s in symbols]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_run_one, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [_run_one(j) for j in jobs]
+    raw = [t for trades, _ in results for t in trades]
+    trades = portfolio(raw, equity, independent)
+    summary = summarize(trades)
+    summary.update(symbols=len(symbols), bars=sum(n for _, n in results), signals=len(raw),
+                   wall_s=time.perf_counter() - t0)
+    return trades, summary
+
+def default_interval(strategy: str) -> str:
+    return INTERVAL if strategy == "volume" else getattr(config, "SCALP_TIMEFRAME", "1m")
+
+def _parse_set(items: List[str]) -> dict:
+    out = {}
+    for it in items or []:
+        k, _, v = it.partition("=")
+        out[k.strip()] = float(v)
+    return out
+
+def _day_ts(s: Optional[str]) -> Optional[float]:
+    return datetime.strptime(s, "%Y-%m-%d").timestamp() if s else None
+
+def main():
+    ap = argparse.ArgumentParser(description="Vectorized backtest of the volume breakout/breakdown strategies")
+    ap.add_argument("--root", default=DATA_DIR, help="K 線目錄（底下是 <interval>/*.csv）")
+    ap.add_argument("--strategy", default="volume", choices=STRATEGIES)
+    ap.add_argument("--interval", default=None, help="預設 volume 用 KLINE_INTERVAL、scalp 用 SCALP_TIMEFRAME")
+    ap.add_argument("--symbols", default=None, help="逗號分隔；預設目錄下全部")
+    ap.add_argument("--start", default=None, help="YYYY-MM-DD（含）")
+    ap.add_argument("--end", default=None, help="YYYY-MM-DD（不含）")
+    ap.add_argument("--out", default="backtest_journal.csv", help="成交紀錄（journal.csv 格式）")
+    ap.add_argument("--equity", type=float, default=float(os.getenv("EQUITY_USDT", "10000")))
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--time-stop-bars", type=int, default=None,
+                    help="持倉超過 N 根以收盤價出場（0 = 不限；預設 scalp 依 TIME_STOP_SEC、volume 不限）")
+    ap.add_argument("--independent", action="store_true", help="每檔各自獨立（不套單一持倉/日停機）")
+    ap.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="覆寫參數，例 HH_N=48")
+    args = ap.parse_args()
+
+    _need_numpy()
+    symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()] if args.symbols else None
+    params = default_params(**_parse_set(args.set))
+    trades, res = run(symbols, args.root, args.interval, params, args.workers, _day_ts(args.start),
+                      _day_ts(args.end), args.time_stop_bars, args.equity, args.independent, args.strategy)
+    write_journal(trades, args.out)
+    print(f"symbols={res['symbols']} bars={res['bars']:,} signals={res['signals']} trades={res['trades']} "
+          f"win={res['win_rate'] * 100:.1f}% {res['by_reason']}")
+    print(f"PnL {res['pnl_pct'] * 100:+.2f}%  maxDD {res['max_dd_pct'] * 100:.2f}%  "
+          f"in {res['wall_s']:.2f}s → {args.out}")
+
+if __name__ == "__main__":
+    main()
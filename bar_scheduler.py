@@ -0,0 +1,184 @@
+# bar_scheduler.py
+# 收盤觸發的策略評估：訊號只看已收盤 bar，所以只有「某 symbol 的 bar 剛收盤」才需要重算。
+# - ws_client 的 kline 收盤事件（k.x=True）→ on_bar_close(symbol, interval, ts)
+# - 只跑「週期相符、且 symbol 在該策略 universe 內」的策略；其他 symbol 完全不花成本
+# - 評估丟到 scan_eval 的執行緒池（REST 補 K 線不擋事件核心），通過者進 ready 佇列
+# - 每個策略記錄評估次數、通過次數、延遲（p50/p99）
+# - ready 的訊號有各自的 TTL（1m scalp 只留幾秒，價格會跑掉）；symbol 離開 universe 就丟掉
+# - 有 batch 函式的策略：同一個收盤 tick 的 symbol 先收集 BAR_BATCH_WINDOW_S，再整批評估一次
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import config
+from scan_eval import submit
+
+READY_TTL_S = float(getattr(config, "BAR_READY_TTL_S", 30.0))   # 通過的訊號多久沒被取用就作廢（register 沒給 ttl_s 時）
+BATCH_WINDOW_S = float(getattr(config, "BAR_BATCH_WINDOW_S", 0.25))  # 批次策略：第一根收盤後等多久把同一 tick 的收齊
+_LAT_SAMPLES = 256
+
+class _Strategy:
+    __slots__ = ("name", "interval", "fn", "batch", "pending", "order", "ttl", "universe",
+                 "evals", "passed", "errors", "ticks", "lat")
+
+    def __init__(self, name: str, interval: str, fn: Callable, order: int, ttl: float,
+                 batch: Optional[Callable] = None):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.batch = batch
+        self.pending: Dict[str, None] = {}       # 批次策略：這個 tick 已收盤、等著整批評估的 symbol
+        self.order = order
+        self.ttl = ttl
+        self.universe: Dict[str, tuple] = {}     # symbol -> (rank, key)
+        self.evals = 0
+        self.passed = 0
+        self.errors = 0
+        self.ticks = 0                           # 批次評估次數（每個收盤 tick 一次）
+        self.lat = deque(maxlen=_LAT_SAMPLES)
+
+class BarCloseScheduler:
+    def __init__(self, on_ready: Optional[Callable[[], None]] = None):
+        self._lock = threading.Lock()
+        self._strats: List[_Strategy] = []
+        self._ready: Dict[tuple, tuple] = {}     # (name, symbol) -> (order, rank, key, result, 到期時間)
+        self._on_ready = on_ready
+
+    def register(self, name: str, interval: str, fn: Callable[[str], object], ttl_s: Optional[float] = None,
+                 batch: Optional[Callable[[List[str]], Dict[str, object]]] = None):
+        """
+        fn(symbol) 回傳 bool 或帶 .ok 的訊號物件；註冊順序即優先順序。ttl_s：通過後多久沒取用就作廢。
+        batch(symbols) → {symbol: 訊號}（只需含通過者）：有給就改成每個收盤 tick 整批評估一次，fn 不再逐檔呼叫。
+        """
+        ttl = READY_TTL_S if ttl_s is None else float(ttl_s)
+        with self._lock:
+            self._strats.append(_Strategy(name, interval, fn, len(self._strats), ttl, batch))
+
+    def set_universe(self, name: str, items):
+        """items: [(symbol, key), ...] 依排名排列；key 會原樣交回給取用端。離開 universe 的 ready 訊號一併丟掉"""
+        with self._lock:
+            for st in self._strats:
+                if st.name == name:
+                    st.universe = {s: (i, key) for i, (s, key) in enumerate(items)}
+                    for k in [k for k in self._ready if k[0] == name and k[1] not in st.universe]:
+                        del self._ready[k]
+
+    def intervals(self) -> set:
+        with self._lock:
+            return {st.interval for st in self._strats}
+
+    def on_bar_close(self, symbol: str, interval: str, ts: float = None):
+        """收盤事件進來：只把相符的 (策略, symbol) 送進執行緒池；批次策略先收進這個 tick 的待評估清單"""
+        todo, flush = [], []
+        with self._lock:
+            for st in self._strats:
+                if st.interval != interval or symbol not in st.universe:
+                    continue
+                if st.batch is None:
+                    todo.append(st)
+                elif symbol not in st.pending:
+                    st.pending[symbol] = None
+                    if len(st.pending) == 1:             # 這個 tick 的第一根：排一次整批評估
+                        flush.append(st)
+        for st in todo:
+            submit(self._run, st, symbol)
+        for st in flush:
+            t = threading.Timer(BATCH_WINDOW_S, submit, args=(self._run_batch, st))
+            t.daemon = True
+            t.start()
+
+    def _run(self, st: _Strategy, symbol: str):
+        t0 = time.perf_counter()
+        try:
+            res = st.fn(symbol)
+        except Exception:
+            res = None
+            with self._lock:
+                st.errors += 1
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            st.evals += 1
+            st.lat.append(ms)
+            ok = self._accept(st, symbol, res)
+        if ok:
+            self._notify()
+
+    def _run_batch(self, st: _Strategy):
+        """同一個收盤 tick 收齊的 symbol 依排名一次丟給 st.batch"""
+        with self._lock:
+            syms = sorted(st.pending, key=lambda s: st.universe.get(s, (len(st.universe), None))[0])
+            st.pending.clear()
+        if not syms:
+            return
+        t0 = time.perf_counter()
+        try:
+            out = st.batch(syms) or {}
+        except Exception:
+            out = {}
+            with self._lock:
+                st.errors += 1
+        ms = (time.perf_counter() - t0) * 1000.0
+        any_ok = False
+        with self._lock:
+            st.evals += len(syms)
+            st.ticks += 1
+            st.lat.append(ms)
+            for s in syms:
+                any_ok |= self._accept(st, s, out.get(s))
+        if any_ok:
+            self._notify()
+
+    def _accept(self, st: _Strategy, symbol: str, res) -> bool:
+        """（持鎖呼叫）通過且仍在 universe 內就放進 ready；回傳是否收下"""
+        if res is None or not bool(getattr(res, "ok", res)):
+            return False
+        got = st.universe.get(symbol)
+        if got is None:                              # 評估期間離開 universe 的不收
+            return False
+        st.passed += 1
+        rank, key = got
+        self._ready[(st.name, symbol)] = (st.order, rank, key, res, time.time() + st.ttl)
+        return True
+
+    def _notify(self):
+        if self._on_ready is not None:
+            try:
+                self._on_ready()
+            except Exception:
+                pass
+
+    def take_ready(self) -> List[tuple]:
+        """
+        取出目前通過的訊號，依（策略順序, 排名）排序：[(name, symbol, key, result), ...]
+        過期的直接丟掉；取出後即清空。
+        """
+        now = time.time()
+        with self._lock:
+            items = [(o, r, name, sym, key, res) for (name, sym), (o, r, key, res, exp) in self._ready.items()
+                     if now <= exp]
+            self._ready.clear()
+        items.sort(key=lambda x: (x[0], x[1]))
+        return [(name, sym, key, res) for _, _, name, sym, key, res in items]
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        每個策略：{interval, universe, evals, passed, errors, ticks, p50_ms, p99_ms}
+        批次策略的延遲是每個 tick 整批一次的時間，ticks 為批次次數（逐檔策略為 0）
+        """
+        out = {}
+        with self._lock:
+            for st in self._strats:
+                vals = sorted(st.lat)
+                out[st.name] = {
+                    "interval": st.interval,
+                    "universe": len(st.universe),
+                    "evals": st.evals,
+                    "passed": st.passed,
+                    "errors": st.errors,
+                    "ticks": st.ticks,
+                    "p50_ms": vals[len(vals) // 2] if vals else None,
+                    "p99_ms": vals[min(len(vals) - 1, int(len(vals) * 0.99))] if vals else None,
+                }
+        return out
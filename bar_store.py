@@ -0,0 +1,157 @@
+# bar_store.py
+# 每個 symbol 一組「欄位式」環形緩衝：o/h/l/c/v/ts 各一條預先配置的 array('d')。
+# 緩衝長度是 2×(cap+1)（鏡像寫入），所以「最近 n 根」永遠是一段連續記憶體，
+# 讀取端直接拿 memoryview（零拷貝），不用每次組 list。
+# 多配的那一格永遠是「下一根要寫的位置」，不在任何視圖裡：視圖取得後再 append 一根也不會被改到。
+# 每個 symbol 固定占用 6 × 2 × (cap+1) × 8 bytes（cap=200 約 19 KB）。
+
+import threading
+from array import array
+from typing import Dict, Optional
+
+FIELDS = ("o", "h", "l", "c", "v", "ts")
+_IDX = {f: i for i, f in enumerate(FIELDS)}
+
+class BarView:
+    """
+    某一刻最近 n 根的零拷貝視圖。
+    - o/h/l/c/v/ts 是 memoryview('d')，可索引、切片、sum/max/min
+    - ver 是取視圖時的版本；ring.changed_since(ver) 可判斷之後是否有新 bar
+    穩定性：取得後再 append 一根（下一根 1m bar 收盤前）都不會改到這段記憶體，同 ts 覆寫也不會
+    （值不同時換一組陣列）；第二根 append 起最舊的幾根會被覆寫。
+    要跨過 bar 收盤保留資料的呼叫端請自行 copy（tuples() / list()）。
+    """
+    __slots__ = ("o", "h", "l", "c", "v", "ts", "ver")
+
+    def __init__(self, cols, start: int, end: int, ver: int):
+        self.o, self.h, self.l, self.c, self.v, self.ts = (
+            memoryview(col)[start:end] for col in cols
+        )
+        self.ver = ver
+
+    def __len__(self):
+        return len(self.c)
+
+    def columns(self):
+        """(closes, highs, lows, vols)，與 utils.fetch_klines 回傳順序相同"""
+        return self.c, self.h, self.l, self.v
+
+    def tuples(self):
+        """轉回 (o,h,l,c,v,ts) tuple 列表（會複製，給舊介面用）"""
+        return list(zip(self.o, self.h, self.l, self.c, self.v, self.ts))
+
+class BarRing:
+    """
+    單一 symbol 的環形緩衝；寫入端需自行序列化（ws_client 以 per-symbol 分段鎖寫）。
+    讀取端不加鎖：(陣列, head, 根數, 版本) 收在一個 tuple（_pub），寫完資料才整個換掉，
+    所以 view() 拿到的一定是一致的那一刻。
+    """
+    __slots__ = ("cap", "_size", "_pub")
+
+    def __init__(self, cap: int = 200):
+        self.cap = max(2, int(cap))
+        self._size = self.cap + 1           # 實際格數：多一格給下一根寫入
+        # (cols, head, n, ver)：head = 下一根要寫入的位置（0..size-1），n = 目前根數（≤ cap），ver 每次寫入 +1
+        self._pub = (self._alloc(), 0, 0, 0)
+
+    def _alloc(self):
+        return tuple(array("d", bytes(16 * self._size)) for _ in FIELDS)
+
+    def __len__(self):
+        return self._pub[2]
+
+    @property
+    def ver(self) -> int:
+        return self._pub[3]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(col.itemsize * len(col) for col in self._pub[0])
+
+    def last_ts(self) -> Optional[float]:
+        cols, head, n, _ = self._pub
+        if n == 0:
+            return None
+        return cols[5][head - 1 + self._size]
+
+    def append(self, o: float, h: float, l: float, c: float, v: float, ts: float) -> bool:
+        """
+        依收盤時間 ts 寫入一根：
+        - ts 與最後一根相同 → 覆寫（REST 補過的 bar 再由 WS 送來）；值都一樣就不寫，
+          不一樣就複製一組新陣列再改（很少發生），已發出的視圖不會被原地改掉
+        - ts 比最後一根舊 → 忽略
+        新 bar 寫在多出來的那一格（讀取端還看不到），最後才換 _pub。回傳是否有寫入。
+        """
+        cols, head, n, ver = self._pub
+        size = self._size
+        vals = (o, h, l, c, v, ts)
+        last = cols[5][head - 1 + size] if n else None
+        if last is not None and ts <= last:
+            if ts < last:
+                return False
+            pos = (head - 1) % size         # 覆寫最後一根
+            if all(col[pos] == val for col, val in zip(cols, vals)):
+                return False
+            cols = tuple(array("d", col) for col in cols)
+        else:
+            pos = head
+            head = (head + 1) % size
+            if n < self.cap:
+                n += 1
+        mirror = pos + size
+        for col, val in zip(cols, vals):
+            col[pos] = val
+            col[mirror] = val
+        self._pub = (cols, head, n, ver + 1)
+        return True
+
+    def view(self, n: Optional[int] = None) -> BarView:
+        """最近 n 根（不足就給全部）的零拷貝視圖"""
+        cols, head, cnt, ver = self._pub
+        n = cnt if n is None else max(0, min(int(n), cnt))
+        end = head + self._size
+        return BarView(cols, end - n, end, ver)
+
+    def changed_since(self, ver: int) -> bool:
+        return self._pub[3] != ver
+
+    def reset(self, bars):
+        """
+        以一批已排序的 (o,h,l,c,v,ts) 重建（REST 補洞用）。
+        換一組新陣列再寫，舊的視圖仍指向舊陣列，不會讀到寫到一半的資料。
+        """
+        cols = self._alloc()
+        bars = list(bars)[-self.cap:]
+        for i, b in enumerate(bars):
+            for col, val in zip(cols, b[:6]):
+                col[i] = val
+                col[i + self._size] = val
+        n = len(bars)
+        self._pub = (cols, n % self._size, n, self._pub[3] + 1)
+
+class BarStore:
+    """symbol -> BarRing；建立時加鎖，個別 ring 的寫入由呼叫端序列化"""
+
+    def __init__(self, cap: int = 200):
+        self.cap = max(2, int(cap))
+        self._rings: Dict[str, BarRing] = {}
+        self._lock = threading.Lock()
+
+    def ring(self, symbol: str) -> BarRing:
+        r = self._rings.get(symbol)
+        if r is None:
+            with self._lock:
+                r = self._rings.setdefault(symbol, BarRing(self.cap))
+        return r
+
+    def get(self, symbol: str) -> Optional[BarRing]:
+        return self._rings.get(symbol)
+
+    def stats(self) -> dict:
+        """{symbols, cap, bytes}：bytes = 全部 ring 的固定配置大小"""
+        rings = list(self._rings.values())
+        return {
+            "symbols": len(rings),
+            "cap": self.cap,
+            "bytes": sum(r.nbytes for r in rings),
+        }
@@ -0,0 +1,116 @@
+# batch_signals.py
+# 整個 universe 一次算：輸入 N 個 symbol × T 根的 OHLCV 矩陣，用 NumPy 向量化
+# 算出 1m scalp 的每個條件（前高/前低突破、VWAP 距離、z-score），
+# 回傳通過遮罩 + 各條件的布林陣列（reasons）。
+# bar_scheduler 每個收盤 tick 把剛收盤的 symbol 整批丟進來算一次，
+# 所以 universe 從 40 擴到數百檔，計算時間幾乎不隨 N 線性成長。
+#
+# 條件與 signals/ 的 scalp 訊號一致。量價突破/跌破不在這裡：它的 EMA/VWAP 來自
+# indicators 引擎的完整歷史（截短視窗重算會不一致），且 armed → 回測是逐檔狀態機，
+# 由 signal_core 以共用特徵快取逐檔推進。
+# NumPy 是選配：沒裝時 available() 為 False，呼叫端維持逐檔評估。
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import config
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 選配依賴
+    np = None
+
+def available() -> bool:
+    return np is not None
+
+def _need_numpy():
+    if np is None:
+        raise RuntimeError("batch_signals 需要 numpy（pip install numpy）")
+
+@dataclass
+class BatchResult:
+    symbols: List[str]
+    mask: "np.ndarray"                                  # (N,) 全部條件通過
+    reasons: Dict[str, "np.ndarray"] = field(default_factory=dict)   # 條件名 -> (N,) bool
+    side: Optional["np.ndarray"] = None                 # scalp：每檔方向（"LONG"/"SHORT"/""）
+    values: Dict[str, "np.ndarray"] = field(default_factory=dict)    # 中間值（vwap、z…）方便除錯
+
+    def passing(self) -> List[str]:
+        """通過的 symbol，維持輸入順序（= 排名順序）"""
+        return [s for s, ok in zip(self.symbols, self.mask) if ok]
+
+    def failed(self, i: int) -> List[str]:
+        """第 i 檔沒通過的條件名"""
+        return [name for name, arr in self.reasons.items() if not arr[i]]
+
+# ---------- 組矩陣 ----------
+def stack(symbols: Sequence[str], columns: Sequence, min_bars: int):
+    """
+    把逐檔的 (closes, highs, lows, vols) 疊成 (N, T) 矩陣；T = 所有檔可用根數的最小值（取尾端對齊）。
+    根數不足 min_bars 或資料為 None 的檔會被剔除。
+    回傳 (symbols, C, H, L, V)；沒有可用資料時回 None。
+    """
+    _need_numpy()
+    keep, cols = [], []
+    for s, c in zip(symbols, columns):
+        if c is None or len(c[0]) < min_bars:
+            continue
+        keep.append(s)
+        cols.append(c)
+    if not keep:
+        return None
+    T = min(len(c[0]) for c in cols)
+    C = np.array([np.asarray(c[0], dtype=float)[-T:] for c in cols])
+    H = np.array([np.asarray(c[1], dtype=float)[-T:] for c in cols])
+    L = np.array([np.asarray(c[2], dtype=float)[-T:] for c in cols])
+    V = np.array([np.asarray(c[3], dtype=float)[-T:] for c in cols])
+    return keep, C, H, L, V
+
+# ---------- 向量化小工具（沿 axis=1 = 時間） ----------
+def _vwap(C, V):
+    sv = V.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(sv > 0, (C * V).sum(axis=1) / np.where(sv > 0, sv, 1.0), C[:, -1])
+
+# ---------- 1m scalp ----------
+def scalp_batch(symbols: Sequence[str], C, H, L, V, mode: str = "breakout") -> BatchResult:
+    """
+    C/H/L/V: (N, T) 已收盤 1m bar。
+    mode="breakout" 對應 scalp_breakout_signal，"vwap" 對應 scalp_vwap_signal。
+    side 陣列給出每檔方向（沒通過為 ""）。
+    """
+    _need_numpy()
+    N, T = C.shape
+    reasons: Dict[str, "np.ndarray"] = {"bars": np.full(N, T >= 25)}
+    side = np.full(N, "", dtype=object)
+    if T < 25:
+        return BatchResult(list(symbols), np.zeros(N, dtype=bool), reasons, side)
+
+    last = C[:, -1]
+    vw = _vwap(C[:, -21:], V[:, -21:])
+    values = {"vwap": vw}
+    if mode == "breakout":
+        vwap_max = float(getattr(config, "VWAP_DIST_MAX", 0.004))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reasons["vwap_dist"] = ~((vw > 0) & (np.abs(last - vw) / np.where(vw > 0, vw, 1.0) > vwap_max))
+        up = last >= H[:, -21:-1].max(axis=1)
+        dn = last <= L[:, -21:-1].min(axis=1)
+    else:
+        zthr = float(getattr(config, "SCALP_Z_THR", 1.0))
+        seg = C[:, -21:]
+        sd = seg.std(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(sd > 0, (seg[:, -1] - seg.mean(axis=1)) / np.where(sd > 0, sd, 1.0), np.nan)
+        reasons["z"] = ~np.isnan(z)
+        up = z <= -zthr
+        dn = z >= zthr
+        values["z"] = z
+    reasons["trigger"] = up | dn
+    side[up] = "LONG"
+    side[dn & ~up] = "SHORT"
+
+    mask = np.ones(N, dtype=bool)
+    for arr in reasons.values():
+        mask &= arr
+    side[~mask] = ""
+    return BatchResult(list(symbols), mask, reasons, side, values)
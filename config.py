@@ -32,6 +32,38 @@ BINANCE_FUTURES_BASE = "https://fapi.binance.com"  # USDT 永續
 USE_TESTNET = False
 ORDER_TIMEOUT_SEC = 90
 USE_WEBSOCKET = True
+TICKER_SNAPSHOT_TTL_S = 1.0  # 24hr ticker 快照有效秒數（同一窗口內漲跌榜共用一次下載）
+RANKING_WS_MAX_AGE_S = 5.0   # 全市場 ticker WS 超過此秒數沒更新就退回 REST
+RANKING_WS_WARMUP_S  = 3.0   # WS 連上後先收幾秒，確保排行涵蓋全市場
+WS_MAX_STREAMS_PER_CONN = 200 # 每條 WS 連線最多訂閱的 stream 數，超過自動分片
+WS_JSON_BACKEND = "auto"     # WS 訊息解碼後端：auto / orjson / msgspec / json（沒裝則自動退回 json）
+WS_INGEST_MODE = "thread"    # thread：WS 在背景執行緒解析；process：子行程收/解析，經 shared memory 發布狀態
+WS_INGEST_SLOTS = 128        # process 模式可同時發布的 symbol 數（shared memory 大小固定）
+WS_INGEST_FLOW_S = 0.5       # process 模式：子行程多久重算一次主動買賣量窗口（沒成交時也要衰減到 0）
+WS_LOCK_STRIPES = 16         # ws_client per-symbol 快取的分段鎖數（寫入端用；讀取端不加鎖）
+RECORD_TICKS = False         # 錄製 per-symbol WS 事件（aggTrade/depth/ticker/已收盤 K 線）到 RECORD_DIR
+RECORD_DIR = "data/ticks"    # 錄製目錄：<日期>/<SYMBOL>/<種類>.bin + .idx
+RECORD_CHUNK = 4096          # 每個壓縮 chunk 的紀錄數
+RECORD_FLUSH_S = 5.0         # 未滿的 chunk 最久幾秒寫一次
+BACKTEST_DIR = "data/klines"  # 回測用本機 K 線：<目錄>/<interval>/<SYMBOL>-5m-YYYY-MM.csv（data.binance.vision 格式）
+KLINE_STORE = True           # fetch_klines / fetch_kline_rows 經本機 mmap K 線庫：只抓最後收盤之後的 bar，重啟免重抓
+KLINE_STORE_DIR = "data/kline_store"  # <目錄>/<interval>/<SYMBOL>.bin
+KLINE_STORE_CAP = 1500       # 每個 symbol × 週期保留的已收盤 bar 數（檔案固定 cap × 48 bytes）
+MARK_WS_MAX_AGE_S    = 3.0   # mark price WS 超過此秒數沒更新，TP/SL 監控退回 REST premiumIndex
+SCAN_MAX_WORKERS     = 8     # 候選並行評估的執行緒上限
+SCAN_EVAL_TIMEOUT_S  = 10.0  # 單次 scan 等候選結果的總時限
+REST_POOL_SIZE       = 16    # REST keep-alive 連線池大小（同時在飛的請求上限）
+REST_WEIGHT_LIMIT_1M = 2400  # 幣安 IP weight / 分鐘
+REST_ORDER_LIMIT_10S = 300   # 下單數 / 10 秒
+REST_ORDER_LIMIT_1M  = 1200  # 下單數 / 分鐘
+REST_WEIGHT_RESERVE  = 0.25  # 保留給下單/帳戶的 weight 比例（行情輪詢用不到）
+REST_MARKET_MAX_WAIT_S = 5.0 # 行情請求等額度的上限，超過直接放棄這次
+USE_USER_STREAM      = True  # 實盤用 listenKey 串流接成交/倉位事件（取代輪詢）
+USER_STREAM_KEEPALIVE_S = 1800  # listenKey 續命間隔（幣安 60 分鐘過期）
+CLOSE_FILL_WAIT_S    = 1.0   # 串流看到倉位歸零後，最多等平倉成交回報幾秒（等不到改查 userTrades）
+POSITION_POLL_S      = 0.8   # 持倉檢查的 REST 備援輪詢間隔（平時由 WS 觸價/成交事件觸發）
+BALANCE_REFRESH_S    = 60.0  # 實盤餘額定期刷新
+LATENCY_BUDGET_MS    = 250.0 # 事件→決策延遲預算，超過會計入 over_budget
 
 # === Breakout Pullback — 強化參數 ===
 RETEST_BUFFER_PCT = 0.001
@@ -66,6 +98,19 @@ VWAP_DIST_MAX = 0.01         # (調整) 價格與VWAP距離限制 1%
 SPREAD_MAX_PCT = 0.0010      # (調整) 0.10%
 OBI_THRESHOLD = 0.65
 TRADE_IMB_LOOKBACK_S = 15
+TRADE_FLOW_BUCKET_S = 1.0      # 主動買賣量滾動視窗的時間桶寬（秒）
+TRADE_FLOW_HORIZON_S = 120     # 可查詢的最長窗口（秒）
+K1M_RING_CAP = 200             # 每個 symbol 保留的 1m bar 根數（欄位式環形緩衝，記憶體固定）
+IND_ATR_N = 14                 # 增量指標：ATR 視窗（根）
+IND_Z_N = 21                   # 增量指標：z-score 視窗（根）
+IND_VWAP_N_1M = 21             # 增量指標：1m 滾動 VWAP 視窗（5m 用 KLINE_LIMIT）
+BATCH_SCAN = True              # 有 numpy 時 scalp 候選整批向量化評估（收盤觸發模式：每個 1m 收盤 tick 一次；沒裝自動退回逐檔）
+SCAN_UNIVERSE_N = 50           # 漲/跌幅榜各取幾檔當候選（批次評估可放大到數百；WS 訂閱數隨之增加）
+BAR_BATCH_WINDOW_S = 0.25      # 批次評估：第一根 1m 收盤後等多久，把同一 tick 其他 symbol 的收盤收齊再算
+BAR_CLOSE_EVAL = True          # (需 USE_WEBSOCKET) 策略只在該 symbol 的 K 線收盤時評估；False 則回到每輪掃描全評估
+BAR_READY_TTL_S = 30.0         # 收盤時通過的訊號多久沒被下單流程取用就作廢
+BAR_READY_TTL_SCALP_S = 3.0    # 1m scalp 訊號的 TTL（進場價是收盤價，放久了就失真）
+SIGNAL_STATE_TTL_S = 1800      # 量價訊號的 armed/回測狀態與特徵快取：多久沒被評估（離開候選）就清掉
 MAKER_ENTRY = True
 TAKER_EXIT = True
 SLIPPAGE_CAP_PCT = 0.0007
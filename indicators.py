@@ -0,0 +1,222 @@
+# indicators.py
+# 增量指標引擎：每個 (symbol, interval) 一份狀態，bar 收盤時 O(1) 更新
+# EMA / EMA 斜率 / 滾動 VWAP / ATR（滾動 true range）/ z-score（滾動和與平方和）。
+# 訊號只讀目前值，不再每次從整段歷史重算。
+#
+# 「live」bar：5m 訊號用的是含未收盤那根的序列（最後一根 = 現價），
+# 所以可以另外掛一根 live bar，讀值時以「已收盤狀態 + 這一根」臨時推一步（不寫回狀態）。
+
+import math
+import threading
+from typing import Dict, Optional, Sequence
+
+import config
+
+EMA_FAST = int(getattr(config, "EMA_FAST", 20))
+EMA_SLOW = int(getattr(config, "EMA_SLOW", 50))
+EMA_SLOPE_N = int(getattr(config, "EMA_SLOPE_N", 50))
+ATR_N = int(getattr(config, "IND_ATR_N", 14))
+Z_N = int(getattr(config, "IND_Z_N", 21))
+VWAP_N_1M = int(getattr(config, "IND_VWAP_N_1M", 21))
+VWAP_N = int(getattr(config, "KLINE_LIMIT", 120))
+
+class _Rolling:
+    """固定長度視窗的 running sum（環形陣列）；每 n 次推入重算一次總和，避免浮點累積誤差"""
+    __slots__ = ("n", "buf", "i", "cnt", "sum", "_since")
+
+    def __init__(self, n: int):
+        self.n = max(1, int(n))
+        self.buf = [0.0] * self.n
+        self.i = 0
+        self.cnt = 0
+        self.sum = 0.0
+        self._since = 0
+
+    def push(self, x: float):
+        if self.cnt == self.n:
+            self.sum -= self.buf[self.i]
+        else:
+            self.cnt += 1
+        self.buf[self.i] = x
+        self.sum += x
+        self.i = (self.i + 1) % self.n
+        self._since += 1
+        if self._since >= self.n:
+            self._since = 0
+            self.sum = math.fsum(self.buf[:self.cnt]) if self.cnt < self.n else math.fsum(self.buf)
+
+    def peek(self, x: float):
+        """假設再推入 x 後的 (sum, cnt)，不改狀態"""
+        if self.cnt == self.n:
+            return self.sum - self.buf[self.i] + x, self.cnt
+        return self.sum + x, self.cnt + 1
+
+class IndicatorState:
+    """單一 (symbol, interval) 的指標狀態；bar 以收盤時間 ts 去重"""
+
+    def __init__(self, ema_periods: Sequence[int], atr_n: int, vwap_n: int, z_n: int):
+        self.periods = tuple(sorted(set(int(n) for n in ema_periods)))
+        self.ema: Dict[int, Optional[float]] = {n: None for n in self.periods}
+        self.ema_prev: Dict[int, Optional[float]] = {n: None for n in self.periods}
+        self.tr = _Rolling(atr_n)
+        self.pv = _Rolling(vwap_n)
+        self.vv = _Rolling(vwap_n)
+        self.zs = _Rolling(z_n)
+        self.zq = _Rolling(z_n)
+        self.shift = None          # z-score 以第一根收盤做平移，降低平方和的數值誤差
+        self.prev_close = None
+        self.last_ts = None
+        self.count = 0
+        self.live = None           # (o,h,l,c,v,ts)：尚未收盤的那根
+
+    def update(self, o: float, h: float, l: float, c: float, v: float, ts: float) -> bool:
+        if self.last_ts is not None and ts <= self.last_ts:
+            return False
+        if self.prev_close is not None:
+            pc = self.prev_close
+            self.tr.push(max(h - l, abs(h - pc), abs(l - pc)))
+        for n in self.periods:
+            e = self.ema[n]
+            self.ema_prev[n] = e
+            k = 2.0 / (n + 1.0)
+            self.ema[n] = c if e is None else k * c + (1.0 - k) * e
+        self.pv.push(c * v)
+        self.vv.push(v)
+        if self.shift is None:
+            self.shift = c
+        d = c - self.shift
+        self.zs.push(d)
+        self.zq.push(d * d)
+        self.prev_close = c
+        self.last_ts = ts
+        self.count += 1
+        return True
+
+    def values(self, use_live: bool = True) -> dict:
+        """
+        目前值：ema{n}、ema_slope{n}、atr、vwap、z、close、bars。
+        有 live bar（ts 晚於最後收盤）且 use_live 時，以它臨時推一步；否則只看已收盤 bar。
+        """
+        live = self.live if use_live else None
+        if live is not None and (self.last_ts is None or live[5] <= self.last_ts):
+            live = None
+        if live is None and self.count == 0:
+            return {}
+
+        out = {"bars": self.count + (1 if live else 0)}
+        if live is None:
+            c = self.prev_close
+            for n in self.periods:
+                e, ep = self.ema[n], self.ema_prev[n]
+                out[f"ema{n}"] = e if self.count >= n else None
+                out[f"ema_slope{n}"] = (e - ep) if (self.count >= n + 2 and ep is not None) else 0.0
+            atr = (self.tr.sum / self.tr.cnt) if self.tr.cnt else 0.0
+            pv, vv = self.pv.sum, self.vv.sum
+            zs, zn = self.zs.sum, self.zs.cnt
+            zq = self.zq.sum
+        else:
+            _, h, l, c, v, _ = live
+            bars = self.count + 1
+            for n in self.periods:
+                e = self.ema[n]
+                k = 2.0 / (n + 1.0)
+                e_live = c if e is None else k * c + (1.0 - k) * e
+                out[f"ema{n}"] = e_live if bars >= n else None
+                out[f"ema_slope{n}"] = (e_live - e) if (bars >= n + 2 and e is not None) else 0.0
+            pc = self.prev_close
+            if pc is not None:
+                s, cnt = self.tr.peek(max(h - l, abs(h - pc), abs(l - pc)))
+                atr = s / cnt
+            else:
+                atr = 0.0
+            pv, _ = self.pv.peek(c * v)
+            vv, _ = self.vv.peek(v)
+            shift = c if self.shift is None else self.shift
+            d = c - shift
+            zs, zn = self.zs.peek(d)
+            zq, _ = self.zq.peek(d * d)
+
+        out["close"] = c
+        out["atr"] = atr
+        out["vwap"] = (pv / vv) if vv > 0 else c
+        z = None
+        if zn >= 2:
+            mean = zs / zn
+            var = zq / zn - mean * mean
+            if var > 1e-18:
+                shift = self.shift if self.shift is not None else c
+                z = ((c - shift) - mean) / math.sqrt(var)
+        out["z"] = z
+        return out
+
+class IndicatorEngine:
+    """(symbol, interval) -> IndicatorState；所有操作在同一把鎖內，都是 O(1)（sync 只補新 bar）"""
+
+    def __init__(self):
+        self._states: Dict[tuple, IndicatorState] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _new_state(interval: str) -> IndicatorState:
+        vwap_n = VWAP_N_1M if interval == "1m" else VWAP_N
+        return IndicatorState((EMA_FAST, EMA_SLOW, EMA_SLOPE_N), ATR_N, vwap_n, Z_N)
+
+    def _state(self, symbol: str, interval: str) -> IndicatorState:
+        key = (symbol.upper(), interval)
+        st = self._states.get(key)
+        if st is None:
+            st = self._states[key] = self._new_state(interval)
+        return st
+
+    def update(self, symbol: str, interval: str, bar) -> bool:
+        """推入一根已收盤 bar (o,h,l,c,v,ts)"""
+        with self._lock:
+            return self._state(symbol, interval).update(*bar[:6])
+
+    def last_ts(self, symbol: str, interval: str) -> Optional[float]:
+        st = self._states.get((symbol.upper(), interval))
+        return st.last_ts if st is not None else None
+
+    def sync(self, symbol: str, interval: str, bars):
+        """
+        以一段已收盤 bar（依時間排序）對齊狀態：
+        - 狀態的最後一根在這段裡 → 只推入之後的新 bar
+        - 這段整個比狀態新（中間斷檔）或狀態不存在 → 用這段重建
+        """
+        if not bars:
+            return
+        key = (symbol.upper(), interval)
+        with self._lock:
+            st = self._states.get(key)
+            if st is not None and st.last_ts is not None and bars[-1][5] <= st.last_ts:
+                return
+            if st is None or st.last_ts is None or bars[0][5] > st.last_ts:
+                live = st.live if st is not None else None
+                st = self._states[key] = self._new_state(interval)
+                st.live = live
+                for b in bars:
+                    st.update(*b[:6])
+                return
+            i = len(bars)
+            while i > 0 and bars[i - 1][5] > st.last_ts:
+                i -= 1
+            for b in bars[i:]:
+                st.update(*b[:6])
+
+    def set_live(self, symbol: str, interval: str, bar):
+        """掛上尚未收盤的那根（讀值時臨時推一步）；None 表示清掉"""
+        with self._lock:
+            self._state(symbol, interval).live = tuple(bar[:6]) if bar is not None else None
+
+    def values(self, symbol: str, interval: str, use_live: bool = True) -> dict:
+        """目前指標值；沒有資料回 {}。use_live=False 只看已收盤 bar"""
+        with self._lock:
+            st = self._states.get((symbol.upper(), interval))
+            return st.values(use_live) if st is not None else {}
+
+    def drop(self, symbol: str, interval: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._states if k[0] == symbol.upper() and (interval is None or k[1] == interval)]:
+                self._states.pop(key, None)
+
+ENGINE = IndicatorEngine()
@@ -11,6 +11,6 @@ def _ensure_file():
 def log_trade(symbol:str, side:str, qty:float, entry:float, exit_price:float, ret_pct:float, reason:str,mode=None):
     _ensure_file()
     with open(PATH, "a", newline="") as f:
-        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time()))
         row = [ts, symbol, side, f"{qty:.6g}", f"{entry:.10g}", f"{exit_price:.10g}", f"{ret_pct*100:.4f}", reason]
         csv.writer(f).writerow(row)
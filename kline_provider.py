@@ -0,0 +1,126 @@
+# kline_provider.py
+# 訊號用 K 線來源：1m 優先讀 ws_client 的已收盤快取，缺口才用一次 REST 補齊並併回快取。
+# 介面與 utils.fetch_klines 相同：get_klines(symbol, interval, limit) -> (closes, highs, lows, vols)
+# 1m 命中時回傳的是環形緩衝的 memoryview（零拷貝），可索引/切片/sum/max/min，但不是 list；
+# 在下一根 1m bar 收盤前內容不會變，要跨 bar 保留請自行 list() 複製。
+# 回傳前會把同一批 bar 對齊到 indicators.ENGINE，訊號直接讀 ENGINE.values(symbol, interval)。
+
+import time
+import threading
+
+import config
+from indicators import ENGINE
+import utils
+from utils import fetch_kline_rows
+from ws_client import k1m_view, merge_k1m
+
+_SLACK_S = float(getattr(config, "KLINE_WS_SLACK_S", 5.0))   # 最新 bar 允許晚到的秒數
+
+_REST_FALLBACK = True                                       # False：只用快取（重播/離線時不打 REST）
+
+_STATS = {"hit": 0, "miss": 0, "rest": 0}
+_STATS_LOCK = threading.Lock()
+
+def _count(key: str):
+    with _STATS_LOCK:
+        _STATS[key] += 1
+
+def _fresh(view, limit: int, step_s: float) -> bool:
+    """根數足夠、最新一根夠新、且中間沒有斷檔（ring 內 ts 遞增不重複，頭尾跨度即可判斷）"""
+    n = len(view)
+    if n < limit:
+        return False
+    ts = view.ts
+    if time.time() - ts[-1] > step_s + _SLACK_S:
+        return False
+    return abs((ts[-1] - ts[0]) - step_s * (n - 1)) <= 1.0
+
+def _split(rows):
+    """(o,h,l,c,v,ts) 列 → (closes, highs, lows, vols)"""
+    closes = [r[3] for r in rows]
+    highs  = [r[1] for r in rows]
+    lows   = [r[2] for r in rows]
+    vols   = [r[4] for r in rows]
+    return closes, highs, lows, vols
+
+def set_rest_fallback(enabled: bool):
+    """快取不夠時是否以 REST 補；關掉後 1m 直接回快取現有的、其他週期回空序列"""
+    global _REST_FALLBACK
+    _REST_FALLBACK = bool(enabled)
+
+def get_klines(symbol: str, interval: str, limit: int):
+    """
+    1m：WS 快取夠新就直接回（hit）；否則一次 REST 補齊、併回快取再回（miss）。
+    其他週期 WS 沒有快取，直接走 REST。
+    注意：回傳的都是已收盤 bar，最後一根是最近收盤的那根。
+    """
+    if interval != "1m":
+        _count("miss")
+        if not _REST_FALLBACK:
+            return [], [], [], []
+        _count("rest")
+        rows = fetch_kline_rows(symbol, interval, limit, closed_only=False)
+        now_s = (utils.now_ts_ms() + utils.TIME_OFFSET_MS) / 1000.0
+        live = rows[-1] if rows and rows[-1][5] >= now_s else None
+        ENGINE.sync(symbol, interval, rows[:-1] if live else rows)
+        ENGINE.set_live(symbol, interval, live)
+        return _split(rows)
+
+    view = k1m_view(symbol, limit)
+    if _fresh(view, limit, 60.0):
+        _count("hit")
+        if ENGINE.last_ts(symbol, "1m") != view.ts[-1]:
+            ENGINE.sync(symbol, "1m", view.tuples())
+        return view.columns()
+
+    _count("miss")
+    if not _REST_FALLBACK:
+        if ENGINE.last_ts(symbol, "1m") != (view.ts[-1] if len(view) else None):
+            ENGINE.sync(symbol, "1m", view.tuples())
+        return view.columns()
+    _count("rest")
+    rows = fetch_kline_rows(symbol, "1m", limit + 1)   # +1：最後一根未收盤會被丟掉
+    merge_k1m(symbol, rows)
+    view = k1m_view(symbol, limit)
+    ENGINE.sync(symbol, "1m", view.tuples())
+    return view.columns()
+
+def get_closed_klines(symbol: str, interval: str, limit: int):
+    """
+    只含已收盤 bar 的 (closes, highs, lows, vols, last_ts)；last_ts 是最後一根的收盤時間（秒）。
+    同樣會把 bar 對齊到 ENGINE，讀值請用 ENGINE.values(..., use_live=False)。
+    """
+    if interval == "1m":
+        closes, highs, lows, vols = get_klines(symbol, "1m", limit)
+        return closes, highs, lows, vols, ENGINE.last_ts(symbol, "1m")
+    _count("miss")
+    if not _REST_FALLBACK:
+        return [], [], [], [], None
+    _count("rest")
+    rows = fetch_kline_rows(symbol, interval, limit + 1, closed_only=True)
+    ENGINE.sync(symbol, interval, rows)
+    rows = rows[-limit:]
+    closes, highs, lows, vols = _split(rows)
+    return closes, highs, lows, vols, (rows[-1][5] if rows else None)
+
+def interval_seconds(interval: str) -> int:
+    """'1m' -> 60、'5m' -> 300、'1h' -> 3600 ..."""
+    unit = interval[-1]
+    mult = {"m": 60, "h": 3600, "d": 86400, "w": 604800}.get(unit, 60)
+    return int(interval[:-1] or 1) * mult
+
+def last_closed_ts(interval: str) -> float:
+    """依伺服器時間推算「目前最後一根已收盤 bar」的收盤時間（秒，與 K 線 close time 同基準）"""
+    step = interval_seconds(interval)
+    now_s = (utils.now_ts_ms() + utils.TIME_OFFSET_MS) / 1000.0
+    return (now_s // step) * step - 0.001
+
+def provider_stats() -> dict:
+    """回傳 {hit, miss, rest, hit_ratio, store}；store 是本機 K 線庫的統計（kline_store.stats）"""
+    with _STATS_LOCK:
+        st = dict(_STATS)
+    total = st["hit"] + st["miss"]
+    st["hit_ratio"] = (st["hit"] / total) if total else None
+    if utils.KLINE_STORE:
+        st["store"] = utils.kline_store.stats()
+    return st
@@ -0,0 +1,242 @@
+# kline_store.py
+# 本機 K 線庫：每個 (symbol, interval) 一個固定大小的 mmap 檔，只存已收盤 bar。
+# - utils.fetch_klines / fetch_kline_rows 經這裡取 K 線：只向 REST 要「最後一根已存收盤時間之後」的 bar
+#   （startTime），通常一次 1~2 根；最新一根已收盤 bar 已在庫裡且不需要未收盤那根時完全不打 REST
+# - 尾端直接從 mmap 複製成 array('d') 欄位回傳（120 根 ≈ 6 KB 的 memcpy），不再逐列 float() 解析
+# - 檔案在重啟後沿用：暖啟動只補停機期間的缺口；缺口比要求的根數還長、或接不上，就整段重抓
+# - 本模組不碰網路：抓取函式由呼叫端（utils）傳入 fetch(limit, start_ms=None) -> Binance 原始列
+# - 同一行程內以 per-(symbol, interval) 鎖序列化；不支援多個行程同時寫同一個檔
+#
+# 檔案格式（little-endian）：
+#   header 32 bytes：magic "KLS1", version, cap, n, step_ms
+#   之後 cap 筆紀錄，每筆 6 個 double：o, h, l, c, v, close_ts（秒，與 fetch_kline_rows 的 tuple 相同）
+#   滿了就一次丟掉最舊的 1/4（memmove），檔案大小固定
+
+import atexit
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+
+STORE_DIR = getattr(config, "KLINE_STORE_DIR", "data/kline_store")
+CAP = int(getattr(config, "KLINE_STORE_CAP", 1500))      # 每檔最多保留幾根
+MAX_REQ = 1500                                            # /fapi/v1/klines 單次上限
+
+_MAGIC = b"KLS1"
+_VERSION = 1
+_HDR = struct.Struct("<4sIIIq")           # magic, version, cap, n, step_ms
+_HDR_SIZE = 32
+_N_OFF = 12
+_REC = struct.Struct("<6d")
+
+def _step_ms(interval: str) -> int:
+    unit = {"m": 60, "h": 3600, "d": 86400, "w": 604800}.get(interval[-1], 60)
+    return int(interval[:-1] or 1) * unit * 1000
+
+class KlineFile:
+    """單一 (symbol, interval) 的 mmap 檔；呼叫端負責加鎖"""
+
+    def __init__(self, path: str, step_ms: int, cap: int = CAP):
+        self.path = path
+        self.step_ms = int(step_ms)
+        self.cap = max(4, int(cap))
+        size = _HDR_SIZE + self.cap * _REC.size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fresh = True
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, "rb") as f:
+                magic, ver, cap_, n, step = _HDR.unpack(f.read(_HDR.size))
+            fresh = not (magic == _MAGIC and ver == _VERSION and cap_ == self.cap
+                         and step == self.step_ms and n <= self.cap)
+        if fresh:
+            with open(path, "wb") as f:
+                f.write(_HDR.pack(_MAGIC, _VERSION, self.cap, 0, self.step_ms).ljust(_HDR_SIZE, b"\0"))
+                f.truncate(size)
+        self._f = open(path, "r+b")
+        self._mm = mmap.mmap(self._f.fileno(), size)
+
+    @property
+    def n(self) -> int:
+        return struct.unpack_from("<I", self._mm, _N_OFF)[0]
+
+    def _set_n(self, n: int):
+        struct.pack_into("<I", self._mm, _N_OFF, n)
+
+    @staticmethod
+    def _off(i: int) -> int:
+        return _HDR_SIZE + i * _REC.size
+
+    def last_ts(self) -> Optional[float]:
+        n = self.n
+        return _REC.unpack_from(self._mm, self._off(n - 1))[5] if n else None
+
+    def last_close_ms(self) -> Optional[int]:
+        ts = self.last_ts()
+        return int(round(ts * 1000)) if ts is not None else None
+
+    def append(self, rows) -> int:
+        """接在最後面（只收比最後一根新的 bar）；先寫資料、最後才改 n。回傳寫入根數"""
+        last = self.last_ts()
+        rows = [r for r in rows if last is None or r[5] > last + 1e-6]
+        if not rows:
+            return 0
+        rows = rows[-self.cap:]
+        k = len(rows)
+        n = self.n
+        if n + k > self.cap:
+            drop = min(n, max(n + k - self.cap, self.cap // 4))
+            self._mm.move(self._off(0), self._off(drop), (n - drop) * _REC.size)
+            n -= drop
+            self._set_n(n)
+        buf = b"".join(_REC.pack(*r[:6]) for r in rows)
+        self._mm[self._off(n):self._off(n) + len(buf)] = buf
+        self._set_n(n + k)
+        return k
+
+    def reset(self, rows) -> int:
+        self._set_n(0)
+        return self.append(rows)
+
+    def _tail(self, n: int) -> bytes:
+        total = self.n
+        n = max(0, min(int(n), total))
+        return self._mm[self._off(total - n):self._off(total)]
+
+    def rows(self, n: int) -> List[tuple]:
+        """最後 n 根 → [(o,h,l,c,v,ts)]"""
+        return list(_REC.iter_unpack(self._tail(n)))
+
+    def columns(self, n: int) -> Tuple[array, ...]:
+        """最後 n 根 → (o, h, l, c, v, ts) 六個 array('d')"""
+        a = array("d")
+        a.frombytes(self._tail(n))
+        return tuple(a[i::6] for i in range(6))
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        try:
+            self._mm.flush()
+            self._mm.close()
+        finally:
+            self._f.close()
+
+# ==== 全域：檔案表 + 同步 ====
+_FILES: Dict[tuple, Optional[KlineFile]] = {}
+_LOCKS: Dict[tuple, threading.Lock] = {}
+_LOCK = threading.Lock()
+_STATS = {"local": 0, "incr": 0, "full": 0, "rows": 0, "errors": 0}
+
+def _count(key: str, n: int = 1):
+    with _LOCK:
+        _STATS[key] += n
+
+def _entry(symbol: str, interval: str):
+    key = (symbol.upper(), interval)
+    with _LOCK:
+        lock = _LOCKS.get(key)
+        if lock is None:
+            lock = _LOCKS[key] = threading.Lock()
+            try:
+                _FILES[key] = KlineFile(os.path.join(STORE_DIR, interval, f"{key[0]}.bin"), _step_ms(interval))
+            except Exception:
+                _FILES[key] = None          # 開不了（唯讀磁碟等）→ 這個 key 之後都直接走 REST
+                _STATS["errors"] += 1
+        return _FILES.get(key), lock
+
+def _split(raw, now_ms: int):
+    """Binance 原始列 → (已收盤 tuple 列, 未收盤那根 or None)"""
+    closed, live = [], None
+    for k in raw:
+        row = (float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5]), int(k[6]) / 1000.0)
+        if int(k[6]) >= now_ms:
+            live = row
+        else:
+            closed.append(row)
+    return closed, live
+
+def _sync(f: KlineFile, need: int, want_live: bool, fetch: Callable, now_ms: int):
+    """把庫補到最新一根已收盤 bar；回傳未收盤那根（有抓到才有）"""
+    step = f.step_ms
+    last_closed = (now_ms // step) * step - 1          # 最近一根已收盤 bar 的 close time
+    last = f.last_close_ms()
+    if last is not None and f.n >= need and (last_closed - last) // step < need:
+        missing = max(0, (last_closed - last) // step)
+        if missing == 0 and not want_live:
+            _count("local")
+            return None
+        _count("incr")
+        closed, live = _split(fetch(missing + 1, last + 1), now_ms)
+        if not closed or abs(int(round(closed[0][5] * 1000)) - last - step) <= 1000:
+            f.append(closed)
+            _count("rows", len(closed) + (1 if live else 0))
+            return live
+        # 接不上（交易所補資料/時鐘跳動）→ 整段重抓
+    _count("full")
+    closed, live = _split(fetch(min(need + 1, MAX_REQ)), now_ms)
+    f.reset(closed)
+    _count("rows", len(closed) + (1 if live else 0))
+    return live
+
+def _direct(limit: int, need: int, closed_only: bool, fetch: Callable, now_ms: int) -> List[tuple]:
+    """庫開不了時的舊行為：整段 REST"""
+    closed, live = _split(fetch(limit), now_ms)
+    if closed_only:
+        return closed[len(closed) - need:] if need else []
+    return (closed + ([live] if live else []))[-limit:]
+
+def rows(symbol: str, interval: str, limit: int, closed_only: bool, fetch: Callable, now_ms: int) -> List[tuple]:
+    """
+    同 utils.fetch_kline_rows 的回傳：最後 limit 根（含未收盤的最後一根）；closed_only 則不含那根。
+    """
+    need = max(0, min(int(limit), MAX_REQ) - 1)
+    f, lock = _entry(symbol, interval)
+    if f is None:
+        return _direct(limit, need, closed_only, fetch, now_ms)
+    with lock:
+        live = _sync(f, need, not closed_only, fetch, now_ms)
+        out = f.rows(need) if need else []
+    if live is not None and not closed_only:
+        out.append(live)
+    return out
+
+def columns(symbol: str, interval: str, limit: int, fetch: Callable, now_ms: int):
+    """同 utils.fetch_klines：(closes, highs, lows, vols)，array('d')，最後一根是未收盤那根"""
+    need = max(0, min(int(limit), MAX_REQ) - 1)
+    f, lock = _entry(symbol, interval)
+    if f is None:
+        rs = _direct(limit, need, False, fetch, now_ms)
+        return tuple(array("d", (r[i] for r in rs)) for i in (3, 1, 2, 4))
+    with lock:
+        live = _sync(f, need, True, fetch, now_ms)
+        _, h, l, c, v, _ = f.columns(need)
+    if live is not None:
+        for col, val in zip((c, h, l, v), (live[3], live[1], live[2], live[4])):
+            col.append(val)
+    return c, h, l, v
+
+def stats() -> dict:
+    """{files, local, incr, full, rows, errors}：local = 完全沒打 REST；rows = 從 REST 解析的列數"""
+    with _LOCK:
+        st = dict(_STATS)
+        st["files"] = sum(1 for f in _FILES.values() if f is not None)
+    return st
+
+def close_all():
+    with _LOCK:
+        files = list(_FILES.values())
+        _FILES.clear()
+        _LOCKS.clear()
+    for f in files:
+        if f is not None:
+            try:
+                f.close()
+            except Exception:
+                pass
+
+atexit.register(close_all)
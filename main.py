@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from datetime import datetime
+import dataclasses
 import time, os ,config
 
 from dotenv import load_dotenv
@@ -10,32 +11,76 @@ from config import (USE_WEBSOCKET, USE_TESTNET, USE_LIVE, SCAN_INTERVAL_S, DAILY
                     SCALP_MODE, MAKER_ENTRY) # <-- 在最後加上
                     
                     
-from utils import (fetch_top_gainers,fetch_top_losers, SESSION, load_exchange_info,EXCHANGE_INFO, update_time_offset, conform_to_filters)
+from utils import (get_ranking_snapshot, SESSION, load_exchange_info,EXCHANGE_INFO, update_time_offset, conform_to_filters)
 from risk_frame import DayGuard, position_size_notional, compute_bracket, PositionClock
 from adapters import SimAdapter, LiveAdapter
 from signal_volume_breakout import volume_breakout_ok
 from signal_volume_breakdown import volume_breakdown_ok
+from signal_core import feature_stats
 from panel import live_render
-from ws_client import start_ws, stop_ws
+from ws_client import (start_ws, stop_ws, ws_shard_stats, k1m_store_stats, lock_stats as ws_lock_stats, on_kline_close, set_kline_intervals, start_market_ws, stop_market_ws, ws_ranking_snapshot,
+                       watch_levels, unwatch)
 import threading
 from journal import log_trade
 import sys, threading, termios, tty, select, math
 import requests
 from utils import (
-    fetch_top_gainers_fut, fetch_top_losers_fut,
     is_futures_symbol, load_exchange_info
 )
 from signals.signal_scalp_breakout import scalp_breakout_signal
 from signals.signal_scalp_vwap import scalp_vwap_signal
+from kline_provider import provider_stats, get_klines
+from scan_eval import first_passing, map_ordered
+import batch_signals
+from signals.signal_scalp_breakout import ScalpSignal
+from rate_governor import governor_stats
+from scheduler import EventLoopCore
+from bar_scheduler import BarCloseScheduler
 import logging
 logger = logging.getLogger("bot")
-load_exchange_info(force_refresh=True)
 
-def state_iter():
+BATCH_SCAN = bool(getattr(config, "BATCH_SCAN", True))
+BAR_CLOSE_EVAL = bool(getattr(config, "BAR_CLOSE_EVAL", True)) and USE_WEBSOCKET
+
+def scalp_batch_eval(symbols, mode):
+    """
+    一次抓齊各檔 1m K 線（WS 快取優先），NumPy 批次評估；回傳 {symbol: ScalpSignal}，只含通過者。
+    收盤觸發模式每個 1m 收盤 tick 呼叫一次（bar_scheduler 的 batch）。
+    """
+    cols = map_ordered(lambda s: get_klines(s, "1m", 40), symbols)
+    st = batch_signals.stack(symbols, cols, 25)
+    if st is None:
+        return {}
+    kept, C, H, L, V = st
+    res = batch_signals.scalp_batch(kept, C, H, L, V, mode=mode)
+    out = {}
+    for i, s in enumerate(res.symbols):
+        if res.mask[i]:
+            side = res.side[i]
+            if mode == "breakout":
+                reason = f"scalp-breakout-{side.lower()}"
+            else:
+                reason = f"vwap-meanrev-{side.lower()} z={res.values['z'][i]:.2f}"
+            out[s] = ScalpSignal(True, side, float(C[i, -1]), reason)
+    return out
+
+def scalp_batch_pick(keys, mode):
+    """keys: [(symbol, last, None), ...] 依排名排列；回傳第一個通過的 (key, ScalpSignal) 或 None"""
+    hits = scalp_batch_eval([k[0] for k in keys], mode)
+    for k in keys:
+        if k[0] in hits:
+            return k, hits[k[0]]
+    return None
+
+def build_core():
+    """
+    初始化（權益、adapter、熱鍵、WS）並組好事件核心；回傳 (core, get_state)。
+    core.run() 跑交易邏輯；get_state() 回傳最新的面板快照。
+    """
     # hotkeys local imports (ensure available even if top-level imports failed)
     import sys, threading, termios, tty, select  # hotkeys
     from datetime import datetime
-    # 這段放在 state_iter() 內，取代原本的 ui_log() 函式
+    # 這段放在 build_core() 內，取代原本的 ui_log() 函式
     def ui_log(msg, tag="SYS"):
         ts = datetime.now().strftime("%H:%M:%S")
         events.append((ts, f"{tag}: {msg}"))
@@ -43,10 +88,12 @@ def state_iter():
     SCALP_MODE = (os.getenv("SCALP_MODE") or getattr(config, "SCALP_MODE", "") or "").lower()  # "", "breakout", "vwap"
     TIME_STOP_SEC = int(os.getenv("TIME_STOP_SEC", str(getattr(config, "TIME_STOP_SEC", 180))))  # 預設 180 秒
     COOLDOWN_SEC = 3        # 平倉後全域冷卻
+    POSITION_POLL_S = float(getattr(config, "POSITION_POLL_S", 0.8))      # 持倉 REST 備援輪詢
+    BALANCE_REFRESH_S = float(getattr(config, "BALANCE_REFRESH_S", 60.0)) # 餘額定期刷新
     REENTRY_BLOCK_SEC = 45  # 同標的平倉後禁止再次進場秒數
 
     load_dotenv(override=True)
-    load_exchange_info()
+    load_exchange_info(force_refresh=True)
     day = DayGuard()
     adapter = LiveAdapter() if USE_LIVE else SimAdapter()
 
@@ -64,9 +111,6 @@ def state_iter():
         print(f"--- 模擬 (SIM) 模式啟動，初始權益: {equity:.2f} USDT ---")
 
     start_equity = equity
-    last_scan = 0.0
-    last_time_sync = time.time()
-    last_bal_ts = 0.0
 
     account = {"equity": equity, "balance": None, "testnet": USE_TESTNET}
     paused = {"scan": False}
@@ -76,6 +120,12 @@ def state_iter():
     events = []
     position_view = None
 
+    # ---- 事件核心：WS / 成交事件觸發對應工作，週期工作交給 timer ----
+    core = EventLoopCore()
+    def _on_level_hit(sym, kind, mark):
+        # WS 執行緒上執行：只投遞事件，延遲從這一刻起算
+        core.post("level_hit", (sym, kind, mark), key=sym)
+
     # ---- 冷卻 / 重入鎖 ----
     cooldown = {"until": 0.0, "symbol_lock": {}}
     open_ts = None  # 開倉時間（for time-stop）
@@ -149,25 +199,64 @@ def state_iter():
 
     threading.Thread(target=_keyloop, daemon=True).start()
 
-    # === 主回圈 ===
-    while True:
-        t_now = time.time()
+    # 全市場 ticker 串流：排行改由 WS 維護，REST 只剩冷啟動/備援
+    if USE_WEBSOCKET:
+        start_market_ws(USE_TESTNET)
+
+    # 使用者資料串流的成交/倉位事件：直接觸發持倉檢查
+    if getattr(adapter, "stream", None) is not None:
+        adapter.stream.add_listener(lambda et, sym: core.post("fill", sym, key=sym))
+
+    # 收盤觸發評估：WS K 線收盤 → core 事件 → 只評估該 symbol 的相符策略；有通過者立刻觸發 scan 下單
+    bars = BarCloseScheduler(on_ready=lambda: core.trigger("scan"))
+    if BAR_CLOSE_EVAL:
+        if SCALP_MODE in ("breakout", "vwap"):
+            _scalp_fn = scalp_breakout_signal if SCALP_MODE == "breakout" else scalp_vwap_signal
+            # 有 numpy 時同一個 1m 收盤 tick 的 symbol 整批評估一次（universe 可放大到數百檔）
+            _batch = (lambda syms: scalp_batch_eval(syms, SCALP_MODE)) if BATCH_SCAN and batch_signals.available() else None
+            bars.register(f"scalp_{SCALP_MODE}", "1m", lambda s: _scalp_fn(s, timeframe="1m"),
+                          ttl_s=float(getattr(config, "BAR_READY_TTL_SCALP_S", 3.0)), batch=_batch)
+        else:
+            if ENABLE_LONG:
+                bars.register("volume_breakout", config.KLINE_INTERVAL, volume_breakout_ok)
+            if ENABLE_SHORT:
+                bars.register("volume_breakdown", config.KLINE_INTERVAL, volume_breakdown_ok)
+        set_kline_intervals(bars.intervals())
+        on_kline_close(lambda sym, iv, bar: core.post("bar_close", (sym, iv, bar[5]), key=(sym, iv), t_event=time.time()))
+
+    # ==================== 工作（全部在 core 執行緒上依序執行） ====================
+    def job_housekeeping():
         day.rollover()
 
-        # --- 每 30 分鐘校時一次 ---
-        if t_now - last_time_sync > 1800:
-            try:
-                new_offset = update_time_offset()
-                ui_log(f"Time offset re-synced: {new_offset} ms", "SYS")
-            except Exception as e:
-                ui_log(f"Time offset sync failed: {e}", "ERROR")
-            finally:
-                last_time_sync = t_now
+    # --- 每 30 分鐘校時一次 ---
+    def job_time_sync():
+        try:
+            new_offset = update_time_offset()
+            ui_log(f"Time offset re-synced: {new_offset} ms", "SYS")
+        except Exception as e:
+            ui_log(f"Time offset sync failed: {e}", "ERROR")
+
+    def job_balance():
+        nonlocal equity
+        if not USE_LIVE:
+            return
+        try:
+            equity = adapter.balance_usdt()
+            account["balance"] = equity
+        except Exception as e:
+            ui_log(f"Balance refresh failed: {e}", "SYS")
 
+    # 觸發來源：mark price 穿越（level_hit）、成交事件（fill）、以及 REST 備援輪詢 timer
+    def job_position(payload=None):
+        nonlocal equity, position_view, open_ts
+        t_now = time.time()
         # ========== 1) 有持倉：監控 TP/SL 與 Time-Stop ==========
         if adapter.has_open():
             # 保留資料給日誌
             trade_data_copy = adapter.open.copy()
+            if USE_WEBSOCKET:
+                watch_levels(trade_data_copy["symbol"], trade_data_copy["side"],
+                             trade_data_copy["tp"], trade_data_copy["sl"], _on_level_hit)
 
             # 1a) 先檢查 TP/SL 是否命中
             try:
@@ -177,6 +266,7 @@ def state_iter():
                 closed, pct, sym, reason, exit_price = (False, None, None, None, None)
 
             if closed:
+                unwatch(sym)
                 ui_log(f"CLOSE {sym} ({reason}) pct={pct*100:.2f}% day={day.state.pnl_pct*100:.2f}%")
                 
                 # 記帳 (你原本在 poll_and_close_if_hit 裡面記了，這裡又記一次)
@@ -198,7 +288,6 @@ def state_iter():
                     ui_log(f"Duplicate Journal log_trade warn: {e}", "WARN")
 
                 cooldown["until"] = time.time() + COOLDOWN_SEC
-                last_bal_ts = 0.0
                 open_ts = None
 
                 # 更新權益
@@ -270,80 +359,119 @@ def state_iter():
                         # 捕捉 API 失敗的 RuntimeError
                         ui_log(f"time-stop error: {e}", "ERROR")
 
+
+    # 觸發來源：scan timer（SCAN_INTERVAL_S）；有持倉時直接略過
+    def job_scan():
+        nonlocal top10, top10_losers, position_view, open_ts
+        t_now = time.time()
         # ========== 2) 無持倉：掃描與找入場 ==========
-        else:
-            if not day.state.halted and not paused["scan"] and (t_now > last_scan + SCAN_INTERVAL_S):
+        if not adapter.has_open():
+            unwatch()  # time-stop / 熱鍵平倉後殘留的觸價監看一併清掉
+            if not day.state.halted and not paused["scan"]:
                 try:
                     ws_syms = []
 
                     # 2a) 抓取 Gainers / Losers（遵守 ENABLE_LONG / ENABLE_SHORT）
+                    #     整個 scan 共用同一份 24hr ticker 快照，只下載/解析一次
+                    snap = get_ranking_snapshot()
                     if ENABLE_LONG:
-                        top10 = fetch_top_gainers(10)        # 面板顯示照舊
+                        top10 = snap.gainers(10)             # 面板顯示照舊
                         ws_syms.extend([t[0] for t in top10])
                         ui_log("top10_gainers ok", "SCAN")
                     else:
                         top10 = []
 
                     if ENABLE_SHORT:
-                        top10_losers = fetch_top_losers(10)  # 面板顯示照舊
+                        top10_losers = snap.losers(10)       # 面板顯示照舊
                         ws_syms.extend([t[0] for t in top10_losers])
                         ui_log("top10_losers ok", "SCAN")
                     else:
                         top10_losers = []
 
                     # 另取候選（僅期貨可交易）
-                    gainers_fut = fetch_top_gainers_fut(20)    # 抓寬一點，讓策略好挑
-                    losers_fut  = fetch_top_losers_fut(20)
+                    uni_n = int(getattr(config, "SCAN_UNIVERSE_N", 50))
+                    gainers_fut = snap.gainers(uni_n, futures_only=True)    # 抓寬一點，讓策略好挑
+                    losers_fut  = snap.losers(uni_n, futures_only=True)
+                    if SCALP_MODE in ("breakout", "vwap"):
+                        # Scalp 候選也訂閱 WS，讓 1m K 線由快取供應（不再每根打 REST）
+                        ws_syms.extend([t[0] for t in gainers_fut + losers_fut])
 
-                    last_scan = t_now
 
                     # 2b) 找候選
+                    won = None
                     candidate = None
                     side = None
                     reason = ""
 
+                    # === 收盤觸發模式：這裡只更新各策略 universe，取走收盤時已通過的訊號 ===
+                    jobs = []
+                    if BAR_CLOSE_EVAL:
+                        if SCALP_MODE in ("breakout", "vwap"):
+                            bars.set_universe(f"scalp_{SCALP_MODE}",
+                                              [(s, (s, last, None)) for s, pct, last, vol in gainers_fut + losers_fut])
+                        else:
+                            bars.set_universe("volume_breakout", [(s, (s, last, "LONG")) for s, pct, last, vol in gainers_fut])
+                            bars.set_universe("volume_breakdown", [(s, (s, last, "SHORT")) for s, pct, last, vol in losers_fut])
+                            # 量價策略的 5m 收盤事件也要 WS 訂閱
+                            ws_syms.extend([t[0] for t in gainers_fut + losers_fut])
+                        for name, s, key, res in bars.take_ready():
+                            if t_now < cooldown['until'] or t_now < cooldown['symbol_lock'].get(s, 0):
+                                continue
+                            # 收盤到取用之間價格已經動了：進場價（與之後的 bracket）改用現價
+                            try:
+                                px = float(adapter.best_price(s))
+                            except Exception:
+                                px = 0.0
+                            if px > 0:
+                                key = (key[0], px, key[2])
+                                if dataclasses.is_dataclass(res) and hasattr(res, "entry"):
+                                    res = dataclasses.replace(res, entry=px)   # breakout / vwap 各有自己的 ScalpSignal
+                            won = (key, res)
+                            break
+
                     # === 路由：Scalp 模式 ===
-                    if SCALP_MODE in ("breakout", "vwap"):
+                    # 候選一次全部送進並行池；仍依排名決定贏家（前面通過者優先）
+                    elif SCALP_MODE in ("breakout", "vwap"):
                         # 下單 universe 只用「期貨版」清單；面板仍顯示原始 top10
                         universe = gainers_fut + losers_fut
-                        for s, pct, last, vol in universe:
-                            if t_now < cooldown['symbol_lock'].get(s, 0):
-                                continue
-                            if t_now < cooldown['until']:
-                                continue
-
-                            if SCALP_MODE == "breakout":
-                                sig = scalp_breakout_signal(s, timeframe="1m")
-                            else:
-                                sig = scalp_vwap_signal(s, timeframe="1m")
-
-                            if sig.ok:
-                                candidate = (s, sig.entry)
-                                side = sig.side
-                                reason = sig.reason
-                                break
+                        sig_fn = scalp_breakout_signal if SCALP_MODE == "breakout" else scalp_vwap_signal
+                        if t_now >= cooldown['until']:
+                            for s, pct, last, vol in universe:
+                                if t_now < cooldown['symbol_lock'].get(s, 0):
+                                    continue
+                                jobs.append(((s, last, None), lambda s=s: sig_fn(s, timeframe="1m")))
+                        # 有 numpy 時整個 universe 一次向量化評估，不再逐檔跑訊號
+                        if jobs and BATCH_SCAN and batch_signals.available():
+                            won = scalp_batch_pick([k for k, _ in jobs], SCALP_MODE)
+                            jobs = []
 
                     # === 路由：原本的 volume 策略（預設） ===
                     else:
+                        # 多單全部排在空單前面：等同原本「多單沒找到才看空單」
                         if ENABLE_LONG and (t_now > cooldown["until"]):
                             for s, pct, last, vol in gainers_fut:
                                 if t_now < cooldown['symbol_lock'].get(s, 0):
                                     continue
-                                if volume_breakout_ok(s):
-                                    candidate = (s, last)
-                                    side = "LONG"
-                                    reason = "volume-breakout"
-                                    break
+                                jobs.append(((s, last, "LONG"), lambda s=s: volume_breakout_ok(s)))
 
-                        if (not candidate) and ENABLE_SHORT and (t_now > cooldown["until"]):
+                        if ENABLE_SHORT and (t_now > cooldown["until"]):
                             for s, pct, last, vol in losers_fut:
                                 if t_now < cooldown['symbol_lock'].get(s, 0):
                                     continue
-                                if volume_breakdown_ok(s):
-                                    candidate = (s, last)
-                                    side = "SHORT"
-                                    reason = "volume-breakdown"
-                                    break
+                                jobs.append(((s, last, "SHORT"), lambda s=s: volume_breakdown_ok(s)))
+
+                    if jobs:
+                        won = first_passing(jobs)
+                    if won:
+                        (s, last, fixed_side), sig = won
+                        if fixed_side is None:
+                            candidate = (s, sig.entry)
+                            side = sig.side
+                            reason = sig.reason
+                        else:
+                            candidate = (s, last)
+                            side = fixed_side
+                            reason = "volume-breakout" if fixed_side == "LONG" else "volume-breakdown"
 
                     # 2c) 啟動/更新 WS（若開啟）
                     if USE_WEBSOCKET and ws_syms:
@@ -361,13 +489,13 @@ def state_iter():
                     # 避免重複下單同一標的（面板與實際倉位不同步時，不要再打同一標的）
                     if adapter.has_open() and adapter.open and adapter.open.get("symbol") == symbol:
                         ui_log(f"Skipping {symbol}: already have open position", "SYS")
-                        continue
+                        return
 
                     # 僅允許交易所期貨清單內的符號
                     if not is_futures_symbol(symbol):
                         ui_log(f"Skipping {symbol}: not in futures exchangeInfo", "SCAN")
                         cooldown["symbol_lock"][symbol] = time.time() + 60
-                        continue
+                        return
 
                     notional = position_size_notional(equity)
 
@@ -454,8 +582,24 @@ def state_iter():
                                 ui_log(f"ORDER FAILED for {symbol}: {e}", "ERROR")
                                 logger.error(f"order failed {symbol}: {e}")
 
+    # ==================== 面板快照（每輪工作結束後發布一份，面板自己的節奏讀取） ====================
+    latest = {"state": None}
+
+    def publish():
+        nonlocal top10, top10_losers
+        for label, err in core.pop_errors():
+            ui_log(f"{label} error: {err}", "ERROR")
+
         # 3) 更新顯示用 Equity
         account["equity"] = equity
+        account["kline_cache"] = provider_stats()
+        account["rest_weight"] = governor_stats()
+        account["latency"] = core.latency_stats()
+        account["ws_shards"] = ws_shard_stats()
+        account["bar_store"] = k1m_store_stats()
+        account["ws_locks"] = ws_lock_stats()
+        account["strategies"] = bars.stats()
+        account["features"] = feature_stats()
         if USE_LIVE and account.get("balance") is None:
             account["balance"] = equity
             try:
@@ -463,24 +607,45 @@ def state_iter():
                     adapter.sync_state() # type: ignore
             except Exception:
                 pass
-        # 4) 輸出給面板
-        yield {
-            "top10": top10,
-            "top10_losers": top10_losers,
+
+        # 3b) 面板 Top10 直接讀 WS 排行（不打 REST；WS 未就緒時沿用上次 scan 結果）
+        ws_snap = ws_ranking_snapshot() if USE_WEBSOCKET else None
+        if ws_snap is not None:
+            top10 = ws_snap.gainers(10) if ENABLE_LONG else []
+            top10_losers = ws_snap.losers(10) if ENABLE_SHORT else []
+
+        # 4) 輸出給面板（淺拷貝，避免面板讀到一半被改）
+        latest["state"] = {
+            "top10": list(top10),
+            "top10_losers": list(top10_losers),
             "day_state": day.state,
             "position": adapter.open if hasattr(adapter, "open") else (None if position_view is None else position_view),
-            "events": events,
-            "account": account,
+            "events": events[-12:],
+            "account": dict(account),
         }
 
-        time.sleep(0.8)
+    core.every("housekeeping", 1.0, job_housekeeping)
+    core.every("time_sync", 1800.0, job_time_sync, first_delay=1800.0)
+    core.every("balance", BALANCE_REFRESH_S, job_balance, first_delay=BALANCE_REFRESH_S)
+    core.every("position", POSITION_POLL_S, job_position)      # WS 失聯時的 REST 備援
+    core.every("scan", SCAN_INTERVAL_S, job_scan)
+    core.on("level_hit", job_position)
+    core.on("fill", job_position)
+    core.on("bar_close", lambda p: bars.on_bar_close(*p))
+    core.after_each(publish)
+    publish()
 
+    return core, (lambda: latest["state"])
 
 if __name__ == "__main__":
+    core, get_state = build_core()
+    threading.Thread(target=core.run, daemon=True, name="bot-core").start()
     try:
-        live_render(state_iter())
+        live_render(get_state)
     finally:
+        core.stop()
         try:
             stop_ws()
+            stop_market_ws()
         except Exception:
             pass
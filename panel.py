@@ -4,6 +4,7 @@ from rich.layout import Layout
 from rich.live import Live
 from rich.console import Console
 from rich.text import Text
+import time
 from utils import ws_best_price
 
 console = Console()
@@ -41,6 +42,40 @@ def build_status_panel(day_state, account: dict | None = None):
     bal = account.get("balance")
     if bal is not None:
         txt.append(f"Balance: {float(bal):.2f} USDT\n", style="cyan")
+    kc = account.get("kline_cache") or {}
+    if kc.get("hit_ratio") is not None:
+        txt.append(f"Kline cache: {kc['hit_ratio']*100:.0f}% hit ({kc['rest']} REST)\n")
+    ks = kc.get("store") or {}
+    if ks.get("files"):
+        txt.append(f"Kline store: {ks['files']} files, {ks['local']} local / {ks['incr']} incr / {ks['full']} full\n")
+    bs = account.get("bar_store") or {}
+    if bs.get("symbols"):
+        txt.append(f"1m bars: {bs['symbols']} sym × {bs['cap']} ({bs['bytes']/1024:.0f} KB)\n")
+    rw = account.get("rest_weight") or {}
+    if rw:
+        style = "red" if rw.get("banned_for") else None
+        txt.append(f"REST weight: {rw['used_1m']}/{rw['limit_1m']} (orders 10s: {rw['orders_10s']})\n", style=style)
+    lat = (account.get("latency") or {}).get("level_hit")
+    if lat:
+        txt.append(f"Tick→decision: p50 {lat['p50_ms']:.0f}ms / p99 {lat['p99_ms']:.0f}ms\n")
+    fs = account.get("features") or {}
+    if fs.get("computed"):
+        style = "red" if fs.get("errors") else None
+        txt.append(f"Features: {fs['computed']} computed / {fs['nodata']} no data / {fs['errors']} errors\n", style=style)
+        if fs.get("errors") and fs.get("last_error"):
+            txt.append(f"  last error: {fs['last_error'][:80]}\n", style="red")
+    for name, st in (account.get("strategies") or {}).items():
+        if st.get("evals"):
+            txt.append(f"{name}: {st['evals']} evals / {st['passed']} pass, p50 {st['p50_ms']:.0f}ms p99 {st['p99_ms']:.0f}ms\n")
+    shards = account.get("ws_shards") or []
+    if shards:
+        parts = [f"#{s['shard']} {s['streams']}st {s['msgs_per_s']}/s" + ("" if s["connected"] else " ✗") for s in shards]
+        txt.append("WS: " + " | ".join(parts) + "\n")
+    lk = account.get("ws_locks") or {}
+    if lk:
+        g, st = lk["global"], lk["stripes"]
+        txt.append(f"WS locks: global {g['contended']}/{g['acquires']} wait {g['wait_ms']:.0f}ms | "
+                   f"stripes {st['contended']}/{st['acquires']} wait {st['wait_ms']:.0f}ms (max {st['max_wait_ms']:.1f}ms)\n")
     return Panel(txt, title="Status", border_style="green" if not day_state.halted else "red" )
 
 def build_position_panel(position):
@@ -105,14 +140,30 @@ def render_layout(top10, top10_losers, day_state, position, events, account=None
     layout["lower"].update(build_events_panel(events))
     return layout
 
-def live_render(loop_iterable):
-    with Live(refresh_per_second=12, console=console) as live:
-        for state in loop_iterable:
-            live.update(render_layout(
-                state.get("top10", []),
-                state.get("top10_losers", []), # <--- 新增
-                state["day_state"],
-                state.get("position"),
-                state.get("events", []),
-                state.get("account", {})
-            ))
+def _render_state(state):
+    return render_layout(
+        state.get("top10", []),
+        state.get("top10_losers", []), # <--- 新增
+        state["day_state"],
+        state.get("position"),
+        state.get("events", []),
+        state.get("account", {})
+    )
+
+def live_render(source, fps: float = 12):
+    """
+    source 可以是：
+    - callable：回傳最新快照（事件核心在別的執行緒跑），面板依 fps 自己的節奏讀取
+    - iterable：舊版 generator，每 yield 一次畫一次
+    """
+    with Live(refresh_per_second=fps, console=console) as live:
+        if callable(source):
+            period = 1.0 / max(fps, 1e-3)
+            while True:
+                state = source()
+                if state is not None:
+                    live.update(_render_state(state))
+                time.sleep(period)
+        else:
+            for state in source:
+                live.update(_render_state(state))
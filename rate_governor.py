@@ -0,0 +1,200 @@
+# rate_governor.py
+# 幣安 REST 權重/下單頻率的客戶端守門員。所有 REST 都應經過 governed_request()：
+# - 依端點估算 IP weight（/ticker/24hr 無 symbol = 40、klines 依 limit 等）
+# - 讀回 X-MBX-USED-WEIGHT-1M / X-MBX-ORDER-COUNT-10S / -1M 校正本地計數
+# - 429/418 依 Retry-After 全面暫停，不再讓 urllib3 Retry 立刻重打
+# - 下單優先：行情輪詢只能用到 (1 - reserve) 的額度，且有下單在等時一律讓路
+
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import config
+
+WEIGHT_LIMIT_1M   = int(getattr(config, "REST_WEIGHT_LIMIT_1M", 2400))
+ORDER_LIMIT_10S   = int(getattr(config, "REST_ORDER_LIMIT_10S", 300))
+ORDER_LIMIT_1M    = int(getattr(config, "REST_ORDER_LIMIT_1M", 1200))
+MARKET_RESERVE    = float(getattr(config, "REST_WEIGHT_RESERVE", 0.25))   # 保留給下單/帳戶的比例
+MARKET_MAX_WAIT_S = float(getattr(config, "REST_MARKET_MAX_WAIT_S", 5.0))
+
+# 優先序：數字越小越優先
+PRIO_ORDER   = 0   # 下單 / 撤單
+PRIO_ACCOUNT = 1   # 倉位、餘額、listenKey 等
+PRIO_MARKET  = 2   # 行情輪詢
+
+class RateLimited(RuntimeError):
+    """行情請求在 MARKET_MAX_WAIT_S 內拿不到額度"""
+
+def _klines_weight(limit: int) -> int:
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+def endpoint_weight(method: str, path: str, params=None) -> int:
+    """估算單一請求的 IP weight（USDⓈ-M Futures 文件值）"""
+    params = params or {}
+    has_sym = bool(params.get("symbol"))
+    m = method.upper()
+    if path == "/fapi/v1/ticker/24hr":
+        return 1 if has_sym else 40
+    if path == "/fapi/v1/ticker/price":
+        return 1 if has_sym else 2
+    if path == "/fapi/v1/premiumIndex":
+        return 1 if has_sym else 10
+    if path == "/fapi/v1/klines":
+        try:
+            return _klines_weight(int(params.get("limit", 500)))
+        except Exception:
+            return 5
+    if path == "/fapi/v1/order":
+        return 0 if m == "POST" else 1      # 下單不吃 IP weight，吃 order count
+    if path in ("/fapi/v2/balance", "/fapi/v2/positionRisk", "/fapi/v1/userTrades"):
+        return 5
+    return 1
+
+def _is_order(method: str, path: str) -> bool:
+    return method.upper() == "POST" and path == "/fapi/v1/order"
+
+class RateGovernor:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._minute = 0          # 目前 1m 視窗（epoch 分鐘）
+        self._used = 0            # 本視窗已用 weight（本地估 + header 校正）
+        self._o10_win = 0
+        self._o10 = 0
+        self._o1m = 0
+        self._banned_until = 0.0
+        self._orders_waiting = 0
+        self._stats = {"waits": 0, "wait_s": 0.0, "bans": 0, "rejected": 0}
+
+    def _roll(self, now: float):
+        m = int(now // 60)
+        if m != self._minute:
+            self._minute = m
+            self._used = 0
+            self._o1m = 0
+        w = int(now // 10)
+        if w != self._o10_win:
+            self._o10_win = w
+            self._o10 = 0
+
+    def _cap(self, prio: int) -> float:
+        if prio == PRIO_ORDER:
+            return WEIGHT_LIMIT_1M
+        if prio == PRIO_ACCOUNT:
+            return WEIGHT_LIMIT_1M * (1.0 - MARKET_RESERVE / 2.0)
+        return WEIGHT_LIMIT_1M * (1.0 - MARKET_RESERVE)
+
+    def _can(self, weight: int, prio: int, is_order: bool, now: float) -> bool:
+        if now < self._banned_until:
+            return False
+        if prio > PRIO_ORDER and self._orders_waiting:
+            return False
+        if self._used + weight > self._cap(prio):
+            return False
+        if is_order and (self._o10 + 1 > ORDER_LIMIT_10S or self._o1m + 1 > ORDER_LIMIT_1M):
+            return False
+        return True
+
+    def acquire(self, weight: int, prio: int = PRIO_MARKET, is_order: bool = False, max_wait_s=None):
+        """
+        阻塞直到有額度；行情請求超過 max_wait_s（預設 MARKET_MAX_WAIT_S）拋 RateLimited。
+        下單/帳戶請求不設上限（一定要送出去）。
+        """
+        if max_wait_s is None and prio == PRIO_MARKET:
+            max_wait_s = MARKET_MAX_WAIT_S
+        t0 = time.time()
+        with self._cond:
+            if prio == PRIO_ORDER:
+                self._orders_waiting += 1
+            try:
+                waited = False
+                while True:
+                    now = time.time()
+                    self._roll(now)
+                    if self._can(weight, prio, is_order, now):
+                        break
+                    if max_wait_s is not None and now - t0 >= max_wait_s:
+                        self._stats["rejected"] += 1
+                        raise RateLimited(f"REST weight budget exhausted (used={self._used}/{WEIGHT_LIMIT_1M})")
+                    waited = True
+                    # 等到下一個 10s 邊界、解禁或被 notify
+                    nxt = min((int(now // 10) + 1) * 10, max(self._banned_until, now + 0.05))
+                    if max_wait_s is not None:
+                        nxt = min(nxt, t0 + max_wait_s)
+                    self._cond.wait(timeout=max(0.01, nxt - now))
+                self._used += weight
+                if is_order:
+                    self._o10 += 1
+                    self._o1m += 1
+                if waited:
+                    self._stats["waits"] += 1
+                    self._stats["wait_s"] += time.time() - t0
+            finally:
+                if prio == PRIO_ORDER:
+                    self._orders_waiting -= 1
+                    self._cond.notify_all()
+
+    def observe(self, status_code: int, headers) -> None:
+        """以回應 header 校正計數；429/418 進入冷卻"""
+        now = time.time()
+        with self._cond:
+            self._roll(now)
+            try:
+                used = headers.get("X-MBX-USED-WEIGHT-1M")
+                if used is not None:
+                    self._used = max(self._used, int(used))
+                o10 = headers.get("X-MBX-ORDER-COUNT-10S")
+                if o10 is not None:
+                    self._o10 = max(self._o10, int(o10))
+                o1m = headers.get("X-MBX-ORDER-COUNT-1M")
+                if o1m is not None:
+                    self._o1m = max(self._o1m, int(o1m))
+            except Exception:
+                pass
+            if status_code in (429, 418):
+                try:
+                    ra = float(headers.get("Retry-After") or 0)
+                except Exception:
+                    ra = 0.0
+                # 沒給 Retry-After 就等到下一分鐘（418 至少 2 分鐘）
+                if ra <= 0:
+                    ra = (60 - now % 60) if status_code == 429 else 120.0
+                self._banned_until = max(self._banned_until, now + ra)
+                self._stats["bans"] += 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._roll(time.time())
+            return dict(self._stats, used_1m=self._used, limit_1m=WEIGHT_LIMIT_1M,
+                        orders_10s=self._o10, orders_1m=self._o1m,
+                        banned_for=max(0.0, self._banned_until - time.time()))
+
+GOVERNOR = RateGovernor()
+
+def governed_request(session, method: str, url: str, params=None, prio=None, **kw):
+    """
+    經過守門員的 session.request()；回傳 requests.Response（不做 raise_for_status）。
+    已簽名的 URL（query 在 url 內）也能正確估 weight。
+    """
+    u = urlparse(url)
+    q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+    if params:
+        q.update(params)
+    weight = endpoint_weight(method, u.path, q)
+    is_order = _is_order(method, u.path)
+    if prio is None:
+        prio = PRIO_ORDER if u.path in ("/fapi/v1/order", "/fapi/v1/allOpenOrders") and method.upper() != "GET" \
+            else PRIO_MARKET
+    GOVERNOR.acquire(weight, prio=prio, is_order=is_order)
+    r = session.request(method, url, params=params, **kw)
+    GOVERNOR.observe(r.status_code, r.headers)
+    return r
+
+def governor_stats() -> dict:
+    return GOVERNOR.stats()
@@ -0,0 +1,342 @@
+# recorder.py
+# 逐筆行情錄製：把 ws_client 收到的事件寫成精簡的二進位檔，給 replay / 回測用。
+# - 固定寬度紀錄（struct），依 日期（UTC）/ symbol / 事件種類 分檔：
+#     <root>/<YYYY-MM-DD>/<SYMBOL>/<kind>.bin   資料：一段段 zlib 壓縮的 chunk（只追加）
+#     <root>/<YYYY-MM-DD>/<SYMBOL>/<kind>.idx   索引：每個 chunk 一筆 (first_ts, last_ts, offset, n)
+# - ingest 執行緒只做 deque.append（不打包、不壓縮、不碰檔案）；背景執行緒批次打包寫檔
+# - 讀取：read_records() 以索引跳到時間起點；iter_events() 還原成 WS 事件格式，可直接餵 replay
+#
+# 紀錄格式（little-endian，時間都是毫秒）：
+#   aggTrade   E, price, qty, buyer_is_maker
+#   depth      E, 5 檔買 (px, qty) × 5, 5 檔賣 (px, qty) × 5
+#   ticker     E, last, pct, vol
+#   kline_<iv> E, close_time, o, h, l, c, v      （只錄已收盤的 bar）
+
+import bisect
+import heapq
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+
+CHUNK_RECORDS = int(getattr(config, "RECORD_CHUNK", 4096))      # 每個壓縮 chunk 的紀錄數上限
+FLUSH_S = float(getattr(config, "RECORD_FLUSH_S", 5.0))         # 未滿的 chunk 最久多久寫一次
+MAX_QUEUE = 1_000_000                                            # 佇列上限；寫檔跟不上時丟棄並計數
+_LEVELS = 5
+_NAN = float("nan")
+
+FORMATS = {
+    "aggTrade": struct.Struct("<qddB"),
+    "depth": struct.Struct("<q%dd" % (4 * _LEVELS)),
+    "ticker": struct.Struct("<qddd"),
+    "kline": struct.Struct("<qq5d"),
+}
+_CHUNK_HDR = struct.Struct("<IIqq")      # 壓縮長度, 紀錄數, first_ts, last_ts
+_IDX = struct.Struct("<qqQI")            # first_ts, last_ts, offset, n
+
+def _fmt(kind: str) -> struct.Struct:
+    return FORMATS["kline" if kind.startswith("kline") else kind]
+
+def _day(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000.0, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def _levels(side) -> list:
+    out = []
+    for i in range(_LEVELS):
+        if i < len(side):
+            out.append(float(side[i][0]))
+            out.append(float(side[i][1]))
+        else:
+            out.append(_NAN)
+            out.append(_NAN)
+    return out
+
+def encode(data: dict) -> Optional[Tuple[str, str, int, bytes]]:
+    """WS 事件 → (symbol, kind, ts_ms, record bytes)；不錄的事件回 None"""
+    e = data.get("e")
+    s = data.get("s")
+    ts = int(data.get("E") or data.get("T") or 0)
+    if not s or not ts:
+        return None
+    if e == "aggTrade":
+        return s, e, ts, FORMATS[e].pack(ts, float(data["p"]), float(data["q"]), 1 if data.get("m") else 0)
+    if e == "depthUpdate":
+        return s, "depth", ts, FORMATS["depth"].pack(ts, *_levels(data.get("b") or ()), *_levels(data.get("a") or ()))
+    if e == "24hrTicker":
+        return s, "ticker", ts, FORMATS["ticker"].pack(ts, float(data["c"]), float(data.get("P") or 0.0),
+                                                       float(data.get("v") or 0.0))
+    if e == "kline":
+        k = data["k"]
+        if not k.get("x"):
+            return None
+        return s, "kline_" + k.get("i", "1m"), ts, FORMATS["kline"].pack(
+            ts, int(k["T"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]))
+    return None
+
+def decode(symbol: str, kind: str, rec: tuple) -> dict:
+    """紀錄 → WS 事件 dict（與 ws_client._handle_event 吃的格式相同）"""
+    if kind == "aggTrade":
+        return {"e": "aggTrade", "E": rec[0], "T": rec[0], "s": symbol, "p": rec[1], "q": rec[2], "m": bool(rec[3])}
+    if kind == "depth":
+        n = 2 * _LEVELS
+        b = [[rec[1 + 2 * i], rec[2 + 2 * i]] for i in range(_LEVELS) if rec[1 + 2 * i] == rec[1 + 2 * i]]
+        a = [[rec[1 + n + 2 * i], rec[2 + n + 2 * i]] for i in range(_LEVELS) if rec[1 + n + 2 * i] == rec[1 + n + 2 * i]]
+        return {"e": "depthUpdate", "E": rec[0], "T": rec[0], "s": symbol, "b": b, "a": a}
+    if kind == "ticker":
+        return {"e": "24hrTicker", "E": rec[0], "s": symbol, "c": rec[1], "P": rec[2], "v": rec[3]}
+    iv = kind.split("_", 1)[1] if "_" in kind else "1m"
+    return {"e": "kline", "E": rec[0], "s": symbol,
+            "k": {"T": rec[1], "i": iv, "o": rec[2], "h": rec[3], "l": rec[4], "c": rec[5], "v": rec[6], "x": True}}
+
+class _Partition:
+    """單一 (day, symbol, kind) 的寫入狀態：未壓縮的緩衝 + 開著的 .bin/.idx"""
+    __slots__ = ("path", "buf", "n", "first", "last", "bin", "idx", "t_open")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.buf = bytearray()
+        self.n = 0
+        self.first = 0
+        self.last = 0
+        self.bin = None
+        self.idx = None
+        self.t_open = time.time()
+
+class TickRecorder:
+    """
+    record(data) 可在任何執行緒呼叫（只做 deque.append）；start() 後由背景執行緒寫檔。
+    stop() 會把剩下的全部寫完再關檔。
+    """
+
+    def __init__(self, root: str = None, chunk: int = CHUNK_RECORDS, flush_s: float = FLUSH_S,
+                 level: int = 1):
+        self.root = root or getattr(config, "RECORD_DIR", "data/ticks")
+        self.chunk = max(1, int(chunk))
+        self.flush_s = float(flush_s)
+        self.level = int(level)
+        self._q = deque()
+        self._parts: Dict[tuple, _Partition] = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.errors = 0
+
+    # ---- ingest 端 ----
+    def record(self, data: dict):
+        if len(self._q) >= MAX_QUEUE:
+            self.dropped += 1
+            return
+        self._q.append(data)
+
+    # ---- 背景寫入 ----
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="tick-recorder")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+            self._thread = None
+        self._drain()
+        self._flush_all(close=True)
+
+    def _loop(self):
+        last_flush = time.time()
+        while not self._stop.is_set():
+            if not self._drain():
+                self._stop.wait(0.05)
+            now = time.time()
+            if now - last_flush >= self.flush_s:
+                last_flush = now
+                self._flush_all(close=False)
+
+    def _drain(self) -> int:
+        q = self._q
+        n = 0
+        while q:
+            data = q.popleft()
+            try:
+                enc = encode(data)
+            except Exception:
+                self.errors += 1
+                continue
+            if enc is None:
+                continue
+            s, kind, ts, rec = enc
+            key = (_day(ts), s, kind)
+            p = self._parts.get(key)
+            if p is None:
+                p = self._parts[key] = _Partition(os.path.join(self.root, key[0], s, kind))
+            if p.n == 0:
+                p.first = ts
+            p.buf += rec
+            p.n += 1
+            p.last = max(p.last, ts)
+            n += 1
+            if p.n >= self.chunk:
+                self._flush(p)
+        self.written += n
+        return n
+
+    def _flush(self, p: _Partition):
+        if p.n == 0:
+            return
+        try:
+            if p.bin is None:
+                os.makedirs(os.path.dirname(p.path), exist_ok=True)
+                p.bin = open(p.path + ".bin", "ab")
+                p.idx = open(p.path + ".idx", "ab")
+            data = zlib.compress(bytes(p.buf), self.level)
+            off = p.bin.tell()
+            p.bin.write(_CHUNK_HDR.pack(len(data), p.n, p.first, p.last))
+            p.bin.write(data)
+            p.bin.flush()
+            p.idx.write(_IDX.pack(p.first, p.last, off, p.n))
+            p.idx.flush()
+            self.bytes += _CHUNK_HDR.size + len(data)
+            self.chunks += 1
+        except Exception:
+            self.errors += 1
+        p.buf = bytearray()
+        p.n = 0
+
+    def _flush_all(self, close: bool):
+        today = _day(int(time.time() * 1000))
+        for key in list(self._parts):
+            p = self._parts[key]
+            self._flush(p)
+            # 已換日的分區寫完就關檔
+            if close or key[0] != today:
+                for f in (p.bin, p.idx):
+                    try:
+                        if f is not None:
+                            f.close()
+                    except Exception:
+                        pass
+                self._parts.pop(key, None)
+
+    def stats(self) -> dict:
+        """{queued, written, dropped, chunks, bytes, files, errors}"""
+        return {"queued": len(self._q), "written": self.written, "dropped": self.dropped,
+                "chunks": self.chunks, "bytes": self.bytes, "files": len(self._parts), "errors": self.errors}
+
+# ==== 讀取 ====
+def _chunks(path: str) -> List[tuple]:
+    """(first_ts, last_ts, offset, n)；沒有索引（例如寫到一半中斷）就掃 .bin 的 chunk 標頭"""
+    out = []
+    try:
+        with open(path + ".idx", "rb") as f:
+            raw = f.read()
+        out = [_IDX.unpack_from(raw, i) for i in range(0, len(raw) - len(raw) % _IDX.size, _IDX.size)]
+        return out
+    except FileNotFoundError:
+        pass
+    try:
+        with open(path + ".bin", "rb") as f:
+            off = 0
+            while True:
+                hdr = f.read(_CHUNK_HDR.size)
+                if len(hdr) < _CHUNK_HDR.size:
+                    break
+                clen, n, first, last = _CHUNK_HDR.unpack(hdr)
+                out.append((first, last, off, n))
+                off += _CHUNK_HDR.size + clen
+                f.seek(off)
+    except FileNotFoundError:
+        pass
+    return out
+
+def read_records(path: str, kind: str, start_ms: Optional[int] = None,
+                 end_ms: Optional[int] = None) -> Iterator[tuple]:
+    """
+    單一分區（不含副檔名）的紀錄 tuple，依寫入順序；
+    以索引跳過 last_ts < start_ms 的 chunk，first_ts > end_ms 後停止。
+    """
+    fmt = _fmt(kind)
+    idx = _chunks(path)
+    if not idx:
+        return
+    i = 0
+    if start_ms is not None:
+        lasts = [c[1] for c in idx]
+        i = bisect.bisect_left(lasts, start_ms)
+    with open(path + ".bin", "rb") as f:
+        for first, last, off, n in idx[i:]:
+            if end_ms is not None and first > end_ms:
+                break
+            f.seek(off)
+            hdr = f.read(_CHUNK_HDR.size)
+            if len(hdr) < _CHUNK_HDR.size:
+                break
+            clen = _CHUNK_HDR.unpack(hdr)[0]
+            try:
+                raw = zlib.decompress(f.read(clen))
+            except zlib.error:
+                break
+            for rec in fmt.iter_unpack(raw):
+                ts = rec[0]
+                if start_ms is not None and ts < start_ms:
+                    continue
+                if end_ms is not None and ts > end_ms:
+                    break
+                yield rec
+
+def partitions(root: str, symbols: Optional[Iterable[str]] = None, kinds: Optional[Iterable[str]] = None,
+               days: Optional[Iterable[str]] = None) -> List[tuple]:
+    """[(day, symbol, kind, path)]，依日期排序"""
+    want_s = {s.upper() for s in symbols} if symbols else None
+    want_k = set(kinds) if kinds else None
+    want_d = set(days) if days else None
+    out = []
+    if not os.path.isdir(root):
+        return out
+    for day in sorted(os.listdir(root)):
+        if want_d and day not in want_d:
+            continue
+        dpath = os.path.join(root, day)
+        if not os.path.isdir(dpath):
+            continue
+        for sym in sorted(os.listdir(dpath)):
+            if want_s and sym not in want_s:
+                continue
+            spath = os.path.join(dpath, sym)
+            for fn in sorted(os.listdir(spath)):
+                if not fn.endswith(".bin"):
+                    continue
+                kind = fn[:-4]
+                if want_k and kind not in want_k and not (kind.startswith("kline") and "kline" in want_k):
+                    continue
+                out.append((day, sym, kind, os.path.join(spath, kind)))
+    return out
+
+def iter_events(root: str, symbols=None, kinds=None, days=None,
+                start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> Iterator[Tuple[float, dict]]:
+    """
+    錄製目錄 → 依時間合併的 (ts 秒, WS 事件 dict)，格式與 replay.load_events 相同。
+    同一天內各分區合併；跨日依日期順序接續。
+    """
+    parts = partitions(root, symbols, kinds, days)
+    by_day: Dict[str, list] = {}
+    for day, sym, kind, path in parts:
+        by_day.setdefault(day, []).append((sym, kind, path))
+
+    def _one(sym, kind, path):
+        for rec in read_records(path, kind, start_ms, end_ms):
+            yield rec[0] / 1000.0, decode(sym, kind, rec)
+
+    for day in sorted(by_day):
+        streams = [_one(sym, kind, path) for sym, kind, path in by_day[day]]
+        yield from heapq.merge(*streams, key=lambda x: x[0])
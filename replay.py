@@ -0,0 +1,282 @@
+# replay.py
+# 行情重播：讀磁碟上錄下來的 WS 事件（aggTrade / kline / depthUpdate / 24hrTicker），
+# 以虛擬時鐘加速重跑「ws_client 快取 → 訊號 → SimAdapter → DayGuard」整條路徑。
+# - 虛擬時鐘：重播期間 time.time() 指向事件時間，TTL、K 線新鮮度、換日、journal 時間戳都跟著走
+# - 事件直接餵 ws_client._handle_event（與實盤同一份 handler）
+# - 成交在逐筆層級判定：每筆 aggTrade 更新價格來源，持倉的 symbol 每筆都檢查 TP/SL
+# - 進場：策略在 K 線收盤時評估（與 BAR_CLOSE_EVAL 相同），sizing / bracket 與 main 相同
+# - K 線快取不夠時不打 REST（kline_provider.set_rest_fallback(False)）
+#
+# 用法：
+#   python replay.py data/2024-05-01/*.jsonl --out replay_journal.csv
+#   python replay.py rec.jsonl --strategies scalp_breakout --equity 5000 --exchange-info exinfo.json
+#   python replay.py data/ticks --strategies scalp_vwap     # recorder 錄下的目錄
+# 事件檔：每行一則 WS 事件（/ws 的原樣，或 /stream 的 {"stream","data"}），同一檔內依時間排序。
+
+import argparse
+import glob
+import heapq
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import journal
+import kline_provider
+import ws_client
+from adapters import SimAdapter
+from risk_frame import DayGuard, compute_bracket, position_size_notional
+from utils import EXCHANGE_INFO, conform_to_filters
+from ws_codec import decode
+
+class VirtualClock:
+    """取代 time.time() 的時鐘；只會往前走。install() 期間全域生效"""
+
+    def __init__(self, start: float = 0.0):
+        self.now = float(start)
+        self._orig = None
+
+    def time(self) -> float:
+        return self.now
+
+    def advance_to(self, ts: float):
+        if ts > self.now:
+            self.now = ts
+
+    def install(self):
+        if self._orig is None:
+            self._orig = time.time
+            time.time = self.time
+
+    def uninstall(self):
+        if self._orig is not None:
+            time.time = self._orig
+            self._orig = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+# ==== 事件來源 ====
+def event_ts(data: dict) -> Optional[float]:
+    """事件時間（秒）：E（event time）優先，沒有就用 T"""
+    ts = data.get("E") or data.get("T")
+    return ts / 1000.0 if ts else None
+
+def iter_jsonl(path: str) -> Iterator[Tuple[float, dict]]:
+    """單一檔案 → (ts, data)；解不開或沒有時間的行略過"""
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                payload = decode(line)
+            except Exception:
+                continue
+            data = payload.get("data", payload) if isinstance(payload, dict) else None
+            if not isinstance(data, dict):
+                continue
+            ts = event_ts(data)
+            if ts is not None:
+                yield ts, data
+
+def load_events(paths: Iterable[str]) -> Iterator[Tuple[float, dict]]:
+    """
+    多個來源依時間合併：JSONL 檔（可含萬用字元，每個檔案本身需已排序），
+    或 recorder 的錄製目錄（data/ticks）。
+    """
+    import recorder
+    streams = []
+    for p in paths:
+        for f in sorted(glob.glob(p)) or [p]:
+            streams.append(recorder.iter_events(f) if os.path.isdir(f) else iter_jsonl(f))
+    return heapq.merge(*streams, key=lambda x: x[0])
+
+# ==== 策略 ====
+def default_strategies() -> List[tuple]:
+    """(name, interval, fn(symbol) -> 訊號)；訊號是 bool 或帶 ok/side/entry/reason 的物件"""
+    from signals.signal_scalp_breakout import scalp_breakout_signal
+    from signals.signal_scalp_vwap import scalp_vwap_signal
+    return [
+        ("scalp_breakout", "1m", scalp_breakout_signal),
+        ("scalp_vwap", "1m", scalp_vwap_signal),
+    ]
+
+def _ensure_exchange_info(symbol: str):
+    """離線重播沒有 exchangeInfo 時給寬鬆的過濾規則（8 位小數、無最小名目）"""
+    if symbol not in EXCHANGE_INFO:
+        EXCHANGE_INFO[symbol] = {
+            "pricePrecision": 8, "quantityPrecision": 6,
+            "tickSize": 1e-8, "minPrice": 0.0, "maxPrice": 0.0,
+            "stepSize": 1e-6, "minQty": 0.0, "maxQty": 0.0, "minNotional": 0.0,
+        }
+
+# ==== 重播引擎 ====
+class ReplayEngine:
+    def __init__(self, strategies: Optional[List[tuple]] = None, equity: float = 10000.0,
+                 journal_path: str = "replay_journal.csv", cooldown_s: float = 10.0):
+        self.strategies = strategies if strategies is not None else default_strategies()
+        self.start_equity = float(equity)
+        self.journal_path = journal_path
+        self.cooldown_s = float(cooldown_s)
+        self.clock = VirtualClock()
+        self.prices: Dict[str, float] = {}
+        self.adapter = SimAdapter(price_source=self.prices.get)
+        self.day = DayGuard()
+        self.trades: List[dict] = []
+        self._closed: List[tuple] = []          # K 線收盤事件（handler 內收集，handler 後處理）
+        self._lock_until: Dict[str, float] = {}
+        self.counts = {"events": 0, "bars": 0, "evals": 0, "signals": 0}
+
+    @property
+    def equity(self) -> float:
+        return self.start_equity * (1.0 + self.day.state.pnl_pct)
+
+    def _on_bar(self, symbol: str, interval: str, bar):
+        self._closed.append((symbol, interval, bar))
+
+    def _on_event(self, ts: float, data: dict):
+        e = data.get("e")
+        s = data.get("s")
+        ws_client._handle_event(data)
+        if e == "aggTrade":
+            try:
+                self.prices[s] = float(data["p"])
+            except Exception:
+                return
+            if self.adapter.open and self.adapter.open["symbol"] == s:
+                self._poll()
+        elif e == "24hrTicker" and s not in self.prices:
+            try:
+                self.prices[s] = float(data["c"])
+            except Exception:
+                pass
+        if self._closed:
+            closed, self._closed = self._closed, []
+            for sym, iv, bar in closed:
+                self.counts["bars"] += 1
+                self.prices.setdefault(sym, bar[3])
+                self._evaluate(sym, iv)
+
+    def _poll(self):
+        closed, pct, sym, reason, exit_price = self.adapter.poll_and_close_if_hit(self.day)
+        if closed:
+            self.trades[-1].update({"exit": exit_price, "ret_pct": pct, "reason": reason,
+                                    "exit_ts": self.clock.now})
+
+    def _evaluate(self, symbol: str, interval: str):
+        if self.adapter.has_open() or not self.day.can_trade():
+            return
+        if self._lock_until.get(symbol, 0.0) > self.clock.now:
+            return
+        for name, iv, fn in self.strategies:
+            if iv != interval:
+                continue
+            self.counts["evals"] += 1
+            try:
+                sig = fn(symbol)
+            except Exception:
+                continue
+            if not bool(getattr(sig, "ok", sig)):
+                continue
+            self.counts["signals"] += 1
+            entry = getattr(sig, "entry", None) or self.prices.get(symbol)
+            side = getattr(sig, "side", None)
+            if not entry or side not in ("LONG", "SHORT"):
+                continue
+            self._open(symbol, side, float(entry), getattr(sig, "reason", name) or name)
+            return
+
+    def _open(self, symbol: str, side: str, entry: float, reason: str):
+        # 與 main 的進場相同：名目 → bracket → 對齊交易所規則 → SimAdapter.place_bracket
+        _ensure_exchange_info(symbol)
+        notional = position_size_notional(self.equity)
+        sl_raw, tp_raw = compute_bracket(entry, side)
+        qty_raw = notional / max(entry, 1e-9)
+        try:
+            entry_f, qty_f, pp, qp = conform_to_filters(symbol, entry, qty_raw)
+            sl_f, _, _, _ = conform_to_filters(symbol, sl_raw, qty_raw)
+            tp_f, _, _, _ = conform_to_filters(symbol, tp_raw, qty_raw)
+        except Exception:
+            return
+        if qty_f == 0.0:
+            return
+        self._lock_until[symbol] = self.clock.now + self.cooldown_s
+        try:
+            self.adapter.place_bracket(symbol, side, f"{qty_f:.{qp}f}", f"{entry_f:.{pp}f}",
+                                       f"{sl_f:.{pp}f}", f"{tp_f:.{pp}f}")
+        except Exception:
+            return
+        o = self.adapter.open
+        self.trades.append({"ts": self.clock.now, "symbol": symbol, "side": side, "qty": o["qty"],
+                            "entry": o["entry"], "sl": o["sl"], "tp": o["tp"], "reason": reason})
+
+    def run(self, events: Iterable[Tuple[float, dict]]) -> dict:
+        """跑完整段事件；回傳摘要 {events, bars, evals, signals, trades, pnl_pct, sim_s, wall_s, speedup}"""
+        old_path = journal.PATH
+        journal.PATH = self.journal_path
+        kline_provider.set_rest_fallback(False)
+        ws_client.on_kline_close(self._on_bar)
+        t0 = time.perf_counter()
+        first = None
+        try:
+            with self.clock:
+                for ts, data in events:
+                    if first is None:
+                        first = ts
+                        self.clock.now = ts
+                        self.day = DayGuard()        # 以重播起點的日期開一天
+                    prev_day = self.day.state.key
+                    self.clock.advance_to(ts)
+                    self.day.rollover()
+                    if self.day.state.key != prev_day:
+                        self._lock_until.clear()
+                    self.counts["events"] += 1
+                    self._on_event(ts, data)
+        finally:
+            ws_client.off_kline_close(self._on_bar)
+            kline_provider.set_rest_fallback(True)
+            journal.PATH = old_path
+        wall = time.perf_counter() - t0
+        sim = (self.clock.now - first) if first is not None else 0.0
+        done = [t for t in self.trades if "exit" in t]
+        return dict(self.counts,
+                    trades=len(done),
+                    open=1 if self.adapter.has_open() else 0,
+                    pnl_pct=sum(t["ret_pct"] for t in done),
+                    equity=self.equity,
+                    sim_s=sim, wall_s=wall,
+                    speedup=(sim / wall) if wall > 0 else None)
+
+def _pick(names: Optional[str]) -> List[tuple]:
+    strats = default_strategies()
+    if not names:
+        return strats
+    want = {n.strip() for n in names.split(",") if n.strip()}
+    return [s for s in strats if s[0] in want]
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded WS events through SimAdapter")
+    ap.add_argument("paths", nargs="+", help="事件檔（JSONL，可用萬用字元）或 recorder 錄製目錄")
+    ap.add_argument("--out", default="replay_journal.csv", help="成交紀錄（journal.csv 格式）")
+    ap.add_argument("--strategies", default=None, help="逗號分隔：scalp_breakout,scalp_vwap")
+    ap.add_argument("--equity", type=float, default=float(os.getenv("EQUITY_USDT", "10000")))
+    ap.add_argument("--exchange-info", default=None, help="utils.EXCHANGE_INFO 的 JSON 傾印（沒給就用寬鬆規則）")
+    args = ap.parse_args()
+
+    if args.exchange_info:
+        with open(args.exchange_info, "r", encoding="utf-8") as f:
+            EXCHANGE_INFO.update(json.load(f))
+    eng = ReplayEngine(_pick(args.strategies), equity=args.equity, journal_path=args.out)
+    res = eng.run(load_events(args.paths))
+    print(f"events={res['events']} bars={res['bars']} evals={res['evals']} signals={res['signals']} "
+          f"trades={res['trades']} open={res['open']}")
+    print(f"PnL {res['pnl_pct'] * 100:+.2f}%  equity {res['equity']:.2f}  "
+          f"sim {res['sim_s'] / 3600:.2f}h in {res['wall_s']:.2f}s"
+          + (f" (×{res['speedup']:.0f})" if res["speedup"] else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# rest_client.py
+# 非同步 REST 層：背景 asyncio loop（與 ws_client 相同的 daemon thread 模式）+ keep-alive 連線池。
+# - 相同的 in-flight GET（url + params）只送一次，其餘呼叫者共用結果
+# - 重試用 await asyncio.sleep 退避，不會卡住其他請求或呼叫端以外的執行緒
+# - 同步 facade get_json() 讓 utils._rest_json / safe_get_json 維持原本簽名
+# - 每個實際送出的請求都經過 rate_governor（合併掉的請求不重複計權重）
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from rate_governor import governed_request, PRIO_MARKET
+
+REST_POOL_SIZE = int(getattr(config, "REST_POOL_SIZE", 16))
+
+# HTTP/1.1 keep-alive 連線池；重試由本模組自己做（非阻塞退避），所以 max_retries=0
+_HTTP = requests.Session()
+_HTTP.headers.update({"User-Agent": "daily-gainer-bot/vC", "Cache-Control": "no-cache"})
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=REST_POOL_SIZE, max_retries=0)
+_HTTP.mount("https://", _ADAPTER)
+_HTTP.mount("http://", _ADAPTER)
+
+_EXEC = ThreadPoolExecutor(max_workers=REST_POOL_SIZE, thread_name_prefix="rest")
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_THREAD: Optional[threading.Thread] = None
+_START_LOCK = threading.Lock()
+_INFLIGHT = {}        # key -> asyncio.Task（只在 loop thread 內存取）
+_STATS = {"requests": 0, "coalesced": 0, "retries": 0}
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP, _THREAD
+    with _START_LOCK:
+        if _LOOP is not None and _THREAD is not None and _THREAD.is_alive():
+            return _LOOP
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _t():
+            asyncio.set_event_loop(loop)
+            ready.set()
+            loop.run_forever()
+
+        _THREAD = threading.Thread(target=_t, daemon=True, name="rest-loop")
+        _THREAD.start()
+        ready.wait()
+        _LOOP = loop
+        return loop
+
+def _key(url: str, params) -> tuple:
+    return (url, tuple(sorted((params or {}).items())))
+
+def _do_get(url: str, params, timeout):
+    r = governed_request(_HTTP, "GET", url, params=params, prio=PRIO_MARKET, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+async def _fetch(url: str, params, timeout, tries: int):
+    loop = asyncio.get_running_loop()
+    last = None
+    for t in range(max(1, tries)):
+        try:
+            _STATS["requests"] += 1
+            return await loop.run_in_executor(_EXEC, _do_get, url, params, timeout)
+        except Exception as e:
+            last = e
+        if t + 1 < max(1, tries):
+            _STATS["retries"] += 1
+            await asyncio.sleep(0.3 * (t + 1))   # 退避不佔執行緒
+    raise last if last else RuntimeError(f"REST failed: {url}")
+
+async def aget_json(url: str, params=None, timeout=5, tries=3):
+    """
+    非同步 GET；同 key 的請求若已在飛，直接等同一個結果（coalescing）。
+    必須在本模組的 loop 內 await（或經由 get_json 呼叫）。
+    """
+    params = dict(params or {})
+    k = _key(url, params)
+    task = _INFLIGHT.get(k)
+    if task is not None:
+        _STATS["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(_fetch(url, params, timeout, tries))
+        _INFLIGHT[k] = task
+        task.add_done_callback(lambda _t, k=k: _INFLIGHT.pop(k, None))
+    # shield：某個等待者被取消不影響其他共用者
+    return await asyncio.shield(task)
+
+def get_json(url: str, params=None, timeout=5, tries=3):
+    """同步 facade：任何執行緒都可呼叫；失敗拋出最後一個例外。"""
+    loop = _ensure_loop()
+    fut = asyncio.run_coroutine_threadsafe(aget_json(url, params, timeout, tries), loop)
+    # 外層保底等待：每次嘗試的 timeout + 退避
+    budget = (float(timeout) + 1.0) * max(1, tries) + 0.3 * max(1, tries) ** 2
+    return fut.result(timeout=budget)
+
+def rest_stats() -> dict:
+    return dict(_STATS, inflight=len(_INFLIGHT))
@@ -13,10 +13,15 @@ class DayState:
 
 class DayGuard:
     def __init__(self):
-        self.state = DayState(key=datetime.now().date().isoformat())
+        self.state = DayState(key=self._today())
+
+    @staticmethod
+    def _today() -> str:
+        # 經 time.time()，重播時跟著虛擬時鐘換日
+        return datetime.fromtimestamp(time.time()).date().isoformat()
 
     def rollover(self):
-        k = datetime.now().date().isoformat()
+        k = self._today()
         if k != self.state.key:
             self.state = DayState(key=k)
 
@@ -35,17 +40,20 @@ def position_size_notional(equity: float) -> float:
     notional = risk_amt / SL_PCT
     return max(notional, 0.0)
 
-def compute_bracket(entry: float, side: str):
+def compute_bracket(entry: float, side: str, sl_pct: float = None, tp_pct: float = None):
     """
     回傳 (sl_price, tp_price)。只用 entry & 常數百分比，直觀好懂。
+    sl_pct / tp_pct 不給就用 config 的 SL_PCT / TP_PCT（回測掃參數時才會覆寫）。
     """
+    sl_pct = SL_PCT if sl_pct is None else sl_pct
+    tp_pct = TP_PCT if tp_pct is None else tp_pct
     side_u = (side or "").upper()
     if side_u == "LONG":
-        sl = entry * (1.0 - SL_PCT)
-        tp = entry * (1.0 + TP_PCT)
+        sl = entry * (1.0 - sl_pct)
+        tp = entry * (1.0 + tp_pct)
     else:
-        sl = entry * (1.0 + SL_PCT)
-        tp = entry * (1.0 - TP_PCT)
+        sl = entry * (1.0 + sl_pct)
+        tp = entry * (1.0 - tp_pct)
     return sl, tp
 
 class PositionClock:
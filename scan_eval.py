@@ -0,0 +1,87 @@
+# scan_eval.py
+# 掃描候選的並行評估：有上限的執行緒池同時跑訊號（各自的網路請求並行），
+# 但仍依「排名順序」決定贏家——排在前面且通過的 symbol 優先。
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutTimeout
+
+import config
+
+SCAN_MAX_WORKERS = int(getattr(config, "SCAN_MAX_WORKERS", 8))
+SCAN_EVAL_TIMEOUT_S = float(getattr(config, "SCAN_EVAL_TIMEOUT_S", 10.0))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=max(1, SCAN_MAX_WORKERS), thread_name_prefix="scan")
+        return _POOL
+
+def _passed(res) -> bool:
+    # volume 策略回 bool；scalp 策略回 ScalpSignal(ok=...)
+    ok = getattr(res, "ok", res)
+    return bool(ok)
+
+def first_passing(jobs, timeout_s: float = None):
+    """
+    jobs: [(key, fn), ...] 依優先順序排列；fn() 回傳 bool 或帶 .ok 的訊號物件。
+    全部同時送進池子，再依順序等結果：第一個通過、且前面都已判定不通過者勝出。
+    決定後取消尚未開始的工作（已在跑的讓它跑完，結果丟棄）。
+    回傳 (key, result)；沒有通過者回 None。單一工作例外或超時視為不通過。
+    """
+    if not jobs:
+        return None
+    deadline = time.time() + (SCAN_EVAL_TIMEOUT_S if timeout_s is None else timeout_s)
+    pool = _pool()
+    futs = [pool.submit(fn) for _, fn in jobs]
+    try:
+        for (key, _), f in zip(jobs, futs):
+            try:
+                res = f.result(timeout=max(0.0, deadline - time.time()))
+            except FutTimeout:
+                continue
+            except Exception:
+                continue
+            if _passed(res):
+                return key, res
+        return None
+    finally:
+        for f in futs:
+            f.cancel()
+
+def map_ordered(fn, items, timeout_s: float = None):
+    """
+    對每個 item 並行跑 fn(item)，依輸入順序回傳結果；例外或超時的位置為 None。
+    （批次評估前先把各檔 K 線抓齊用）
+    """
+    if not items:
+        return []
+    deadline = time.time() + (SCAN_EVAL_TIMEOUT_S if timeout_s is None else timeout_s)
+    pool = _pool()
+    futs = [pool.submit(fn, it) for it in items]
+    out = []
+    try:
+        for f in futs:
+            try:
+                out.append(f.result(timeout=max(0.0, deadline - time.time())))
+            except Exception:
+                out.append(None)
+        return out
+    finally:
+        for f in futs:
+            f.cancel()
+
+def submit(fn, *args):
+    """丟一個背景工作進同一個池子（收盤觸發評估用），回傳 Future"""
+    return _pool().submit(fn, *args)
+
+def shutdown():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
@@ -0,0 +1,152 @@
+# scheduler.py
+# 事件驅動核心：計時工作（scan / 校時 / 餘額）+ 事件佇列（WS 價格、K 線、成交）。
+# - post() 任何執行緒都可呼叫；同 (kind, key) 尚未處理的事件會合併，避免積壓
+# - run_once() 依序執行到期的 timer 與佇列事件，其餘時間阻塞等待（不空轉）
+# - 每種事件記錄「事件時間 → handler 完成」延遲，可用 latency_stats() 查
+
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Optional
+
+import config
+
+LATENCY_BUDGET_MS = float(getattr(config, "LATENCY_BUDGET_MS", 250.0))
+_LAT_SAMPLES = 512
+
+class EventLoopCore:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._events = deque()                   # (kind, key, payload, t_event)
+        self._pending = {}                       # (kind, key) -> index 標記（合併用）
+        self._timers = []                        # heap: (due, seq, name)
+        self._timer_def = {}                     # name -> (interval, fn)
+        self._seq = itertools.count()
+        self._handlers = defaultdict(list)       # kind -> [fn(payload)]
+        self._after = []                         # 每輪結束後呼叫（例如發布面板快照）
+        self._lat = defaultdict(lambda: deque(maxlen=_LAT_SAMPLES))
+        self._counts = defaultdict(int)
+        self._over_budget = defaultdict(int)
+        self._errors = []                        # 最近的 handler 例外（給上層 log）
+        self._stop = False
+
+    # ---------- 註冊 ----------
+    def every(self, name: str, interval_s: float, fn: Callable[[], None], first_delay: float = 0.0):
+        """週期工作；同名重複註冊會覆蓋間隔與函式"""
+        with self._cond:
+            self._timer_def[name] = (float(interval_s), fn)
+            heapq.heappush(self._timers, (time.time() + first_delay, next(self._seq), name))
+            self._cond.notify()
+
+    def trigger(self, name: str):
+        """讓某個 timer 立刻到期（例如平倉後馬上掃描）"""
+        with self._cond:
+            if name in self._timer_def:
+                heapq.heappush(self._timers, (0.0, next(self._seq), name))
+                self._cond.notify()
+
+    def on(self, kind: str, fn: Callable[[object], None]):
+        self._handlers[kind].append(fn)
+
+    def after_each(self, fn: Callable[[], None]):
+        self._after.append(fn)
+
+    # ---------- 事件 ----------
+    def post(self, kind: str, payload=None, key=None, t_event: Optional[float] = None):
+        """
+        投遞事件（thread-safe）。key 相同且尚未處理的事件只保留最新 payload，
+        但延遲仍以最早那筆的事件時間計算。
+        """
+        t = time.time() if t_event is None else t_event
+        with self._cond:
+            k = (kind, key)
+            if key is not None and k in self._pending:
+                self._pending[k][2] = payload
+            else:
+                item = [kind, key, payload, t]
+                self._events.append(item)
+                if key is not None:
+                    self._pending[k] = item
+            self._cond.notify()
+
+    # ---------- 執行 ----------
+    def _run_handler(self, label: str, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self._errors.append((label, e))
+            del self._errors[:-20]
+
+    def run_once(self, max_block_s: float = 1.0):
+        """處理所有到期 timer 與佇列事件；都沒有就最多阻塞 max_block_s"""
+        with self._cond:
+            now = time.time()
+            if not self._events and (not self._timers or self._timers[0][0] > now):
+                wait = max_block_s
+                if self._timers:
+                    wait = min(wait, max(0.0, self._timers[0][0] - now))
+                self._cond.wait(timeout=wait)
+            events = list(self._events)
+            self._events.clear()
+            self._pending.clear()
+            now = time.time()
+            due = []
+            while self._timers and self._timers[0][0] <= now:
+                _, _, name = heapq.heappop(self._timers)
+                if name in self._timer_def and name not in due:
+                    due.append(name)
+
+        # 事件優先（價格/成交反應延遲最要緊），再跑到期的週期工作
+        for kind, key, payload, t_event in events:
+            for fn in self._handlers.get(kind, ()):
+                self._run_handler(kind, fn, payload)
+            ms = (time.time() - t_event) * 1000.0
+            self._lat[kind].append(ms)
+            self._counts[kind] += 1
+            if ms > LATENCY_BUDGET_MS:
+                self._over_budget[kind] += 1
+
+        for name in due:
+            interval, fn = self._timer_def[name]
+            self._run_handler(name, fn)
+            with self._cond:
+                # 只保留一個排程：trigger() 可能已經多塞了一筆
+                self._timers = [t for t in self._timers if t[2] != name]
+                heapq.heapify(self._timers)
+                heapq.heappush(self._timers, (time.time() + interval, next(self._seq), name))
+
+        if events or due:
+            for fn in self._after:
+                self._run_handler("after_each", fn)
+
+    def run(self):
+        while not self._stop:
+            self.run_once()
+
+    def stop(self):
+        self._stop = True
+        with self._cond:
+            self._cond.notify_all()
+
+    # ---------- 觀測 ----------
+    def pop_errors(self):
+        errs, self._errors = self._errors, []
+        return errs
+
+    def latency_stats(self) -> dict:
+        """每種事件：{n, p50_ms, p99_ms, max_ms, over_budget}"""
+        out = {}
+        for kind, dq in list(self._lat.items()):
+            vals = sorted(dq)
+            if not vals:
+                continue
+            out[kind] = {
+                "n": self._counts[kind],
+                "p50_ms": vals[len(vals) // 2],
+                "p99_ms": vals[min(len(vals) - 1, int(len(vals) * 0.99))],
+                "max_ms": vals[-1],
+                "over_budget": self._over_budget[kind],
+            }
+        return out
@@ -0,0 +1,326 @@
+# signal_core.py
+# 量價突破（多）/跌破（空）共用核心：
+# - 只在 bar 收盤後評估：每個 symbol 每根已收盤 bar 只抓一次 K 線、算一次特徵（BarFeatures），
+#   多/空兩邊共用；bar 還沒收盤時直接跳過，不抓也不算。
+# - 同一 symbol 併發要求只會有一個真的去算（其他等結果）。
+# - armed → 回測狀態機以「已收盤 bar 的收盤時間」計數，RETEST_EXPIRE_N 是真的 N 根 bar；
+#   離開 universe 太久的 symbol 依 TTL 清掉。
+
+import logging
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import config
+from kline_provider import get_closed_klines, last_closed_ts, interval_seconds
+from indicators import ENGINE
+
+KLINE_INTERVAL = getattr(config, "KLINE_INTERVAL", "5m")
+KLINE_LIMIT = int(getattr(config, "KLINE_LIMIT", 120))
+HH_N = int(getattr(config, "HH_N", 60))
+LL_N = int(getattr(config, "LL_N", 60))
+OVEREXTEND_CAP = float(getattr(config, "OVEREXTEND_CAP", 0.012))
+VOL_BASE_WIN = int(getattr(config, "VOL_BASE_WIN", 48))
+VOL_SPIKE_K = float(getattr(config, "VOL_SPIKE_K", 1.5))
+VOL_LOOKBACK_CONFIRM = int(getattr(config, "VOL_LOOKBACK_CONFIRM", 3))
+VOL_COOLDOWN_ALPHA = float(getattr(config, "VOL_COOLDOWN_ALPHA", 0.80))   # 量能降溫 80%
+EMA_FAST = int(getattr(config, "EMA_FAST", 20))
+EMA_SLOW = int(getattr(config, "EMA_SLOW", 50))
+EMA_SLOPE_N = int(getattr(config, "EMA_SLOPE_N", 50))                     # 以 5m 的 EMA50 斜率近似多週期濾網
+VWAP_DIST_MAX = float(getattr(config, "VWAP_DIST_MAX", 0.008))           # 與 VWAP 最大距離
+BASE_MIN_BARS = int(getattr(config, "BASE_MIN_BARS", 12))                # 箱體最少根數
+BASE_MAX_ATR_Q = float(getattr(config, "BASE_MAX_ATR_Q", 0.35))          # 箱體寬度 ≤ ATR 的 35% 分位（近似）
+FATIGUE_LOOKBACK = int(getattr(config, "FATIGUE_LOOKBACK", 4))
+FATIGUE_MIN_STREAK = int(getattr(config, "FATIGUE_MIN_STREAK", 2))
+FATIGUE_TOTAL_MOVE = float(getattr(config, "FATIGUE_TOTAL_MOVE", 0.015))
+RETEST_BUFFER_PCT = float(getattr(config, "RETEST_BUFFER_PCT", 0.001))   # ±0.10% 回測緩衝
+RETEST_EXPIRE_N = int(getattr(config, "RETEST_EXPIRE_N", 6))             # Armed 後 N 根內必須回測
+STATE_TTL_S = float(getattr(config, "SIGNAL_STATE_TTL_S", 1800))        # 多久沒被評估就清掉狀態/快取
+BAR_S = interval_seconds(KLINE_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+# 小工具
+def _pct_dist(a: float, b: float) -> float:
+    return 0.0 if a == 0 else abs(a - b) / a
+
+def _box_base_ok(highs, lows, closes, min_bars: int, atr_q: float, base_atr: float) -> bool:
+    if len(closes) < min_bars + 2:
+        return False
+    sub_h = highs[-(min_bars+1):-1]
+    sub_l = lows [-(min_bars+1):-1]
+    width = (max(sub_h) - min(sub_l))
+    if base_atr == 0:
+        return False
+    # 以 ATR 比例當作「窄幅」判斷，atr_q=0.35 代表約 35%*2 的鬆綁門檻
+    return (width / base_atr) <= (atr_q / 0.5)
+
+def _fatigue_exhausted(closes, m: int, min_streak: int, total_move: float, bullish: bool) -> bool:
+    if len(closes) < m + 1:
+        return False
+    seg = closes[-(m+1):]
+    streak = 0
+    acc = 0.0
+    for i in range(1, len(seg)):
+        d = seg[i] - seg[i-1]
+        if (d > 0 and bullish) or (d < 0 and not bullish):
+            streak += 1
+            acc += abs(d) / max(seg[i-1], 1e-9)
+        else:
+            streak = 0
+            acc = 0.0
+        if streak >= min_streak and acc >= total_move:
+            return True
+    return False
+
+@dataclass
+class BarFeatures:
+    """一個 symbol 在最後一根已收盤 bar 的特徵；多/空規則都只讀這份"""
+    symbol: str
+    bar_ts: Optional[float]       # 最後一根已收盤 bar 的收盤時間（秒）
+    price: float
+    prev_high: float
+    prev_low: float
+    vol_spike: bool
+    vol_cool_ok: bool
+    vwap: float
+    vwap_dist_ok: bool
+    overextend_ok: bool
+    e_fast: float
+    e_slow: float
+    ema_slope: float
+    base_ok: bool
+    fatigue_long: bool
+    fatigue_short: bool
+    t: float                      # 計算時間（快取用）
+
+def compute_features(symbol: str) -> Optional[BarFeatures]:
+    """抓一次已收盤 K 線、算一次全部特徵；資料不足回 None"""
+    closes, highs, lows, vols, bar_ts = get_closed_klines(symbol, KLINE_INTERVAL, KLINE_LIMIT)
+    if len(closes) < max(HH_N, LL_N, VOL_BASE_WIN) + VOL_LOOKBACK_CONFIRM + 2:
+        return None
+
+    price = closes[-1]
+    # 區間高低點：排除當前這根
+    prev_high = max(highs[-(HH_N+1):-1])
+    prev_low = min(lows[-(LL_N+1):-1])
+
+    # 量能：尖峰 + 降溫
+    base_window = vols[-(VOL_BASE_WIN+VOL_LOOKBACK_CONFIRM):-VOL_LOOKBACK_CONFIRM]
+    base_med = statistics.median(base_window)
+    recent_sum = sum(vols[-VOL_LOOKBACK_CONFIRM:])
+    vol_spike = recent_sum >= VOL_SPIKE_K * base_med * VOL_LOOKBACK_CONFIRM
+    vol_cool_ok = True
+    if len(vols) >= 2:
+        peak = max(vols[-2], vols[-1])
+        vol_cool_ok = (vols[-1] <= VOL_COOLDOWN_ALPHA * peak) or (vols[-2] <= VOL_COOLDOWN_ALPHA * peak)
+
+    # VWAP / EMA / ATR 直接讀增量指標引擎（kline_provider 已對齊）
+    ind = ENGINE.values(symbol, KLINE_INTERVAL, use_live=False)
+    if not ind:
+        return None
+    e_fast = ind.get(f"ema{EMA_FAST}")
+    e_slow = ind.get(f"ema{EMA_SLOW}")
+    if e_fast is None or e_slow is None:
+        return None
+    session_vwap = ind["vwap"]
+    dist = _pct_dist(price, session_vwap)
+
+    return BarFeatures(
+        symbol=symbol,
+        bar_ts=bar_ts,
+        price=price,
+        prev_high=prev_high,
+        prev_low=prev_low,
+        vol_spike=vol_spike,
+        vol_cool_ok=vol_cool_ok,
+        vwap=session_vwap,
+        vwap_dist_ok=dist <= VWAP_DIST_MAX,
+        overextend_ok=dist <= OVEREXTEND_CAP,
+        e_fast=e_fast,
+        e_slow=e_slow,
+        ema_slope=ind.get(f"ema_slope{EMA_SLOPE_N}", 0.0),
+        base_ok=_box_base_ok(highs, lows, closes, BASE_MIN_BARS, BASE_MAX_ATR_Q, ind["atr"]),
+        fatigue_long=_fatigue_exhausted(closes, FATIGUE_LOOKBACK, FATIGUE_MIN_STREAK, FATIGUE_TOTAL_MOVE, bullish=True),
+        fatigue_short=_fatigue_exhausted(closes, FATIGUE_LOOKBACK, FATIGUE_MIN_STREAK, FATIGUE_TOTAL_MOVE, bullish=False),
+        t=time.time(),
+    )
+
+# ===== 特徵快取（每根 bar 一份，single-flight） =====
+_CACHE: Dict[str, BarFeatures] = {}
+_INFLIGHT: Dict[str, threading.Event] = {}
+_CACHE_LOCK = threading.Lock()
+_STATS = {"computed": 0, "shared": 0, "skipped": 0, "nodata": 0, "errors": 0}
+_LAST_ERROR = {"msg": None}
+
+def _current(f: Optional[BarFeatures]) -> bool:
+    """快取的特徵是否就是最後一根已收盤 bar 的"""
+    return f is not None and f.bar_ts is not None and f.bar_ts >= last_closed_ts(KLINE_INTERVAL) - 1.0
+
+def get_features(symbol: str) -> Optional[BarFeatures]:
+    """
+    最後一根已收盤 bar 的特徵已算過就直接回快取；同一 symbol 正在計算時等待那一份結果。
+    """
+    with _CACHE_LOCK:
+        f = _CACHE.get(symbol)
+        if _current(f):
+            _STATS["shared"] += 1
+            return f
+        evt = _INFLIGHT.get(symbol)
+        owner = evt is None
+        if owner:
+            evt = _INFLIGHT[symbol] = threading.Event()
+    if not owner:
+        evt.wait(timeout=10.0)
+        with _CACHE_LOCK:
+            _STATS["shared"] += 1
+            return _CACHE.get(symbol)
+    err = None
+    try:
+        f = compute_features(symbol)
+    except Exception as e:
+        f, err = None, f"{type(e).__name__}: {e}"
+    with _CACHE_LOCK:
+        _STATS["computed"] += 1
+        if err is not None:
+            # 例外與「資料不足」分開記：程式錯誤會讓策略整個不觸發，要在面板上看得到
+            _STATS["errors"] += 1
+            if err != _LAST_ERROR["msg"]:
+                logger.warning("compute_features(%s) failed: %s", symbol, err)
+            _LAST_ERROR["msg"] = err
+        elif f is None:
+            _STATS["nodata"] += 1
+        else:
+            _CACHE[symbol] = f
+        _INFLIGHT.pop(symbol, None)
+    evt.set()
+    return f
+
+def feature_stats() -> dict:
+    """
+    {computed, shared, skipped, nodata, errors, last_error}：實際計算次數 / 共用快取次數 /
+    bar 未收盤直接跳過次數 / 資料不足 / compute_features 拋例外的次數與最後一則訊息
+    """
+    with _CACHE_LOCK:
+        st = dict(_STATS)
+        st["last_error"] = _LAST_ERROR["msg"]
+        return st
+
+# ===== 方向規則 + armed/回測狀態機 =====
+def arm_ok(f: BarFeatures, side: str) -> bool:
+    """觸發 armed 的條件（不含回測）"""
+    if side == "LONG":
+        return (f.price > f.prev_high and f.vol_spike and f.vol_cool_ok and f.vwap_dist_ok and f.overextend_ok
+                and f.e_fast > f.e_slow and f.ema_slope > 0.0 and f.base_ok and not f.fatigue_long)
+    return (f.price < f.prev_low and f.vol_spike and f.vol_cool_ok and f.vwap_dist_ok and f.overextend_ok
+            and f.e_fast < f.e_slow and f.ema_slope < 0.0 and f.base_ok and not f.fatigue_short)
+
+class RetestMachine:
+    """
+    (symbol, side) -> {'armed', 'level', 'armed_ts', 'bar_ts', 'seen'}
+    - bar_ts：最後評估過的已收盤 bar；同一根 bar 不會評估第二次
+    - armed_ts：armed 那根 bar 的收盤時間；(bar_ts - armed_ts) / BAR_S 就是經過的 bar 數
+    - seen：最後被詢問的時間；超過 STATE_TTL_S 沒被問到（離開 universe）就清掉
+    """
+
+    def __init__(self, bar_s: float, expire_n: int, ttl_s: float):
+        self.bar_s = float(bar_s)
+        self.expire_n = int(expire_n)
+        self.ttl_s = float(ttl_s)
+        self._st: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _get(self, symbol: str, side: str, now: float) -> dict:
+        st = self._st.get((symbol, side))
+        if st is None:
+            st = self._st[(symbol, side)] = {'armed': False, 'level': None, 'armed_ts': None, 'bar_ts': None, 'seen': now}
+        st['seen'] = now
+        return st
+
+    def pending(self, symbol: str, side: str, closed_ts: float) -> bool:
+        """這個方向是否還有尚未評估的已收盤 bar"""
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            st = self._get(symbol, side, now)
+            return st['bar_ts'] is None or st['bar_ts'] < closed_ts - 1.0
+
+    def skip(self, symbol: str, side: str, closed_ts: float):
+        """這根 bar 沒有可用特徵（資料不足/抓取失敗）：記為已評估，下一根再試"""
+        with self._lock:
+            st = self._get(symbol, side, time.time())
+            st['bar_ts'] = max(st['bar_ts'] or 0.0, closed_ts)
+
+    def step(self, f: BarFeatures, side: str) -> bool:
+        """
+        以一根新收盤 bar 推進：
+        1) 未 armed → 符合條件則 armed（不立刻進），回測位 = 前高（多）/前低（空）
+        2) 已 armed → 收盤回到「回測位 ± buffer」才回 True；超過 RETEST_EXPIRE_N 根失效
+        """
+        now = time.time()
+        with self._lock:
+            st = self._get(f.symbol, side, now)
+            if f.bar_ts is None or (st['bar_ts'] is not None and f.bar_ts <= st['bar_ts']):
+                return False
+            st['bar_ts'] = f.bar_ts
+
+            if not st['armed']:
+                if arm_ok(f, side):
+                    st['armed'] = True
+                    st['level'] = f.prev_high if side == "LONG" else f.prev_low
+                    st['armed_ts'] = f.bar_ts
+                return False  # armed 這根不進，等待回測
+
+            bars = int(round((f.bar_ts - st['armed_ts']) / self.bar_s))
+            expired = bars > self.expire_n
+            retest_ok = (abs(f.price - st['level']) / max(f.price, 1e-9)) <= RETEST_BUFFER_PCT
+            if retest_ok and not expired:
+                self._disarm(st)
+                return True
+            if expired:
+                # 超時失效
+                self._disarm(st)
+            return False
+
+    @staticmethod
+    def _disarm(st: dict):
+        st['armed'] = False
+        st['level'] = None
+        st['armed_ts'] = None
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep < 60.0:
+            return
+        self._last_sweep = now
+        for key in [k for k, st in self._st.items() if now - st['seen'] > self.ttl_s]:
+            self._st.pop(key, None)
+        with _CACHE_LOCK:
+            for sym in [s for s, f in _CACHE.items() if now - f.t > self.ttl_s]:
+                _CACHE.pop(sym, None)
+
+    def snapshot(self) -> Dict[tuple, dict]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._st.items()}
+
+MACHINE = RetestMachine(BAR_S, RETEST_EXPIRE_N, STATE_TTL_S)
+
+def evaluate(symbol: str, side: str) -> bool:
+    """
+    只有出現新的已收盤 bar 時才抓資料、推進狀態機；其餘呼叫直接回 False（零成本）。
+    """
+    try:
+        closed_ts = last_closed_ts(KLINE_INTERVAL)
+        if not MACHINE.pending(symbol, side, closed_ts):
+            with _CACHE_LOCK:
+                _STATS["skipped"] += 1
+            return False
+        f = get_features(symbol)
+        if f is None:
+            MACHINE.skip(symbol, side, closed_ts)
+            return False
+        return MACHINE.step(f, side)
+    except Exception:
+        return False
@@ -5,22 +5,26 @@ import statistics
 import requests
 
 import config
+from indicators import ENGINE
 
-# 優先用 utils.fetch_klines；若不存在則 fallback REST
+# 優先用 kline_provider（WS 1m 快取 + REST 補洞）；其次 utils.fetch_klines；都不行才直接 REST
 try:
-    from utils import fetch_klines as _fetch_klines
+    from kline_provider import get_klines as _fetch_klines
 except Exception:
-    def _fetch_klines(symbol: str, interval: str, limit: int):
-        url = "https://fapi.binance.com/fapi/v1/klines"
-        params = {"symbol": symbol, "interval": interval, "limit": limit}
-        r = requests.get(url, params=params, timeout=8)
-        r.raise_for_status()
-        arr = r.json()
-        closes = [float(x[4]) for x in arr]
-        highs  = [float(x[2]) for x in arr]
-        lows   = [float(x[3]) for x in arr]
-        vols   = [float(x[5]) for x in arr]
-        return closes, highs, lows, vols
+    try:
+        from utils import fetch_klines as _fetch_klines
+    except Exception:
+        def _fetch_klines(symbol: str, interval: str, limit: int):
+            url = "https://fapi.binance.com/fapi/v1/klines"
+            params = {"symbol": symbol, "interval": interval, "limit": limit}
+            r = requests.get(url, params=params, timeout=8)
+            r.raise_for_status()
+            arr = r.json()
+            closes = [float(x[4]) for x in arr]
+            highs  = [float(x[2]) for x in arr]
+            lows   = [float(x[3]) for x in arr]
+            vols   = [float(x[5]) for x in arr]
+            return closes, highs, lows, vols
 
 def _vwap_from_klines(closes, highs, lows, vols) -> Optional[float]:
     if not closes or not vols:
@@ -59,11 +63,13 @@ def scalp_vwap_signal(symbol: str, timeframe: str = "1m") -> ScalpSignal:
         return ScalpSignal(False, "", 0.0, "insufficient-bars")
 
     last = closes[-1]
-    vw = _vwap_from_klines(closes, highs, lows, vols)
+    # 指標引擎已由 kline_provider 對齊；引擎沒有狀態時（走備援 K 線來源）才就地計算
+    ind = ENGINE.values(symbol, timeframe)
+    vw = ind["vwap"] if ind else _vwap_from_klines(closes, highs, lows, vols)
     if vw is None:
         return ScalpSignal(False, "", 0.0, "no-vwap")
 
-    dev = _zscore(closes[-21:])
+    dev = ind["z"] if ind else _zscore(closes[-21:])
     if dev is None:
         return ScalpSignal(False, "", 0.0, "no-z")
 
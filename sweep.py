@@ -0,0 +1,290 @@
+# sweep.py
+# config 策略參數掃描：把參數格點（或隨機抽樣）分給行程池，每組參數跑一次 backtest（全部 symbol），
+# 依 PnL / 回撤排名輸出。
+# - 準備階段：每個 symbol 的 K 線欄位、以及格點會用到的每個指標陣列（前高/前低、VWAP、EMA、ATR、箱體、z）
+#   只算一次，存成 <work>/<SYMBOL>/*.npy；worker 以 np.load(mmap_mode="r") 開啟，
+#   資料在 OS page cache 裡共用，不重算也不複製到每個行程
+# - 每個工作 = 一組參數；組數遠多於核心數時，吞吐隨核心數線性成長
+# - 只影響門檻的參數（VOL_SPIKE_K、VWAP_DIST_MAX、TP/SL、SCALP_Z_THR、RETEST_*…）不需要任何重算
+#
+# 用法：
+#   python sweep.py --grid HH_N=48,60,72 --grid VOL_SPIKE_K=1.5:2.5:0.25 --grid TP_PCT=0.004,0.0055,0.008
+#   python sweep.py --grid SL_PCT=0.003:0.006:0.0005 --grid RETEST_EXPIRE_N=3:9:1 --random 200 --seed 7
+#   python sweep.py --strategy scalp_vwap --grid SCALP_Z_THR=0.8:2.0:0.1 --rank ratio --top 10
+# 範圍寫法 start:stop:step 含 stop；整數參數（HH_N 等）自動取整。結果寫到 --out（CSV，已排名）。
+
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import backtest as bt
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 選配依賴
+    np = None
+
+RANKS = ("pnl", "dd", "ratio")
+
+# ==== 參數空間 ====
+def parse_space(specs: List[str]) -> Dict[str, list]:
+    """["HH_N=48,60,72", "VOL_SPIKE_K=1.5:2.5:0.25"] → {name: [值...]}；名稱必須是 backtest 認得的參數"""
+    space: Dict[str, list] = {}
+    for spec in specs or []:
+        name, _, vals = spec.partition("=")
+        name = name.strip()
+        if name not in bt.PARAM_DEFAULTS:
+            raise KeyError(f"unknown backtest param: {name}")
+        if ":" in vals:
+            a, b, s = (float(x) for x in vals.split(":"))
+            n = int(round((b - a) / s)) + 1 if s > 0 else 1
+            out = [round(a + i * s, 10) for i in range(max(n, 1))]
+        else:
+            out = [float(x) for x in vals.split(",") if x.strip()]
+        if name in bt._INT_PARAMS:
+            out = [int(round(x)) for x in out]
+        space[name] = list(dict.fromkeys(out))     # 去重、保留順序
+    return space
+
+def grid_points(space: Dict[str, list]) -> List[dict]:
+    names = list(space)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(space[n] for n in names))]
+
+def random_points(space: Dict[str, list], n: int, seed: Optional[int] = None) -> List[dict]:
+    """從格點裡不重複抽 n 組（格點比 n 少就全跑）"""
+    total = 1
+    for v in space.values():
+        total *= len(v)
+    if n >= total:
+        return grid_points(space)
+    rng = random.Random(seed)
+    seen, out = set(), []
+    while len(out) < n:
+        pt = {k: rng.choice(v) for k, v in space.items()}
+        key = tuple(pt.values())
+        if key not in seen:
+            seen.add(key)
+            out.append(pt)
+    return out
+
+# ==== 共用陣列（memmap） ====
+_COLS = ("ts", "o", "h", "l", "c", "v")
+
+def _key_path(d: str, key) -> str:
+    return os.path.join(d, f"{key[0]}_{key[1]}.npy")
+
+def _save(path: str, arr):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, np.ascontiguousarray(arr))
+    os.replace(tmp, path)
+
+class MemmapCache:
+    """backtest 指標快取的唯讀版：先找 <dir>/<名稱>_<n>.npy（memmap），沒有才就地算（只留在本行程）"""
+
+    def __init__(self, d: str):
+        self.d = d
+        self._local: dict = {}
+
+    def get(self, key):
+        v = self._local.get(key)
+        if v is None:
+            try:
+                v = self._local[key] = np.load(_key_path(self.d, key), mmap_mode="r")
+            except (OSError, ValueError):
+                return None
+        return v
+
+    def __setitem__(self, key, value):
+        self._local[key] = value
+
+def _open_bars(d: str) -> Optional[dict]:
+    try:
+        a = np.load(os.path.join(d, "bars.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return dict(zip(_COLS, a))
+
+def _prepare_one(args) -> int:
+    """一個 symbol：K 線轉成 (6, n) 連續欄位 + 算缺的指標陣列；來源較新就全部重建。回傳根數"""
+    symbol, root, interval, work, keys = args
+    d = os.path.join(work, symbol)
+    src = os.path.join(root, interval, ".npy", f"{symbol}.npy")
+    bars = bt.load_klines(symbol, root, interval)
+    if bars is None:
+        return 0
+    dst = os.path.join(d, "bars.npy")
+    os.makedirs(d, exist_ok=True)
+    try:
+        stale = os.path.getmtime(dst) < os.path.getmtime(src)
+    except OSError:
+        stale = True
+    if stale:
+        for f in os.listdir(d):
+            if f.endswith(".npy"):
+                os.remove(os.path.join(d, f))
+        _save(dst, np.stack([bars[k] for k in _COLS]))
+    for key in keys:
+        path = _key_path(d, key)
+        if not os.path.exists(path):
+            _save(path, bt.INDICATORS[key[0]](bars, key[1]))
+    return len(bars["c"])
+
+def prepare(symbols: List[str], root: str, interval: str, work: str, points: List[dict],
+            strategy: str, workers: int) -> int:
+    """所有參數組會用到的指標 key 取聯集，每個 symbol 各算一次存檔；回傳總根數"""
+    keys = set()
+    for pt in points:
+        keys.update(bt.indicator_keys(bt.default_params(**pt), strategy))
+    jobs = [(s, root, interval, work, sorted(keys)) for s in symbols]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            return sum(ex.map(_prepare_one, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    return sum(_prepare_one(j) for j in jobs)
+
+# ==== worker ====
+_W: dict = {}
+
+def _init_worker(work: str, symbols: List[str], interval: str, strategy: str, start_ts, end_ts,
+                 time_stop_bars: int, equity: float, independent: bool):
+    _W.update(work=work, symbols=symbols, bar_s=bt._interval_seconds(interval), strategy=strategy,
+              start_ts=start_ts, end_ts=end_ts, time_stop_bars=time_stop_bars, equity=equity,
+              independent=independent, data={})
+
+def _data(symbol: str):
+    """(bars, cache)；每個 worker 只開一次 memmap"""
+    got = _W["data"].get(symbol)
+    if got is None:
+        d = os.path.join(_W["work"], symbol)
+        got = _W["data"][symbol] = (_open_bars(d), MemmapCache(d))
+    return got
+
+def _run_point(i: int, point: dict):
+    p = bt.default_params(**point)
+    raw = []
+    for s in _W["symbols"]:
+        bars, cache = _data(s)
+        if bars is None:
+            continue
+        trades = bt.simulate(s, bars, p, _W["bar_s"], _W["time_stop_bars"], cache, _W["strategy"])
+        raw.extend(bt.clip_trades(trades, _W["start_ts"], _W["end_ts"]))
+    res = bt.summarize(bt.portfolio(raw, _W["equity"], _W["independent"]))
+    res["signals"] = len(raw)
+    return i, res
+
+# ==== 排名 / 輸出 ====
+def rank(rows: List[dict], by: str = "pnl") -> List[dict]:
+    """pnl：PnL 高→低、同分回撤小優先；dd：回撤小→大、同分 PnL 高優先；ratio：PnL / 回撤"""
+    if by == "dd":
+        key = lambda r: (r["max_dd_pct"], -r["pnl_pct"])
+    elif by == "ratio":
+        key = lambda r: (-r["ratio"], r["max_dd_pct"])
+    else:
+        key = lambda r: (-r["pnl_pct"], r["max_dd_pct"])
+    return sorted(rows, key=key)
+
+def write_results(rows: List[dict], names: List[str], path: str):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["rank"] + names + ["trades", "win_rate", "pnl_pct", "max_dd_pct", "ratio", "signals"])
+        for n, r in enumerate(rows, 1):
+            w.writerow([n] + [r["params"][k] for k in names]
+                       + [r["trades"], f"{r['win_rate'] * 100:.2f}", f"{r['pnl_pct'] * 100:.4f}",
+                          f"{r['max_dd_pct'] * 100:.4f}", f"{r['ratio']:.3f}", r["signals"]])
+
+def sweep(points: List[dict], symbols: Optional[List[str]] = None, root: str = bt.DATA_DIR,
+          interval: Optional[str] = None, strategy: str = "volume", workers: int = 1,
+          work: Optional[str] = None, start_ts: Optional[float] = None, end_ts: Optional[float] = None,
+          time_stop_bars: Optional[int] = None, equity: float = 10000.0, independent: bool = False,
+          progress=None) -> dict:
+    """
+    跑完全部參數組 → {rows（未排名，每列含 params + summarize 的欄位 + ratio）, bars, prep_s, run_s}。
+    progress(done, total) 每完成一組呼叫一次。
+    """
+    bt._need_numpy()
+    interval = interval or bt.default_interval(strategy)
+    if time_stop_bars is None:
+        time_stop_bars = bt.default_time_stop(strategy, bt._interval_seconds(interval))
+    symbols = symbols or bt.list_symbols(root, interval)
+    work = work or os.path.join(root, interval, ".sweep")
+    t0 = time.perf_counter()
+    nbars = prepare(symbols, root, interval, work, points, strategy, workers)
+    t1 = time.perf_counter()
+    rows: List[Optional[dict]] = [None] * len(points)
+    init = (work, symbols, interval, strategy, start_ts, end_ts, time_stop_bars, equity, independent)
+    if workers > 1 and len(points) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as ex:
+            futs = [ex.submit(_run_point, i, pt) for i, pt in enumerate(points)]
+            for done, fut in enumerate(as_completed(futs), 1):
+                i, res = fut.result()
+                rows[i] = res
+                if progress:
+                    progress(done, len(points))
+    else:
+        _init_worker(*init)
+        for done, pt in enumerate(points, 1):
+            i, res = _run_point(done - 1, pt)
+            rows[i] = res
+            if progress:
+                progress(done, len(points))
+    for pt, r in zip(points, rows):
+        r["params"] = pt
+        dd = r["max_dd_pct"]
+        r["ratio"] = r["pnl_pct"] / dd if dd > 0 else (float("inf") if r["pnl_pct"] > 0 else 0.0)
+    return {"rows": rows, "bars": nbars, "symbols": len(symbols), "prep_s": t1 - t0,
+            "run_s": time.perf_counter() - t1}
+
+def main():
+    ap = argparse.ArgumentParser(description="Parallel parameter sweep over the vectorized backtester")
+    ap.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2|START:STOP:STEP",
+                    help="掃描的參數（可重複）；沒列到的用 config 的值")
+    ap.add_argument("--random", type=int, default=0, help="隨機抽 N 組（0 = 完整格點）")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--strategy", default="volume", choices=bt.STRATEGIES)
+    ap.add_argument("--root", default=bt.DATA_DIR)
+    ap.add_argument("--interval", default=None)
+    ap.add_argument("--symbols", default=None, help="逗號分隔；預設目錄下全部")
+    ap.add_argument("--start", default=None, help="YYYY-MM-DD（含）")
+    ap.add_argument("--end", default=None, help="YYYY-MM-DD（不含）")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--work", default=None, help="共用陣列目錄（預設 <root>/<interval>/.sweep，可重用）")
+    ap.add_argument("--time-stop-bars", type=int, default=None)
+    ap.add_argument("--equity", type=float, default=float(os.getenv("EQUITY_USDT", "10000")))
+    ap.add_argument("--independent", action="store_true", help="每檔各自獨立（不套單一持倉/日停機）")
+    ap.add_argument("--rank", default="pnl", choices=RANKS)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--out", default="sweep_results.csv")
+    args = ap.parse_args()
+
+    bt._need_numpy()
+    space = parse_space(args.grid)
+    points = random_points(space, args.random, args.seed) if args.random else grid_points(space)
+    symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()] if args.symbols else None
+
+    def _progress(done, total):
+        if done == total or done % max(1, total // 20) == 0:
+            print(f"\r{done}/{total}", end="", flush=True)
+
+    res = sweep(points, symbols, args.root, args.interval, args.strategy, args.workers, args.work,
+                bt._day_ts(args.start), bt._day_ts(args.end), args.time_stop_bars, args.equity,
+                args.independent, _progress)
+    print()
+    rows = rank(res["rows"], args.rank)
+    names = list(space)
+    write_results(rows, names, args.out)
+    n = len(rows)
+    print(f"{n} param sets × {res['symbols']} symbols ({res['bars']:,} bars) on {args.workers} workers: "
+          f"prepare {res['prep_s']:.1f}s, sweep {res['run_s']:.1f}s ({n / max(res['run_s'], 1e-9):.2f} sets/s)")
+    print(f"{'#':>3}  " + "  ".join(f"{k:>14}" for k in names) + f"  {'trades':>7} {'win%':>6} {'PnL%':>9} {'maxDD%':>8} {'ratio':>7}")
+    for i, r in enumerate(rows[:args.top], 1):
+        print(f"{i:>3}  " + "  ".join(f"{r['params'][k]:>14}" for k in names)
+              + f"  {r['trades']:>7} {r['win_rate'] * 100:>6.1f} {r['pnl_pct'] * 100:>+9.2f} "
+                f"{r['max_dd_pct'] * 100:>8.2f} {r['ratio']:>7.2f}")
+    print(f"→ {args.out}")
+
+if __name__ == "__main__":
+    main()
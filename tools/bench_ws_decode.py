@@ -0,0 +1,104 @@
+# tools/bench_ws_decode.py
+# WS 熱路徑微基準：每個可用的 JSON 後端，量「只解碼」與「解碼 + 分派到 ws_client handler」的
+# 單執行緒吞吐（= 每核心每秒訊息數）。
+#
+# 用法（在 repo 根目錄）：
+#   python tools/bench_ws_decode.py                       # 用合成的 depth5/aggTrade/ticker/kline 混合訊息
+#   python tools/bench_ws_decode.py --file msgs.jsonl     # 每行一則錄下來的原始 WS 訊息
+#   python tools/bench_ws_decode.py --n 200000 --backend orjson json
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ws_codec  # noqa: E402
+import ws_client  # noqa: E402
+
+def synth_payloads(n: int, symbols=("BTCUSDT", "ETHUSDT", "SOLUSDT", "BNBUSDT")):
+    """依實盤大致比例合成：depth5 40%、aggTrade 40%、ticker 15%、kline 5%（其中少數已收盤）"""
+    out = []
+    t0 = 1_700_000_000_000
+    for i in range(n):
+        s = random.choice(symbols)
+        p = 100.0 + random.random()
+        r = random.random()
+        if r < 0.40:
+            msg = {"e": "depthUpdate", "E": t0 + i, "T": t0 + i, "s": s, "U": i, "u": i + 1, "pu": i - 1,
+                   "b": [[f"{p - 0.01 * k:.2f}", f"{random.random() * 5:.3f}"] for k in range(5)],
+                   "a": [[f"{p + 0.01 * (k + 1):.2f}", f"{random.random() * 5:.3f}"] for k in range(5)]}
+        elif r < 0.80:
+            msg = {"e": "aggTrade", "E": t0 + i, "s": s, "a": i, "p": f"{p:.2f}", "q": f"{random.random():.3f}",
+                   "f": i, "l": i, "T": t0 + i, "m": random.random() < 0.5}
+        elif r < 0.95:
+            msg = {"e": "24hrTicker", "E": t0 + i, "s": s, "p": "1.0", "P": "1.0", "w": f"{p:.2f}", "c": f"{p:.2f}",
+                   "Q": "0.1", "o": "99", "h": "101", "l": "98", "v": "1000", "q": "100000",
+                   "O": t0, "C": t0 + i, "F": 0, "L": i, "n": i}
+        else:
+            msg = {"e": "kline", "E": t0 + i, "s": s,
+                   "k": {"t": t0 + i * 60000, "T": t0 + i * 60000 + 59999, "s": s, "i": "1m", "f": 0, "L": 1,
+                         "o": f"{p:.2f}", "c": f"{p:.2f}", "h": f"{p + 0.1:.2f}", "l": f"{p - 0.1:.2f}",
+                         "v": "10", "n": 5, "x": random.random() < 0.1, "q": "1000", "V": "5", "Q": "500", "B": "0"}}
+        out.append(json.dumps(msg, separators=(",", ":")))
+    return out
+
+def load_payloads(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+def _rate(fn, msgs, repeat: int):
+    best = 0.0
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(msgs)
+        dt = time.perf_counter() - t
+        best = max(best, len(msgs) / dt if dt > 0 else 0.0)
+    return best
+
+def bench(backend: str, msgs, repeat: int):
+    name, dec = ws_codec.make_decoder(backend)
+    if name != backend:
+        return None
+    as_bytes = [m.encode() for m in msgs]   # websockets 給 str；部分後端吃 bytes 更快，兩種都量
+
+    def decode_only(ms):
+        for m in ms:
+            dec(m)
+
+    def decode_dispatch(ms):
+        handle = ws_client._handle_event
+        for m in ms:
+            payload = dec(m)
+            handle(payload.get("data", payload))
+
+    return {
+        "decode_str": _rate(decode_only, msgs, repeat),
+        "decode_bytes": _rate(decode_only, as_bytes, repeat),
+        "decode+dispatch": _rate(decode_dispatch, msgs, repeat),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="WS decode/dispatch micro-benchmark")
+    ap.add_argument("--file", help="每行一則原始 WS 訊息（JSON 文字）")
+    ap.add_argument("--n", type=int, default=100_000, help="合成訊息數（未指定 --file 時）")
+    ap.add_argument("--repeat", type=int, default=3, help="每項重複次數（取最佳）")
+    ap.add_argument("--backend", nargs="*", default=None, help="要量的後端；預設全部可用的")
+    args = ap.parse_args()
+
+    msgs = load_payloads(args.file) if args.file else synth_payloads(args.n)
+    backends = args.backend or list(ws_codec.available())
+    print(f"{len(msgs)} messages, backends: {', '.join(backends)} (ws_client 目前使用: {ws_codec.BACKEND})")
+    print(f"{'backend':<10}{'decode(str)':>16}{'decode(bytes)':>16}{'decode+dispatch':>18}   msg/s per core")
+    for b in backends:
+        r = bench(b, msgs, args.repeat)
+        if r is None:
+            print(f"{b:<10}{'(not installed)':>16}")
+            continue
+        print(f"{b:<10}{r['decode_str']:>16,.0f}{r['decode_bytes']:>16,.0f}{r['decode+dispatch']:>18,.0f}")
+
+if __name__ == "__main__":
+    main()
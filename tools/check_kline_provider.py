@@ -0,0 +1,67 @@
+# tools/check_kline_provider.py
+# kline_provider 離線自檢：REST 換成合成的 Binance K 線，實際跑一遍非 1m 週期
+# （get_klines / get_closed_klines）與 signal_core.compute_features，K 線庫開/關各一次。
+# 任何一步拋例外或結果不對就以非 0 結束。
+#
+# 用法（在 repo 根目錄）：
+#   python tools/check_kline_provider.py
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kline_provider  # noqa: E402
+import kline_store  # noqa: E402
+import signal_core  # noqa: E402
+import utils  # noqa: E402
+from indicators import ENGINE  # noqa: E402
+
+INTERVALS = ("5m", "15m", "1h")
+
+def fake_klines(path, params=None, timeout=None, tries=None):
+    """/fapi/v1/klines 的合成回應：每根收盤價 = 100 + 序號，最後一根未收盤；支援 limit / startTime"""
+    assert path == "/fapi/v1/klines", path
+    step = kline_provider.interval_seconds(params["interval"]) * 1000
+    now = utils.now_ts_ms()
+    open_last = (now // step) * step                  # 未收盤那根的開盤時間
+    limit = int(params["limit"])
+    start = params.get("startTime")
+    first = open_last - (limit - 1) * step if start is None else (int(start) // step) * step
+    out = []
+    for t in range(first, open_last + 1, step):
+        i = t // step
+        c = 100.0 + (i % 1000) * 0.01
+        out.append([t, f"{c - 0.005}", f"{c + 0.02}", f"{c - 0.02}", f"{c}", f"{10 + i % 7}", t + step - 1])
+    return out[:limit]
+
+def check(store: bool):
+    utils.KLINE_STORE = store
+    for iv in INTERVALS:
+        ENGINE.drop("CHKUSDT", iv)
+        closes, highs, lows, vols = kline_provider.get_klines("CHKUSDT", iv, 120)
+        assert len(closes) == len(highs) == len(lows) == len(vols) == 120, (iv, len(closes))
+        assert all(h >= c >= l for c, h, l in zip(closes, highs, lows)), iv
+        closes, highs, lows, vols, last_ts = kline_provider.get_closed_klines("CHKUSDT", iv, 120)
+        assert len(closes) == 120, (iv, len(closes))
+        assert last_ts is not None and last_ts <= kline_provider.last_closed_ts(iv) + 1e-3, (iv, last_ts)
+        assert ENGINE.values("CHKUSDT", iv, use_live=False), iv
+    f = signal_core.compute_features("CHKUSDT")
+    assert f is not None and f.bar_ts is not None, f
+    print(f"ok  store={'on ' if store else 'off'}  {', '.join(INTERVALS)}  features@{time.strftime('%H:%M', time.localtime(f.bar_ts))}")
+
+def main():
+    utils._rest_json = fake_klines
+    with tempfile.TemporaryDirectory() as d:
+        kline_store.STORE_DIR = d
+        try:
+            check(store=False)
+            check(store=True)
+        finally:
+            kline_store.close_all()
+    print(kline_provider.provider_stats())
+
+if __name__ == "__main__":
+    main()
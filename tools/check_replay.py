@@ -0,0 +1,78 @@
+# tools/check_replay.py
+# replay 離線自檢：合成 2 個 symbol、跨本地午夜的 6 小時 WS 事件（aggTrade + 1m kline），
+# 用一個固定觸發的測試策略跑 ReplayEngine.run，檢查成交數、出場原因與 DayGuard 換日。
+# 任何一項不符就以非 0 結束。
+#
+# 用法（在 repo 根目錄）：
+#   python tools/check_replay.py
+
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import replay  # noqa: E402
+
+SYMBOLS = ("AAAUSDT", "BBBUSDT")
+HOURS = 6
+CYCLE_MIN = 30          # 價格每 30 分鐘從 100 線性爬到 101 再回到 100
+
+def _price(minute: int, sec: int) -> float:
+    return 100.0 * (1.0 + 0.01 * ((minute % CYCLE_MIN) * 60 + sec) / (CYCLE_MIN * 60))
+
+def synth_events(start: float):
+    """每個 symbol 每 10 秒一筆 aggTrade，每分鐘一根已收盤 1m kline；依時間排序"""
+    out = []
+    for m in range(HOURS * 60):
+        t0 = int((start + m * 60) * 1000)
+        for s in SYMBOLS:
+            ps = []
+            for sec in range(0, 60, 10):
+                p = _price(m, sec)
+                ps.append(p)
+                out.append((t0 + sec * 1000 + 1, {"e": "aggTrade", "E": t0 + sec * 1000 + 1, "s": s,
+                                                    "p": f"{p:.6f}", "q": "1.0", "m": False}))
+            close = _price(m + 1, 0) if (m + 1) % CYCLE_MIN else ps[-1]
+            k = {"t": t0, "T": t0 + 59_999, "i": "1m", "x": True, "o": f"{ps[0]:.6f}",
+                 "h": f"{max(ps + [close]):.6f}", "l": f"{min(ps):.6f}", "c": f"{close:.6f}", "v": "6.0"}
+            out.append((t0 + 59_999, {"e": "kline", "E": t0 + 59_999, "s": s, "k": k}))
+    out.sort(key=lambda x: x[0])
+    return [(ts / 1000.0, d) for ts, d in out]
+
+def cycle_strategy(symbol: str):
+    """每個循環的起點（第 0 分鐘那根收盤）做多一次"""
+    minute = int(time.time() // 60)
+    ok = minute % CYCLE_MIN == 0
+    return SimpleNamespace(ok=ok, side="LONG", entry=None, reason="cycle")
+
+def main():
+    midnight = datetime.combine(datetime.now().date(), datetime.min.time())
+    start = (midnight - timedelta(hours=HOURS // 2)).timestamp()
+    start -= start % (CYCLE_MIN * 60)
+    events = synth_events(start)
+    with tempfile.TemporaryDirectory() as d:
+        eng = replay.ReplayEngine([("cycle", "1m", cycle_strategy)], equity=10000.0,
+                                  journal_path=str(Path(d) / "journal.csv"), cooldown_s=0.0)
+        res = eng.run(events)
+        rows = (Path(d) / "journal.csv").read_text().strip().splitlines()
+
+    done = [t for t in eng.trades if "exit" in t]
+    n_cycles = HOURS * 60 // CYCLE_MIN
+    after = [t for t in done if t["exit_ts"] >= midnight.timestamp()]
+    assert res["events"] == len(events), res
+    assert res["bars"] == HOURS * 60 * len(SYMBOLS), res
+    assert len(done) == n_cycles, (len(done), n_cycles)            # 同時只持有 1 筆：每個循環 1 筆
+    assert all(t["reason"] == "TP" and t["ret_pct"] > 0 for t in done), done
+    assert res["open"] == 0, res
+    assert eng.day.state.key == midnight.date().isoformat(), ("DayGuard did not roll over", eng.day.state.key)
+    assert eng.day.state.trades == len(after), (eng.day.state.trades, len(after))
+    assert len(rows) >= len(done), rows
+    print(f"ok  {res['events']} events, {res['trades']} trades ({len(after)} after rollover), "
+          f"sim {res['sim_s'] / 3600:.1f}h in {res['wall_s']:.2f}s")
+
+if __name__ == "__main__":
+    main()
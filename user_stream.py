@@ -0,0 +1,293 @@
+# user_stream.py
+# 幣安 USDⓈ-M 使用者資料串流（listenKey）：
+# - 建 key、每 USER_STREAM_KEEPALIVE_S 續命、斷線/過期自動重建重連
+# - ORDER_TRADE_UPDATE / ACCOUNT_UPDATE 寫進記憶體內的訂單簿與倉位簿
+# - LiveAdapter 用 wait_order / wait_position 等事件，不再輪詢 REST
+# - 每次（重）連線先用 REST 快照（positionRisk + openOrders）重建倉位簿/未成交單，才標記為在線：
+#   斷線期間成交的 TP/SL 不會留下過期的倉位數量
+
+import asyncio
+import json
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import websockets
+
+import config
+from utils import SESSION
+from rate_governor import governed_request, PRIO_ACCOUNT
+
+USER_STREAM_KEEPALIVE_S = float(getattr(config, "USER_STREAM_KEEPALIVE_S", 1800))
+
+_WS_HOST = {
+    "test": "wss://stream.binancefuture.com",
+    "main": "wss://fstream.binance.com",
+}
+
+_TERMINAL = ("FILLED", "CANCELED", "EXPIRED", "REJECTED", "EXPIRED_IN_MATCH")
+_CLOSE_TYPES = ("TAKE_PROFIT_MARKET", "STOP_MARKET")
+
+def is_close_fill(rec: dict) -> bool:
+    """平倉成交：reduce-only / closePosition，或交易所端的 TP/SL 單"""
+    return bool(rec.get("reduceOnly") or rec.get("closePosition") or rec.get("origType") in _CLOSE_TYPES)
+
+class UserDataStream:
+    def __init__(self, api_key: str, rest_base: str, use_testnet: bool,
+                 snapshot: Optional[Callable[[], tuple]] = None):
+        """snapshot() -> (positionRisk 列表, openOrders 列表)；需要簽名，由 LiveAdapter 提供"""
+        self.key = api_key
+        self._snapshot = snapshot
+        self.rest_base = rest_base
+        self.ws_base = _WS_HOST["test"] if use_testnet else _WS_HOST["main"]
+        self._cond = threading.Condition()
+        self._orders: Dict[str, dict] = {}        # orderId(str) -> 最新一筆 order 事件
+        self._client_ids: Dict[str, str] = {}     # clientOrderId -> orderId
+        self._positions: Dict[str, dict] = {}     # symbol -> {"amt","entry","ts"}
+        self._last_fill: Dict[str, dict] = {}     # symbol -> 最近一筆 FILLED 訂單
+        self._last_close: Dict[str, dict] = {}    # symbol -> 最近一筆 FILLED 平倉單（is_close_fill）
+        self._listen_key: Optional[str] = None
+        self._connected = False
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        self._listeners = []                      # fn(event_type, symbol)，在串流執行緒上呼叫
+        self.stats = {"events": 0, "reconnects": 0, "keepalives": 0, "resyncs": 0}
+
+    def add_listener(self, fn: Callable[[str, Optional[str]], None]):
+        """訂單/倉位簿更新後通知（例如投遞到事件核心）；請保持輕量"""
+        self._listeners.append(fn)
+
+    def _notify(self, et: str, symbol: Optional[str]):
+        for fn in self._listeners:
+            try:
+                fn(et, symbol)
+            except Exception:
+                pass
+
+    # ---------- listenKey REST ----------
+    def _listen_key_req(self, method: str) -> Optional[str]:
+        r = governed_request(SESSION, method, f"{self.rest_base}/fapi/v1/listenKey", prio=PRIO_ACCOUNT,
+                             headers={"X-MBX-APIKEY": self.key}, timeout=10)
+        r.raise_for_status()
+        return (r.json() or {}).get("listenKey")
+
+    # ---------- 事件處理 ----------
+    def _on_event(self, data: dict):
+        et = data.get("e")
+        now = time.time()
+        if et == "ORDER_TRADE_UPDATE":
+            o = data.get("o") or {}
+            oid = str(o.get("i"))
+            rec = {
+                "symbol": o.get("s"), "orderId": oid, "clientOrderId": o.get("c"),
+                "side": o.get("S"), "type": o.get("o"), "origType": o.get("ot"),
+                "status": o.get("X"), "avgPrice": _f(o.get("ap")), "lastPrice": _f(o.get("L")),
+                "filledQty": _f(o.get("z")), "reduceOnly": bool(o.get("R")),
+                "closePosition": bool(o.get("cp")), "ts": now,
+            }
+            with self._cond:
+                self._orders[oid] = rec
+                if rec["clientOrderId"]:
+                    self._client_ids[rec["clientOrderId"]] = oid
+                if rec["status"] == "FILLED" and rec["symbol"]:
+                    self._last_fill[rec["symbol"]] = rec
+                    if is_close_fill(rec):
+                        self._last_close[rec["symbol"]] = rec
+                self._cond.notify_all()
+            self._notify(et, rec["symbol"])
+        elif et == "ACCOUNT_UPDATE":
+            a = data.get("a") or {}
+            with self._cond:
+                for p in a.get("P") or []:
+                    s = p.get("s")
+                    if not s:
+                        continue
+                    # 單向持倉只看 BOTH；雙向模式各 side 分開時以淨額記錄
+                    ps = p.get("ps", "BOTH")
+                    amt = _f(p.get("pa")) or 0.0
+                    if ps == "SHORT":
+                        amt = -abs(amt)
+                    self._positions[s] = {"amt": amt, "entry": _f(p.get("ep")), "ts": now}
+                self._cond.notify_all()
+            for p in a.get("P") or []:
+                self._notify(et, p.get("s"))
+        elif et == "listenKeyExpired":
+            raise ConnectionResetError("listenKey expired")
+        self.stats["events"] += 1
+
+    def _resync(self):
+        """以 REST 快照重建倉位簿；未成交但不在 openOrders 裡的單（斷線期間成交/取消）從訂單簿移除"""
+        if self._snapshot is None:
+            return
+        positions, open_orders = self._snapshot()
+        now = time.time()
+        book: Dict[str, dict] = {}
+        for p in positions or []:
+            s = p.get("symbol")
+            if not s:
+                continue
+            amt = (_f(p.get("positionAmt")) or 0.0) + (book[s]["amt"] if s in book else 0.0)  # 雙向持倉取淨額
+            book[s] = {"amt": amt, "entry": _f(p.get("entryPrice")), "ts": now}
+        live = {str(o.get("orderId")) for o in open_orders or []}
+        with self._cond:
+            self._positions = book
+            for oid in [oid for oid, rec in self._orders.items()
+                        if rec["status"] not in _TERMINAL and oid not in live]:
+                rec = self._orders.pop(oid)
+                self._client_ids.pop(rec.get("clientOrderId"), None)
+            for o in open_orders or []:
+                oid = str(o.get("orderId"))
+                rec = {
+                    "symbol": o.get("symbol"), "orderId": oid, "clientOrderId": o.get("clientOrderId"),
+                    "side": o.get("side"), "type": o.get("type"), "origType": o.get("origType"),
+                    "status": o.get("status"), "avgPrice": _f(o.get("avgPrice")), "lastPrice": None,
+                    "filledQty": _f(o.get("executedQty")), "reduceOnly": bool(o.get("reduceOnly")),
+                    "closePosition": bool(o.get("closePosition")), "ts": now,
+                }
+                self._orders[oid] = rec
+                if rec["clientOrderId"]:
+                    self._client_ids[rec["clientOrderId"]] = oid
+            self._cond.notify_all()
+        self.stats["resyncs"] += 1
+
+    # ---------- 主循環 ----------
+    async def _keepalive(self):
+        loop = asyncio.get_running_loop()
+        while not self._stop:
+            await asyncio.sleep(USER_STREAM_KEEPALIVE_S)
+            try:
+                await loop.run_in_executor(None, self._listen_key_req, "PUT")
+                self.stats["keepalives"] += 1
+            except Exception:
+                return  # 續命失敗：讓主循環重建 key
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stop:
+            ka = None
+            try:
+                self._listen_key = await loop.run_in_executor(None, self._listen_key_req, "POST")
+                url = f"{self.ws_base}/ws/{self._listen_key}"
+                async with websockets.connect(url, ping_interval=15, ping_timeout=15, close_timeout=5) as ws:
+                    # 先連上再拍快照：快照之後的事件都會在 socket 裡排隊，之後照順序套用
+                    await loop.run_in_executor(None, self._resync)
+                    self._connected = True
+                    ka = asyncio.ensure_future(self._keepalive())
+                    while not self._stop:
+                        if ka.done():
+                            break
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(), timeout=30)
+                        except asyncio.TimeoutError:
+                            continue
+                        try:
+                            data = json.loads(raw)
+                        except Exception:
+                            continue
+                        if isinstance(data, dict):
+                            self._on_event(data)
+            except Exception:
+                pass
+            finally:
+                self._connected = False
+                if ka is not None:
+                    ka.cancel()
+            if not self._stop:
+                self.stats["reconnects"] += 1
+                await asyncio.sleep(1.0)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+
+        def _t():
+            try:
+                asyncio.run(self._run())
+            except Exception:
+                pass
+
+        self._thread = threading.Thread(target=_t, daemon=True, name="user-stream")
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=0.5)
+        self._thread = None
+
+    # ---------- 對外查詢 ----------
+    def alive(self) -> bool:
+        return self._connected
+
+    def get_order(self, order_id=None, client_id=None) -> Optional[dict]:
+        with self._cond:
+            if order_id is None and client_id is not None:
+                order_id = self._client_ids.get(client_id)
+            rec = self._orders.get(str(order_id)) if order_id is not None else None
+            return dict(rec) if rec else None
+
+    def wait_order(self, order_id, timeout: float, statuses=_TERMINAL) -> Optional[dict]:
+        """等到訂單進入 statuses 之一；逾時回傳目前已知狀態（可能為 None）"""
+        oid = str(order_id)
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                rec = self._orders.get(oid)
+                if rec and rec["status"] in statuses:
+                    return dict(rec)
+                left = deadline - time.time()
+                if left <= 0:
+                    return dict(rec) if rec else None
+                self._cond.wait(timeout=left)
+
+    def position_amt(self, symbol: str) -> Optional[float]:
+        """串流上看到的倉位數量；還沒收到過該 symbol 的 ACCOUNT_UPDATE 時回 None"""
+        with self._cond:
+            p = self._positions.get(symbol)
+            return p["amt"] if p else None
+
+    def position_ts(self, symbol: str) -> float:
+        with self._cond:
+            p = self._positions.get(symbol)
+            return p["ts"] if p else 0.0
+
+    def wait_position(self, symbol: str, pred: Callable[[float], bool], timeout: float) -> bool:
+        """等到 pred(倉位數量) 成立"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                p = self._positions.get(symbol)
+                if p and pred(p["amt"]):
+                    return True
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(timeout=left)
+
+    def last_fill(self, symbol: str) -> Optional[dict]:
+        with self._cond:
+            rec = self._last_fill.get(symbol)
+            return dict(rec) if rec else None
+
+    def wait_close_fill(self, symbol: str, since: float, timeout: float) -> Optional[dict]:
+        """
+        等 since 之後的平倉成交（is_close_fill）。ACCOUNT_UPDATE 常比平倉的 ORDER_TRADE_UPDATE 先到，
+        這時 last_fill 還是進場那筆，不能拿來當出場價；逾時回 None
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                rec = self._last_close.get(symbol)
+                if rec and rec["ts"] >= since:
+                    return dict(rec)
+                left = deadline - time.time()
+                if left <= 0:
+                    return None
+                self._cond.wait(timeout=left)
+
+def _f(v) -> Optional[float]:
+    try:
+        return float(v)
+    except Exception:
+        return None
@@ -2,9 +2,17 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import time,math
 import statistics
+import threading
 import requests
-from datetime import datetime, timezone
+from array import array
 from config import BINANCE_FUTURES_BASE, SYMBOL_BLACKLIST
+import config
+from rest_client import get_json as rest_get_json
+import kline_store
+from rate_governor import governed_request, PRIO_ACCOUNT
+
+TICKER_SNAPSHOT_TTL_S = float(getattr(config, "TICKER_SNAPSHOT_TTL_S", 1.0))
+KLINE_STORE = bool(getattr(config, "KLINE_STORE", True))     # K 線走本機 mmap 庫（增量補抓）
 
 SESSION = requests.Session()
 SESSION.headers.update({"User-Agent": "daily-gainer-bot/vC"})
@@ -15,7 +23,7 @@ EXCHANGE_INFO = {}
 FUTURE_KEYS = set()
 
 def now_ts_ms():
-    return int(datetime.now(timezone.utc).timestamp() * 1000)
+    return int(time.time() * 1000)
 # utils.py（任一合適位置）
 def ws_best_price(symbol: str):
     try:
@@ -23,56 +31,131 @@ def ws_best_price(symbol: str):
         return _ws(symbol)
     except Exception:
         return None
-# --- 安全版：Top Losers（跌幅榜），和 fetch_top_gainers 結構一致 ---
+# ==== 24hr ticker 排行快照：一次下載、一次解析，漲跌榜都從這裡切 ====
+class RankingSnapshot:
+    """
+    /fapi/v1/ticker/24hr 的欄式快照。
+    - 建構時只解析一次（過濾規則與舊版 fetch_top_gainers/losers 相同）
+    - _order 依 pct 由大到小排好；gainers 從頭取、losers 從尾取
+    - futures_only=True 時再以 FUTURE_KEYS 過濾（不需重抓）
+    """
+    __slots__ = ("ts", "symbols", "pcts", "lasts", "vols", "_order")
+
+    def __init__(self, items, ts=None):
+        # items: iterable of (symbol, pct, last, vol)，已轉成 float
+        self.ts = time.time() if ts is None else ts
+        self.symbols = []
+        self.pcts = array("d")
+        self.lasts = array("d")
+        self.vols = array("d")
+        for s, pct, last, vol in items:
+            if (not s.endswith("USDT")) or any(k in s for k in EXCLUDE_KEYWORDS):
+                continue
+            if s in SYMBOL_BLACKLIST:
+                continue
+            if last <= 0 or vol <= 0 or pct == 0:
+                continue
+            self.symbols.append(s)
+            self.pcts.append(pct)
+            self.lasts.append(last)
+            self.vols.append(vol)
+        pcts = self.pcts
+        self._order = sorted(range(len(pcts)), key=lambda i: -pcts[i])
+
+    @classmethod
+    def from_rest(cls, rows, ts=None):
+        """由 REST 回傳的 dict 陣列建立（欄位轉型失敗的列直接略過）"""
+        def _iter():
+            for x in rows:
+                try:
+                    yield (x.get("symbol", ""),
+                           float(x.get("priceChangePercent", 0.0)),
+                           float(x.get("lastPrice", 0.0)),
+                           float(x.get("volume", 0.0)))
+                except Exception:
+                    continue
+        return cls(_iter(), ts=ts)
+
+    def age(self) -> float:
+        return time.time() - self.ts
+
+    def _take(self, order, limit, want_up: bool, futures_only: bool):
+        out = []
+        for i in order:
+            pct = self.pcts[i]
+            if (pct <= 0) if want_up else (pct >= 0):
+                break  # 已排序，越過 0 之後不會再有符合的
+            s = self.symbols[i]
+            if futures_only and s.upper() not in FUTURE_KEYS:
+                continue
+            out.append((s, pct, self.lasts[i], self.vols[i]))
+            if len(out) >= limit:
+                break
+        return out
+
+    def gainers(self, limit=10, futures_only=False):
+        """漲幅榜（pct > 0，由大到小）"""
+        return self._take(self._order, limit, True, futures_only)
+
+    def losers(self, limit=10, futures_only=False):
+        """跌幅榜（pct < 0，由小到大）"""
+        return self._take(reversed(self._order), limit, False, futures_only)
+
+
+_RANK_SNAP = None
+_RANK_LOCK = threading.Lock()
+
+def get_ranking_snapshot(max_age_s=None, force=False):
+    """
+    取得共用的排行快照。
+    - 優先讀 ws_client 的全市場排行（!ticker@arr，無 REST）
+    - WS 冷啟動/過期時退回 REST：超過 TTL（config.TICKER_SNAPSHOT_TTL_S）才重抓一次 24hr ticker
+    同一個 scan 內的 gainers/losers/_fut 都應該用同一份快照。
+    """
+    global _RANK_SNAP
+    if not force:
+        try:
+            from ws_client import ws_ranking_snapshot as _ws_rank
+            snap = _ws_rank()
+            if snap is not None:
+                return snap
+        except Exception:
+            pass
+    ttl = TICKER_SNAPSHOT_TTL_S if max_age_s is None else max_age_s
+    with _RANK_LOCK:
+        snap = _RANK_SNAP
+        if force or snap is None or snap.age() > ttl:
+            rows = _rest_json("/fapi/v1/ticker/24hr", timeout=6, tries=3)
+            snap = RankingSnapshot.from_rest(rows)
+            _RANK_SNAP = snap
+        return snap
+
 def fetch_top_gainers(limit=10):
     """
     獲取漲幅榜 Top 10
     """
-    rows = _rest_json("/fapi/v1/ticker/24hr", timeout=6, tries=3)
-    items = []
-    for x in rows:
-        s = x.get("symbol", "")
-        if (not s.endswith("USDT")) or any(k in s for k in EXCLUDE_KEYWORDS):
-            continue
-        if s in SYMBOL_BLACKLIST:
-            continue
-        try:
-            pct = float(x.get("priceChangePercent", 0.0))
-            last = float(x.get("lastPrice", 0.0))
-            vol  = float(x.get("volume", 0.0))
-        except:
-            continue
-        if last <= 0 or vol <= 0 or pct <= 0: # <-- 關鍵差異：只看 pct > 0
-            continue
-        items.append((s, pct, last, vol))
-    items.sort(key=lambda t: t[1], reverse=True) # <-- 關鍵差異：True (由大到小)
-    return items[:limit]
+    return get_ranking_snapshot().gainers(limit)
 
 def fetch_top_losers(limit=10):
     """
     獲取跌幅榜 Top 10
     """
-    rows = _rest_json("/fapi/v1/ticker/24hr", timeout=6, tries=3)
-    items = []
-    for x in rows:
-        s = x.get("symbol", "")
-        if (not s.endswith("USDT")) or any(k in s for k in EXCLUDE_KEYWORDS):
-            continue
-        if s in SYMBOL_BLACKLIST:
-            continue
-        try:
-            pct = float(x.get("priceChangePercent", 0.0))
-            last = float(x.get("lastPrice", 0.0))
-            vol  = float(x.get("volume", 0.0))
-        except:
-            continue
-        if last <= 0 or vol <= 0 or pct >= 0: # <-- 關鍵差異：只看 pct < 0
-            continue
-        items.append((s, pct, last, vol))
-    items.sort(key=lambda t: t[1], reverse=False) # <-- 關鍵差異：False (由小到大)
-    return items[:limit]
+    return get_ranking_snapshot().losers(limit)
+
+def _kline_fetcher(symbol, interval):
+    """給 kline_store 的抓取函式：fetch(limit, start_ms=None) -> Binance 原始列"""
+    def fetch(limit, start_ms=None):
+        params = {"symbol": symbol, "interval": interval, "limit": int(limit)}
+        if start_ms is not None:
+            params["startTime"] = int(start_ms)
+        return _rest_json("/fapi/v1/klines", params=params, timeout=6, tries=3)
+    return fetch
 
 def fetch_klines(symbol, interval, limit):
+    if KLINE_STORE:
+        # 本機 K 線庫：只補最後收盤之後的 bar，回傳 array('d') 欄位
+        return kline_store.columns(symbol, interval, limit, _kline_fetcher(symbol, interval),
+                                   now_ts_ms() + TIME_OFFSET_MS)
     rows = _rest_json("/fapi/v1/klines", params={"symbol":symbol, "interval":interval, "limit":limit}, timeout=6, tries=3)
     closes = [float(k[4]) for k in rows]
     highs  = [float(k[2]) for k in rows]
@@ -80,6 +163,24 @@ def fetch_klines(symbol, interval, limit):
     vols   = [float(k[5]) for k in rows]
     return closes, highs, lows, vols
 
+def fetch_kline_rows(symbol, interval, limit, closed_only=True):
+    """
+    取 K 線原始列，轉成與 ws_client._K1M 相同的 (o,h,l,c,v,ts) tuple（ts=收盤時間，秒）。
+    closed_only=True 時丟掉尚未收盤的最後一根。
+    """
+    if KLINE_STORE:
+        return kline_store.rows(symbol, interval, limit, closed_only, _kline_fetcher(symbol, interval),
+                                now_ts_ms() + TIME_OFFSET_MS)
+    rows = _rest_json("/fapi/v1/klines", params={"symbol":symbol, "interval":interval, "limit":limit}, timeout=6, tries=3)
+    now_ms = now_ts_ms() + TIME_OFFSET_MS
+    out = []
+    for k in rows:
+        close_ms = int(k[6])
+        if closed_only and close_ms >= now_ms:
+            continue
+        out.append((float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5]), close_ms / 1000.0))
+    return out
+
 def ema(vals, n):
     if len(vals) < n: return None
     k = 2.0/(n+1.0)
@@ -89,25 +190,17 @@ def ema(vals, n):
     return e
 
 
-# 安裝全域重試（429/5xx，帶退避）
-_retry = Retry(total=3, backoff_factor=0.4, status_forcelist=[429,500,502,503,504], allowed_methods=["GET","POST","DELETE"])
+# 安裝全域重試（5xx，帶退避）；429/418 交給 rate_governor 依 Retry-After 冷卻，不在這裡重打
+_retry = Retry(total=3, backoff_factor=0.4, status_forcelist=[500,502,503,504], allowed_methods=["GET","POST","DELETE"])
 SESSION.mount("https://", HTTPAdapter(max_retries=_retry))
 SESSION.mount("http://",  HTTPAdapter(max_retries=_retry))
 
 
 def safe_get_json(url: str, params=None, timeout=4, tries=2):
-    """帶重試/timeout 的 GET，失敗拋例外讓上層 decide。"""
-    params = params or {}
-    last = None
-    for i in range(max(1, tries)):
-        try:
-            r = SESSION.get(url, params=params, timeout=timeout)
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            last = e
-            time.sleep(0.3 * (i + 1))
-    raise last
+    """帶重試/timeout 的 GET，失敗拋例外讓上層 decide。
+    (改走 rest_client：連線池 + in-flight 合併 + 非阻塞退避)
+    """
+    return rest_get_json(url, params=params, timeout=timeout, tries=tries)
 
 # --- Resilient REST hosts (main & testnet) ---
 # 刪除 FUTURES_HOSTS_MAIN 和 FUTURES_HOSTS_TEST 列表
@@ -125,27 +218,15 @@ def _rest_json(path: str, params=None, timeout=5, tries=3):
     # 依據 USE_TESTNET 選擇正確的 base URL
     base = BINANCE_FUTURES_TEST_BASE if USE_TESTNET else BINANCE_FUTURES_BASE
 
-    params = params or {}
-    last_err = None
-    # 移除多主機輪詢，只保留重試
-    for t in range(max(1, tries)):
-        try:
-            r = SESSION.get(f"{base}{path}", params=params, timeout=timeout)
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            last_err = e
-        # 退避 + 一點 jitter
-        time.sleep(0.3 * (t + 1))
-    # 把最後一個錯誤丟回去，外層會捕捉並 log，不讓主迴圈掛掉
-    raise last_err if last_err else RuntimeError("REST all hosts failed")
+    # 重試/退避在 rest_client 的 asyncio loop 內進行，同樣的 GET 同時只會送一次
+    # 失敗時把最後一個錯誤丟回去，外層會捕捉並 log，不讓主迴圈掛掉
+    return rest_get_json(f"{base}{path}", params=params, timeout=timeout, tries=tries)
 
 
 # --- Binance Futures server time offset (ms) ---
 def _fapi_server_time_ms():
     try:
-        import requests
-        r = SESSION.get(f"{BINANCE_FUTURES_BASE}/fapi/v1/time", timeout=5)
+        r = governed_request(SESSION, "GET", f"{BINANCE_FUTURES_BASE}/fapi/v1/time", prio=PRIO_ACCOUNT, timeout=5)
         r.raise_for_status()
         return int(r.json().get("serverTime", now_ts_ms()))
     except Exception:
@@ -387,26 +468,12 @@ def last_close(k1m):
 # === futures-only 版本，僅給掃描/下單使用；不影響面板顯示 ===
 def fetch_top_gainers_fut(limit=10):
     """
-    從原本的 fetch_top_gainers 抓多一點，再只保留期貨可交易的；格式不變。
+    與 fetch_top_gainers 共用同一份快照，只保留期貨可交易的；格式不變。
     """
-    raw = fetch_top_gainers(limit=100)  # 多抓，避免被過濾後不足
-    out = []
-    for s, pct, last, vol in raw:
-        if s.upper() in FUTURE_KEYS:
-            out.append((s, pct, last, vol))
-            if len(out) >= limit:
-                break
-    return out
+    return get_ranking_snapshot().gainers(limit, futures_only=True)
 
 def fetch_top_losers_fut(limit=10):
-    raw = fetch_top_losers(limit=100)
-    out = []
-    for s, pct, last, vol in raw:
-        if s.upper() in FUTURE_KEYS:
-            out.append((s, pct, last, vol))
-            if len(out) >= limit:
-                break
-    return out
+    return get_ranking_snapshot().losers(limit, futures_only=True)
 
 
 
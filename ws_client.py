@@ -1,23 +1,48 @@
 # ws_client.py
 # Binance Futures WebSocket helper with price, microstructure, and 1m kline caches.
 # 保留既有 API：start_ws(symbols, use_testnet), stop_ws(), ws_best_price(symbol)
+# 另有全市場排行/標記價格：start_market_ws(use_testnet), ws_ranking_snapshot(), ws_mark_price(symbol)
 
 import json
 import threading
 import time
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional
 import asyncio
 from collections import deque, defaultdict
 from threading import Lock
 
 import websockets  # pip install websockets
 
+from bar_store import BarStore, BarView
+from indicators import ENGINE as _IND
+from ws_codec import decode as _decode
+
 # ==== 可選設定（若 config 沒有對應鍵，這裡提供安全預設） ====
 try:
     import config
     _IMB_LOOKBACK_S = int(getattr(config, "TRADE_IMB_LOOKBACK_S", 15))
+    _FLOW_BUCKET_S = float(getattr(config, "TRADE_FLOW_BUCKET_S", 1.0))
+    _FLOW_HORIZON_S = float(getattr(config, "TRADE_FLOW_HORIZON_S", 120))
+    _MAX_STREAMS_PER_CONN = int(getattr(config, "WS_MAX_STREAMS_PER_CONN", 200))
+    _K1M_CAP = int(getattr(config, "K1M_RING_CAP", 200))
+    _INGEST_MODE = str(getattr(config, "WS_INGEST_MODE", "thread")).lower()
+    _LOCK_STRIPES = int(getattr(config, "WS_LOCK_STRIPES", 16))
+    _RECORD = bool(getattr(config, "RECORD_TICKS", False))
+    _RANK_MAX_AGE_S = float(getattr(config, "RANKING_WS_MAX_AGE_S", 5.0))
+    _RANK_WARMUP_S = float(getattr(config, "RANKING_WS_WARMUP_S", 3.0))
+    _MARK_MAX_AGE_S = float(getattr(config, "MARK_WS_MAX_AGE_S", 3.0))
 except Exception:
     _IMB_LOOKBACK_S = 15  # seconds
+    _FLOW_BUCKET_S = 1.0
+    _FLOW_HORIZON_S = 120
+    _MAX_STREAMS_PER_CONN = 200
+    _K1M_CAP = 200
+    _INGEST_MODE = "thread"
+    _LOCK_STRIPES = 16
+    _RECORD = False
+    _RANK_MAX_AGE_S = 5.0
+    _RANK_WARMUP_S = 3.0
+    _MARK_MAX_AGE_S = 3.0
 
 # ==== 連線端點 ====
 _HOST = {
@@ -25,42 +50,356 @@ _HOST = {
     "main": "wss://fstream.binance.com",
 }
 
+# ==== 鎖：計時 + 分段 ====
+class TimedLock:
+    """
+    threading.Lock 加上爭用統計：先試非阻塞取得，失敗才計時等待。
+    統計值只在持有鎖時更新，不需要另外的鎖。
+    """
+    __slots__ = ("_lk", "acquires", "contended", "wait_s", "max_wait_s")
+
+    def __init__(self):
+        self._lk = Lock()
+        self.acquires = 0
+        self.contended = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lk.acquire(False):
+            self.acquires += 1
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        if not self._lk.acquire(True, timeout):
+            return False
+        w = time.perf_counter() - t0
+        self.acquires += 1
+        self.contended += 1
+        self.wait_s += w
+        if w > self.max_wait_s:
+            self.max_wait_s = w
+        return True
+
+    def release(self):
+        self._lk.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lk.release()
+
+    def stats(self) -> dict:
+        return {"acquires": self.acquires, "contended": self.contended,
+                "wait_ms": self.wait_s * 1000.0, "max_wait_ms": self.max_wait_s * 1000.0}
+
+# 讀寫分工：
+# - _PRICE：單一 dict 賦值/取值（GIL 下不可分割），讀寫都不加鎖
+# - _MICRO：每個 symbol 一筆不可變的 Micro，寫入端組新的整筆換上（copy-on-write），讀取端不加鎖
+# - _K1M：BarRing 以單一 tuple 發布狀態，讀取端不加鎖；寫入端（WS / REST 補洞）用 per-symbol 分段鎖
+# - _FLOW：TradeFlow 原地更新，讀寫都用分段鎖（不同 symbol 互不影響）
+# - _LOCK 只剩全市場排行 / mark price / TP-SL 監看
+_LOCK = TimedLock()
+_STRIPES = tuple(TimedLock() for _ in range(max(1, _LOCK_STRIPES)))
+
+def _stripe(symbol: str) -> TimedLock:
+    return _STRIPES[hash(symbol) % len(_STRIPES)]
+
+def lock_stats() -> dict:
+    """
+    爭用統計：{"global": {...}, "stripes": {...合計..., "hottest": i}}
+    每項含 acquires / contended / wait_ms / max_wait_ms；contended 與 wait_ms 高代表時間耗在等鎖。
+    """
+    st = [lk.stats() for lk in _STRIPES]
+    agg = {k: sum(x[k] for x in st) for k in ("acquires", "contended", "wait_ms")}
+    agg["max_wait_ms"] = max(x["max_wait_ms"] for x in st)
+    agg["n"] = len(st)
+    agg["hottest"] = max(range(len(st)), key=lambda i: st[i]["wait_ms"])
+    return {"global": _LOCK.stats(), "stripes": agg}
+
 # ==== 全域狀態 ====
-_WS_THREAD: Optional[threading.Thread] = None
-_WS_STOP = False
 _PRICE: Dict[str, float] = {}                    # last price from 24h ticker
 _SUBS: List[str] = []                            # current subscribed symbols (upper)
-_LOCK = Lock()
 
 # Microstructure + Kline caches
-_MICRO = defaultdict(lambda: {
-    "obi": None,                # 頂層委買賣不平衡（0..1）
-    "spread": None,             # 相對價差（%）
-    "trade_buy_ratio": None,    # 最近窗口主動買量比
-    "ts": 0.0,
-})
-_K1M = defaultdict(lambda: deque(maxlen=200))    # (o,h,l,c,v,ts)
-_IMB_WINDOWS: Dict[str, deque] = {}              # symbol -> deque[(t, price, qty, is_aggr_buy)]
+class Micro(NamedTuple):
+    obi: Optional[float] = None                  # 頂層委買賣不平衡（0..1）
+    spread: Optional[float] = None               # 相對價差（%）
+    trade_buy_ratio: Optional[float] = None      # 最近窗口主動買量比
+    ts: float = 0.0
+
+_MICRO0 = Micro()
+_MICRO: Dict[str, Micro] = {}                    # symbol -> Micro（整筆替換，不原地改）
+_K1M = BarStore(_K1M_CAP)                        # symbol -> 欄位式環形緩衝 (o,h,l,c,v,ts)
+_KLINE_LISTENERS: List = []                      # fn(symbol, interval, bar)：K 線收盤時呼叫
+_EXTRA_KLINES: List[str] = []                    # 除了 1m 之外要訂閱的 K 線週期（例如 "5m"）
+_FLOW: Dict[str, "TradeFlow"] = {}               # symbol -> 主動買/賣量滾動視窗
+_INGEST = None                                   # WS_INGEST_MODE="process" 時的 ws_ingest.IngestProcess
+_TAP = None                                      # fn(data)：每則已知型別的事件先交給它（錄製用），需極輕量
+_RECORDER = None                                 # RECORD_TICKS=True 時的 recorder.TickRecorder
+
+# 全市場排行（!ticker@arr）：symbol -> (pct, last, vol)
+_MKT_THREAD: Optional[threading.Thread] = None
+_MKT_STOP = False
+_RANK_ROWS: Dict[str, tuple] = {}
+_RANK_T0 = 0.0                                   # 第一筆全市場訊息時間（暖機判斷）
+_RANK_TS = 0.0                                   # 最近一筆全市場訊息時間
+_RANK_VER = 0                                    # 每次更新 +1；讀取端據此決定是否重排
+_RANK_CACHE = (-1, None)                         # (ver, RankingSnapshot)
+
+# 全市場標記價格（!markPrice@arr@1s）：symbol -> (mark, ts)；以及 TP/SL 觸價監看
+_MARK: Dict[str, tuple] = {}
+_WATCH: Dict[str, dict] = {}                     # symbol -> {"side","tp","sl","cb"}
 
 # ==== 對外查價（保留舊名） ====
 def ws_best_price(symbol: str) -> Optional[float]:
     """取得最近的 last price（24h ticker 的 c）"""
-    with _LOCK:
-        return _PRICE.get(symbol.upper())
+    s = symbol.upper()
+    ing = _INGEST
+    if ing is not None:
+        p = ing.price(s)            # shared memory，不加鎖
+        if p is not None:
+            return p
+    return _PRICE.get(s)
 
 # ==== micro/kline 對外讀取 ====
 def get_micro(symbol: str) -> Dict:
     """回傳 micro 結構的淺拷貝（obi/spread/trade_buy_ratio/ts）"""
     s = symbol.upper()
-    with _LOCK:
-        return dict(_MICRO[s])
+    ing = _INGEST
+    if ing is not None:
+        m = ing.micro_dict(s)
+        if m is not None:
+            return m
+    return _MICRO.get(s, _MICRO0)._asdict()
 
 def get_k1m(symbol: str, n: int = 50):
-    """取得最近 n 根 1m K 線（關盤後寫入）"""
+    """取得最近 n 根 1m K 線（關盤後寫入）；tuple 列表，需要零拷貝請用 k1m_view"""
+    return k1m_view(symbol, n).tuples()
+
+def k1m_view(symbol: str, n: Optional[int] = None) -> BarView:
+    """最近 n 根 1m K 線的欄位視圖（memoryview，不複製）；下一根 bar 收盤前有效，要保留更久請 copy"""
     s = symbol.upper()
+    ring = _K1M.ring(s)
+    ing = _INGEST
+    new = ing.new_bars(s) if ing is not None else None    # 子行程寫進 shared memory 的新收盤 bar
+    if new:
+        with _stripe(s):
+            for b in new:
+                ring.append(*b)
+    return ring.view(n)
+
+def k1m_store_stats() -> dict:
+    """{symbols, cap, bytes}：1m 環形緩衝的固定記憶體用量"""
+    return _K1M.stats()
+
+def on_kline_close(fn):
+    """註冊 K 線收盤監聽：fn(symbol, interval, bar)，bar = (o,h,l,c,v,ts)；在 WS 執行緒上呼叫，需快速返回"""
+    if fn not in _KLINE_LISTENERS:
+        _KLINE_LISTENERS.append(fn)
+
+def off_kline_close(fn):
+    """移除 on_kline_close 註冊的監聽"""
+    try:
+        _KLINE_LISTENERS.remove(fn)
+    except ValueError:
+        pass
+
+def set_kline_intervals(intervals):
+    """除了 1m 之外還要訂閱的 K 線週期；已在跑的連線會以差量訂閱補上"""
+    global _EXTRA_KLINES
+    _EXTRA_KLINES = sorted({iv for iv in intervals if iv and iv != "1m"})
+    if _MANAGER is not None and _SUBS:
+        _MANAGER.set_streams(_make_streams(_SUBS))
+    if _INGEST is not None and _SUBS:
+        _INGEST.set_symbols(_SUBS, _EXTRA_KLINES)
+
+def _notify_kline_close(symbol: str, interval: str, bar):
+    for fn in list(_KLINE_LISTENERS):
+        try:
+            fn(symbol, interval, bar)
+        except Exception:
+            pass
+
+def merge_k1m(symbol: str, bars) -> int:
+    """
+    把 REST 補回來的已收盤 1m bar 併進 _K1M（以 ts 去重、依時間排序）。
+    回傳合併後的根數。
+    """
+    s = symbol.upper()
+    ring = _K1M.ring(s)
+    with _stripe(s):
+        by_ts = {b[5]: b for b in ring.view().tuples()}
+        for b in bars:
+            by_ts.setdefault(b[5], b)   # WS 寫入的優先
+        merged = sorted(by_ts.values(), key=lambda b: b[5])
+        ring.reset(merged)
+        return len(ring)
+
+# ==== 主動買賣量：時間分桶滾動視窗 ====
+class TradeFlow:
+    """
+    以固定寬度時間桶記錄「累積」主動買/賣量（環形陣列）：
+    - 每筆成交只更新當前桶，O(1)；跨過空桶時補上相同累積值（攤銷 O(1)）
+    - 任一窗口 = 現在累積 - 窗口起點前一桶的累積，查多個窗口各 O(1)
+    - 依時間淘汰，不受筆數上限影響；最長可查 horizon 秒
+    """
+    __slots__ = ("bucket_s", "n", "_idx", "_buy", "_sell", "_last", "_cb", "_cs")
+
+    def __init__(self, bucket_s: float = 1.0, horizon_s: float = 120):
+        self.bucket_s = max(0.05, float(bucket_s))
+        self.n = int(horizon_s / self.bucket_s) + 2
+        self._idx = [-1] * self.n       # 每格對應的桶編號
+        self._buy = [0.0] * self.n      # 每格結束時的累積主動買量
+        self._sell = [0.0] * self.n
+        self._last = -1                 # 最近有成交的桶編號
+        self._cb = 0.0                  # 目前累積主動買量
+        self._cs = 0.0
+
+    def add(self, t: float, qty: float, is_aggr_buy: bool):
+        b = int(t / self.bucket_s)
+        if b < self._last:
+            b = self._last              # 亂序的舊成交算進目前桶
+        elif b > self._last:
+            # 補齊中間的空桶（最多一圈）
+            start = max(self._last + 1, b - self.n + 1)
+            for j in range(start, b):
+                k = j % self.n
+                self._idx[k] = j
+                self._buy[k] = self._cb
+                self._sell[k] = self._cs
+            self._last = b
+        if is_aggr_buy:
+            self._cb += qty
+        else:
+            self._cs += qty
+        k = b % self.n
+        self._idx[k] = b
+        self._buy[k] = self._cb
+        self._sell[k] = self._cs
+
+    def window(self, seconds: float, now: Optional[float] = None):
+        """最近 seconds 秒的 (buy, sell)；超過 horizon 會截到 horizon"""
+        if self._last < 0:
+            return 0.0, 0.0
+        now = time.time() if now is None else now
+        cur = int(now / self.bucket_s)
+        nb = min(self.n - 2, max(1, int(round(seconds / self.bucket_s))))
+        j = cur - nb                    # 窗口起點前一桶
+        if j >= self._last:
+            return 0.0, 0.0
+        k = j % self.n
+        if self._idx[k] == j:
+            base_b, base_s = self._buy[k], self._sell[k]
+        else:
+            base_b, base_s = 0.0, 0.0   # 更早的紀錄不存在：從第一筆開始算
+        return self._cb - base_b, self._cs - base_s
+
+    def ratio(self, seconds: float, now: Optional[float] = None) -> Optional[float]:
+        buy, sell = self.window(seconds, now)
+        tot = buy + sell
+        return buy / tot if tot > 0 else None
+
+def _on_agg_trade(s: str, qty: float, is_aggr_buy: bool, now: float):
+    with _stripe(s):
+        fl = _FLOW.get(s)
+        if fl is None:
+            fl = _FLOW[s] = TradeFlow(_FLOW_BUCKET_S, max(_FLOW_HORIZON_S, _IMB_LOOKBACK_S))
+        fl.add(now, qty, is_aggr_buy)
+        _MICRO[s] = _MICRO.get(s, _MICRO0)._replace(trade_buy_ratio=fl.ratio(_IMB_LOOKBACK_S, now), ts=now)
+
+def ws_trade_flow(symbol: str, windows=(5, 15, 60)) -> Dict[float, dict]:
+    """
+    一次取多個窗口的主動買賣量：{秒數: {"buy","sell","ratio"}}。
+    沒有資料時 ratio 為 None。
+    """
+    s = symbol.upper()
+    now = time.time()
+    out = {}
+    ing = _INGEST
+    if ing is not None:
+        # 子行程只發布固定幾個窗口（ws_ingest.FLOW_WINDOWS），每筆成交與每 WS_INGEST_FLOW_S 重算一次
+        fl = ing.flows(s)
+        for w in windows:
+            buy, sell = fl.get(w, (0.0, 0.0))
+            tot = buy + sell
+            out[w] = {"buy": buy, "sell": sell, "ratio": buy / tot if tot > 0 else None}
+        return out
+    with _stripe(s):
+        fl = _FLOW.get(s)
+        for w in windows:
+            buy, sell = fl.window(w, now) if fl is not None else (0.0, 0.0)
+            tot = buy + sell
+            out[w] = {"buy": buy, "sell": sell, "ratio": buy / tot if tot > 0 else None}
+    return out
+
+def ws_mark_price(symbol: str, max_age_s: Optional[float] = None) -> Optional[float]:
+    """最近的 mark price；超過 max_age_s（預設 MARK_WS_MAX_AGE_S）視為過期回 None"""
+    max_age = _MARK_MAX_AGE_S if max_age_s is None else max_age_s
     with _LOCK:
-        data = list(_K1M[s])[-n:]
-    return data
+        rec = _MARK.get(symbol.upper())
+    if not rec or (time.time() - rec[1]) > max_age:
+        return None
+    return rec[0]
+
+def watch_levels(symbol: str, side: str, tp: float, sl: float, callback):
+    """
+    mark price 穿越 TP/SL 時呼叫 callback(symbol, "TP"|"SL", mark)（只觸發一次，之後自動移除）。
+    callback 在 WS 執行緒上執行，請保持輕量（例如只 set 一個 Event）。
+    重複呼叫會覆蓋同 symbol 的設定。
+    """
+    with _LOCK:
+        _WATCH[symbol.upper()] = {"side": side.upper(), "tp": float(tp), "sl": float(sl), "cb": callback}
+
+def unwatch(symbol: Optional[str] = None):
+    """移除指定 symbol 的監看；不給 symbol 則全部移除"""
+    with _LOCK:
+        if symbol is None:
+            _WATCH.clear()
+        else:
+            _WATCH.pop(symbol.upper(), None)
+
+def _check_watch(s: str, mark: float):
+    w = _WATCH.get(s)
+    if not w:
+        return None
+    if w["side"] == "LONG":
+        hit = "TP" if mark >= w["tp"] else "SL" if mark <= w["sl"] else None
+    else:
+        hit = "TP" if mark <= w["tp"] else "SL" if mark >= w["sl"] else None
+    if hit:
+        _WATCH.pop(s, None)
+        return (w["cb"], s, hit, mark)
+    return None
+
+# ==== 全市場排行對外讀取 ====
+def ws_ranking_snapshot(max_age_s: Optional[float] = None):
+    """
+    回傳由 !ticker@arr 維護的 RankingSnapshot（與 utils REST 版同介面）。
+    串流未暖機或過期時回傳 None，呼叫端應退回 REST。
+    排序只在資料有更新後的第一次讀取時做一次，其餘讀取直接切 Top-N。
+    """
+    global _RANK_CACHE
+    max_age = _RANK_MAX_AGE_S if max_age_s is None else max_age_s
+    now = time.time()
+    with _LOCK:
+        if not _RANK_ROWS or (now - _RANK_TS) > max_age or (_RANK_TS - _RANK_T0) < _RANK_WARMUP_S:
+            return None
+        ver, snap = _RANK_CACHE
+        if ver == _RANK_VER and snap is not None:
+            return snap
+        ver = _RANK_VER
+        items = [(sym, r[0], r[1], r[2]) for sym, r in _RANK_ROWS.items()]
+        ts = _RANK_TS
+    from utils import RankingSnapshot
+    snap = RankingSnapshot(items, ts=ts)
+    with _LOCK:
+        if _RANK_CACHE[0] < ver:
+            _RANK_CACHE = (ver, snap)
+    return snap
 
 # ==== 產生訂閱串 ====
 def _make_streams(symbols: List[str]) -> List[str]:
@@ -70,31 +409,389 @@ def _make_streams(symbols: List[str]) -> List[str]:
         sl = s.lower()
         sts.append(f"{sl}@ticker")         # 24h ticker（取 c 當 last）
         sts.append(f"{sl}@kline_1m")       # 1m kline（用已收盤 k 寫入）
+        for iv in _EXTRA_KLINES:
+            sts.append(f"{sl}@kline_{iv}")  # 其他週期：只送收盤事件 + 更新指標引擎
         sts.append(f"{sl}@depth5@100ms")   # 頂層五檔，計算 OBI / spread
         sts.append(f"{sl}@aggTrade")       # 聚合成交，計算主動量比
     return sts
 
-# ==== WS 主循環 ====
-async def _run_ws(loop_syms: List[str], use_testnet: bool):
-    global _PRICE
-    url = (_HOST["test"] if use_testnet else _HOST["main"]) + "/ws"
-    streams = _make_streams(loop_syms)
-    sub_msg = {"method": "SUBSCRIBE", "params": streams, "id": 1}
+# ==== 單筆訊息處理（所有 shard 共用）：依事件型別查表分派 ====
+# 每個 handler 只處理一種事件，欄位直接取（缺欄位/格式錯由外層吞掉）。
+def _on_ticker_evt(data: dict):
+    # 24h Ticker（last price）
+    s = data["s"]
+    _PRICE[s] = float(data["c"])
+
+def _on_kline_evt(data: dict):
+    # K 線（只收已結束的 bar）；k: { t,o,h,l,c,v, T, i, x ... }，x=True 表示該 bar 已收盤
+    k = data["k"]
+    if not k["x"]:
+        return
+    s = data["s"]
+    o = float(k["o"]); h = float(k["h"]); l = float(k["l"])
+    c = float(k["c"]); v = float(k["v"])
+    ts = k["T"] / 1000.0
+    iv = k.get("i", "1m")
+    bar = (o, h, l, c, v, ts)
+    if iv == "1m":
+        ring = _K1M.ring(s)
+        with _stripe(s):
+            ring.append(o, h, l, c, v, ts)
+    _IND.update(s, iv, bar)
+    _notify_kline_close(s, iv, bar)
+
+def _on_depth_evt(data: dict):
+    # 深度（頂層）：OBI / 相對價差
+    b0 = data["b"][0]
+    a0 = data["a"][0]
+    bp = float(b0[0]); bq = float(b0[1])
+    ap = float(a0[0]); aq = float(a0[1])
+    tq = bq + aq
+    mid2 = ap + bp
+    obi = bq / tq if tq > 0 else None
+    spread = (ap - bp) / (mid2 / 2.0) if mid2 != 0 else None
+    s = data["s"]
+    now = time.time()
+    with _stripe(s):
+        m = _MICRO.get(s, _MICRO0)
+        _MICRO[s] = Micro(obi, spread, m.trade_buy_ratio, now)
+
+def _on_agg_evt(data: dict):
+    # 聚合成交（主動量比）；m=True 表示 Buyer 是 market maker（即賣方主動），所以主動買為 not m
+    _on_agg_trade(data["s"], float(data["q"]), not data["m"], time.time())
+
+_DISPATCH = {
+    "24hrTicker": _on_ticker_evt,
+    "kline": _on_kline_evt,
+    "depthUpdate": _on_depth_evt,
+    "aggTrade": _on_agg_evt,
+}
+
+def _handle_event(data: dict):
+    h = _DISPATCH.get(data.get("e"))
+    if h is None:
+        return          # 無事件型別 / 其他事件忽略
+    tap = _TAP
+    if tap is not None:
+        tap(data)
+    try:
+        h(data)
+    except Exception:
+        pass
+
+def set_event_tap(fn):
+    """設定事件旁路（None 取消）：在 ingest 執行緒上、handler 之前呼叫"""
+    global _TAP
+    _TAP = fn
+
+def _start_recorder():
+    """RECORD_TICKS 開啟時啟動錄製（每個行程一份；process 模式由子行程呼叫）"""
+    global _RECORDER
+    if not _RECORD or _RECORDER is not None:
+        return
+    try:
+        import recorder
+        rec = recorder.TickRecorder()
+        rec.start()
+    except Exception:
+        return
+    _RECORDER = rec
+    set_event_tap(rec.record)
+
+def _stop_recorder():
+    global _RECORDER
+    rec, _RECORDER = _RECORDER, None
+    if rec is not None:
+        set_event_tap(None)
+        try:
+            rec.stop()
+        except Exception:
+            pass
+
+def recorder_stats() -> dict:
+    """本行程錄製器的統計；沒開啟回 {}"""
+    return _RECORDER.stats() if _RECORDER is not None else {}
+
+# ==== 訂閱管理：差量 SUBSCRIBE/UNSUBSCRIBE + 多連線分片 ====
+class _Shard:
+    """
+    一條 WS 連線。target 是「應該訂閱」的集合：
+    - 連上（或重連）時一次訂閱整個 target
+    - 在線時的增減以 SUBSCRIBE/UNSUBSCRIBE 差量送出（不斷線，快取不中斷）
+    """
+    def __init__(self, sid: int, url: str):
+        self.sid = sid
+        self.url = url
+        self.target = set()
+        self.connected = False
+        self.msgs = 0                 # 累計訊息數
+        self._sec = 0
+        self._sec_count = 0
+        self.rate = 0                 # 上一個完整秒的訊息數
+        self._ops = deque()           # (method, [streams])
+        self._ops_evt = None          # asyncio.Event（在 loop 內建立）
+        self._stop = False
+        self._task = None
+
+    def queue_op(self, method: str, streams):
+        if not self.connected or not streams:
+            return                    # 未連線：重連時會直接訂閱整個 target
+        self._ops.append((method, sorted(streams)))
+        self._ops_evt.set()
+
+    def _count(self, now: float):
+        self.msgs += 1
+        sec = int(now)
+        if sec != self._sec:
+            self.rate = self._sec_count if sec == self._sec + 1 else 0
+            self._sec = sec
+            self._sec_count = 0
+        self._sec_count += 1
+
+    async def _send(self, ws, method: str, streams):
+        # 每則控制訊息最多 _SUB_CHUNK 個 stream；幣安限制每連線每秒 10 則，這裡壓在 5 則
+        for i in range(0, len(streams), _SUB_CHUNK):
+            await ws.send(json.dumps({"method": method, "params": streams[i:i + _SUB_CHUNK], "id": _next_id()}))
+            await asyncio.sleep(0.2)
+
+    async def _sender(self, ws):
+        while True:
+            await self._ops_evt.wait()
+            self._ops_evt.clear()
+            while self._ops:
+                method, streams = self._ops.popleft()
+                await self._send(ws, method, streams)
+
+    async def run(self):
+        self._ops_evt = asyncio.Event()
+        while not self._stop:
+            sender = None
+            try:
+                async with websockets.connect(
+                    self.url, ping_interval=15, ping_timeout=15, close_timeout=5
+                ) as ws:
+                    self._ops.clear()
+                    self.connected = True
+                    # 訂閱（整個 target；之後的變化走差量）
+                    await self._send(ws, "SUBSCRIBE", sorted(self.target))
+                    sender = asyncio.ensure_future(self._sender(ws))
+
+                    # 讀取循環
+                    while not self._stop:
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(), timeout=30)
+                        except asyncio.TimeoutError:
+                            # 嘗試 ping 保活
+                            try:
+                                await ws.ping()
+                            except Exception:
+                                break
+                            continue
+
+                        self._count(time.time())
+                        try:
+                            payload = _decode(raw)
+                        except Exception:
+                            continue
+
+                        # 兼容 /ws 與 /stream（/stream 會包 {stream,data}）
+                        data = payload.get("data", payload) if isinstance(payload, dict) else None
+                        if not isinstance(data, dict):
+                            continue
+                        # ACK 訊息：{"result": None, "id": 1}
+                        if "result" in data:
+                            continue
+                        _handle_event(data)
+            except Exception:
+                pass
+            finally:
+                self.connected = False
+                if sender is not None:
+                    sender.cancel()
+            if not self._stop:
+                # 短暫睡一下再重連
+                await asyncio.sleep(1.0)
+
+class SubscriptionManager:
+    """
+    管理所有 per-symbol streams：
+    - set_streams(desired) 與目前集合做 diff，只送差量
+    - 每條連線最多 _MAX_STREAMS_PER_CONN 個 stream，超過自動開新分片
+    - 所有分片跑在同一個背景 asyncio loop
+    """
+    def __init__(self, use_testnet: bool):
+        self.url = (_HOST["test"] if use_testnet else _HOST["main"]) + "/ws"
+        self.use_testnet = use_testnet
+        self._shards: Dict[int, _Shard] = {}
+        self._next_sid = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _t():
+            asyncio.set_event_loop(loop)
+            ready.set()
+            try:
+                loop.run_forever()
+            except Exception:
+                pass
+
+        self._thread = threading.Thread(target=_t, daemon=True, name="ws-subs")
+        self._thread.start()
+        ready.wait()
+        self._loop = loop
+
+    def alive(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def set_streams(self, desired):
+        """thread-safe：實際變更在 loop 執行緒內套用"""
+        desired = set(desired)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._apply, desired)
+
+    def _apply(self, desired: set):
+        current = set()
+        for sh in self._shards.values():
+            current |= sh.target
+        remove = current - desired
+        add = desired - current
+
+        for sh in self._shards.values():
+            rm = sh.target & remove
+            if rm:
+                sh.target -= rm
+                sh.queue_op("UNSUBSCRIBE", rm)
+
+        added = defaultdict(set)
+        for st in sorted(add):
+            sh = None
+            for cand in sorted(self._shards.values(), key=lambda x: x.sid):
+                if not cand._stop and len(cand.target) < _MAX_STREAMS_PER_CONN:
+                    sh = cand
+                    break
+            if sh is None:
+                sh = _Shard(self._next_sid, self.url)
+                self._next_sid += 1
+                self._shards[sh.sid] = sh
+                sh._task = self._loop.create_task(sh.run())
+            sh.target.add(st)
+            added[sh.sid].add(st)
+        for sid, sts in added.items():
+            self._shards[sid].queue_op("SUBSCRIBE", sts)
+
+        # 清空的分片直接收掉連線
+        for sid in [sid for sid, sh in self._shards.items() if not sh.target]:
+            sh = self._shards.pop(sid)
+            sh._stop = True
+            if sh._task is not None:
+                sh._task.cancel()
+
+    def stop(self):
+        loop = self._loop
+        if loop is None:
+            return
+
+        def _shutdown():
+            for sh in self._shards.values():
+                sh._stop = True
+                if sh._task is not None:
+                    sh._task.cancel()
+            self._shards.clear()
+            loop.stop()
+
+        loop.call_soon_threadsafe(_shutdown)
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=0.5)
+        self._loop = None
+        self._thread = None
+
+    def stats(self) -> List[dict]:
+        """每個分片：{shard, streams, connected, msgs, msgs_per_s}"""
+        now = int(time.time())
+        return [
+            {"shard": sh.sid, "streams": len(sh.target), "connected": sh.connected,
+             "msgs": sh.msgs, "msgs_per_s": sh.rate if now - sh._sec <= 1 else 0}
+            for sh in sorted(list(self._shards.values()), key=lambda x: x.sid)
+        ]
+
+_SUB_CHUNK = 50
+_MSG_ID = [0]
+_MANAGER: Optional[SubscriptionManager] = None
+
+def _next_id() -> int:
+    _MSG_ID[0] += 1
+    return _MSG_ID[0]
+
+# ==== 全市場主循環（獨立連線，不受 start_ws 重啟影響）：24h ticker + mark price ====
+def _on_market_tickers(rows):
+    global _RANK_T0, _RANK_TS, _RANK_VER
+    now = time.time()
+    upd = {}
+    for d in rows:
+        if not isinstance(d, dict):
+            continue
+        s = d.get("s")
+        if not s:
+            continue
+        try:
+            upd[s] = (float(d["P"]), float(d["c"]), float(d["v"]))
+        except Exception:
+            continue
+    if not upd:
+        return
+    for s, r in upd.items():
+        _PRICE[s] = r[1]
+    with _LOCK:
+        _RANK_ROWS.update(upd)
+        if not _RANK_T0:
+            _RANK_T0 = now
+        _RANK_TS = now
+        _RANK_VER += 1
+
+def _on_mark_prices(rows):
+    now = time.time()
+    fired = []
+    with _LOCK:
+        for d in rows:
+            if not isinstance(d, dict):
+                continue
+            s = d.get("s")
+            try:
+                p = float(d["p"])
+            except Exception:
+                continue
+            if not s:
+                continue
+            _MARK[s] = (p, now)
+            if _WATCH:
+                hit = _check_watch(s, p)
+                if hit:
+                    fired.append(hit)
+    # callback 放在鎖外，避免回呼裡再讀 ws_client 造成死鎖
+    for cb, s, kind, p in fired:
+        try:
+            cb(s, kind, p)
+        except Exception:
+            pass
 
-    while not _WS_STOP:
+async def _run_market_ws(use_testnet: bool):
+    url = (_HOST["test"] if use_testnet else _HOST["main"]) + "/stream?streams=!ticker@arr/!markPrice@arr@1s"
+
+    while not _MKT_STOP:
         try:
             async with websockets.connect(
                 url, ping_interval=15, ping_timeout=15, close_timeout=5
             ) as ws:
-                # 訂閱
-                await ws.send(json.dumps(sub_msg))
-
-                # 讀取循環
-                while not _WS_STOP:
+                while not _MKT_STOP:
                     try:
                         raw = await asyncio.wait_for(ws.recv(), timeout=30)
                     except asyncio.TimeoutError:
-                        # 嘗試 ping 保活
                         try:
                             await ws.ping()
                         except Exception:
@@ -102,142 +799,116 @@ async def _run_ws(loop_syms: List[str], use_testnet: bool):
                         continue
 
                     try:
-                        payload = json.loads(raw)
+                        payload = _decode(raw)
                     except Exception:
                         continue
+                    stream = ""
+                    if isinstance(payload, dict):
+                        stream = payload.get("stream", "")
+                        payload = payload.get("data", payload)
+                    if isinstance(payload, list):
+                        if stream.startswith("!markPrice"):
+                            _on_mark_prices(payload)
+                        else:
+                            _on_market_tickers(payload)
+        except Exception:
+            await asyncio.sleep(1.0)
 
-                    # 兼容 /ws 與 /stream（/stream 會包 {stream,data}）
-                    data = payload.get("data", payload)
-                    if not isinstance(data, dict):
-                        continue
-
-                    # ACK 訊息：{"result": None, "id": 1}
-                    if "result" in data:
-                        continue
-
-                    # 事件型別
-                    et = data.get("e")
-                    if not et:
-                        # 無事件型別；忽略
-                        continue
+def start_market_ws(use_testnet: bool):
+    """啟動全市場 ticker + mark price 串流（已在跑就不重複啟動）。"""
+    global _MKT_THREAD, _MKT_STOP
+    if _MKT_THREAD and _MKT_THREAD.is_alive():
+        return
+    _MKT_STOP = False
 
-                    # === 24h Ticker（last price）===
-                    if et == "24hrTicker":
-                        s = data.get("s")
-                        c = data.get("c")
-                        if s and c is not None:
-                            try:
-                                c = float(c)
-                                with _LOCK:
-                                    _PRICE[s] = c
-                            except Exception:
-                                pass
-
-                    # === 1m K 線（只收已結束的 bar）===
-                    elif et == "kline":
-                        s = data.get("s")
-                        k = data.get("k") or {}
-                        # k: { t,o,h,l,c,v, T, x ... }；x=True 表示該 bar 已收盤
-                        if s and k.get("x"):
-                            try:
-                                o = float(k["o"]); h = float(k["h"]); l = float(k["l"])
-                                c = float(k["c"]); v = float(k["v"])
-                                ts = float(k.get("T", 0)) / 1000.0
-                                with _LOCK:
-                                    _K1M[s].append((o, h, l, c, v, ts))
-                            except Exception:
-                                pass
-
-                    # === 深度（頂層）===
-                    elif et == "depthUpdate":
-                        s = data.get("s")
-                        bids = data.get("b") or []
-                        asks = data.get("a") or []
-                        if s and bids and asks:
-                            try:
-                                bp = float(bids[0][0]); bq = float(bids[0][1])
-                                ap = float(asks[0][0]); aq = float(asks[0][1])
-                                obi = bq / (bq + aq) if (bq + aq) > 0 else None
-                                spread = (ap - bp) / ((ap + bp) / 2.0) if (ap + bp) != 0 else None
-                                with _LOCK:
-                                    _MICRO[s].update({"obi": obi, "spread": spread, "ts": time.time()})
-                            except Exception:
-                                pass
+    def _t():
+        try:
+            asyncio.run(_run_market_ws(use_testnet))
+        except Exception:
+            pass
 
-                    # === 聚合成交（主動量比）===
-                    elif et == "aggTrade":
-                        s = data.get("s")
-                        if s:
-                            try:
-                                p = float(data["p"])
-                                q = float(data["q"])
-                                # m=True 表示 Buyer 是 market maker（即賣方主動），所以主動買為 not m
-                                is_buyer_maker = bool(data["m"])
-                                is_aggr_buy = not is_buyer_maker
-
-                                now = time.time()
-                                win = _IMB_WINDOWS.setdefault(s, deque(maxlen=200))
-                                win.append((now, p, q, is_aggr_buy))
-
-                                cutoff = now - _IMB_LOOKBACK_S
-                                buys = 0.0
-                                sells = 0.0
-                                # 累積最近窗口
-                                for t, _p, _q, is_buy in win:
-                                    if t >= cutoff:
-                                        if is_buy:
-                                            buys += _q
-                                        else:
-                                            sells += _q
-                                ratio = buys / (buys + sells) if (buys + sells) > 0 else None
-                                with _LOCK:
-                                    _MICRO[s].update({"trade_buy_ratio": ratio, "ts": now})
-                            except Exception:
-                                pass
+    _MKT_THREAD = threading.Thread(target=_t, daemon=True)
+    _MKT_THREAD.start()
 
-                    # 其他事件忽略
+def stop_market_ws():
+    """停止全市場 ticker 串流。"""
+    global _MKT_THREAD, _MKT_STOP
+    _MKT_STOP = True
+    if _MKT_THREAD and _MKT_THREAD.is_alive():
+        try:
+            _MKT_THREAD.join(timeout=0.5)
         except Exception:
-            # 短暫睡一下再重連
-            await asyncio.sleep(1.0)
+            pass
+    _MKT_THREAD = None
 
-# ==== 啟動 / 更新訂閱（保留舊名與行為） ====
+# ==== 啟動 / 更新訂閱（保留舊名） ====
 def start_ws(symbols: List[str], use_testnet: bool):
     """
     啟動或更新 WebSocket 訂閱。
-    重複呼叫會比對 symbols，若不同會重啟並重新訂閱。
+    以集合比對（順序無關）；差異只送 SUBSCRIBE/UNSUBSCRIBE，不重啟連線。
     """
-    global _WS_THREAD, _WS_STOP, _SUBS
-    syms = [s.upper() for s in symbols if isinstance(s, str)]
-    # 相同訂閱且執行緒存活就不重啟
-    if syms == _SUBS and _WS_THREAD and _WS_THREAD.is_alive():
+    global _SUBS, _MANAGER, _INGEST
+    syms = sorted({s.upper() for s in symbols if isinstance(s, str)})
+    if _MANAGER is not None and _MANAGER.use_testnet != use_testnet:
+        stop_ws()
+    if _INGEST is not None and _INGEST.use_testnet != use_testnet:
+        stop_ws()
+
+    if _INGEST_MODE == "process":
+        # 連線與解析在子行程；本行程只讀 shared memory + 收 K 線收盤事件
+        if syms == _SUBS and _INGEST is not None and _INGEST.alive():
+            return
+        _SUBS = syms
+        if _INGEST is None:
+            if not syms:
+                return
+            import ws_ingest            # 錄製在子行程裡做
+            ing = ws_ingest.IngestProcess(use_testnet, on_bar=_on_ingest_bar, cap=_K1M_CAP)
+            ing.start()
+            _INGEST = ing
+        _INGEST.set_symbols(syms, _EXTRA_KLINES)
         return
 
-    _SUBS = syms
-    stop_ws()               # 確保先停掉舊連線
-    if not _SUBS:
-        return              # 沒有要訂閱的標的
+    if syms == _SUBS and _MANAGER is not None and _MANAGER.alive():
+        return
 
-    _WS_STOP = False
+    _SUBS = syms
+    if _MANAGER is None:
+        if not syms:
+            return          # 沒有要訂閱的標的
+        _start_recorder()
+        _MANAGER = SubscriptionManager(use_testnet)
+        _MANAGER.start()
+    _MANAGER.set_streams(_make_streams(syms))
 
-    def _t():
+def stop_ws():
+    """停止所有 per-symbol WebSocket 連線。"""
+    global _MANAGER, _SUBS, _INGEST
+    if _MANAGER is not None:
         try:
-            asyncio.run(_run_ws(_SUBS, use_testnet))
+            _MANAGER.stop()
         except Exception:
             pass
-
-    _WS_THREAD = threading.Thread(target=_t, daemon=True)
-    _WS_THREAD.start()
-
-def stop_ws():
-    """停止 WebSocket 連線。"""
-    global _WS_THREAD, _WS_STOP
-    _WS_STOP = True
-    if _WS_THREAD and _WS_THREAD.is_alive():
+    ing, _INGEST = _INGEST, None
+    if ing is not None:
         try:
-            _WS_THREAD.join(timeout=0.5)
+            ing.stop()
         except Exception:
             pass
-    _WS_THREAD = None
+    _stop_recorder()
+    _MANAGER = None
+    _SUBS = []
+
+def ws_shard_stats() -> List[dict]:
+    """各分片的 stream 數、連線狀態與每秒訊息數（process 模式為子行程每秒回報的值）"""
+    if _INGEST is not None:
+        return _INGEST.stats()
+    return _MANAGER.stats() if _MANAGER is not None else []
+
+def _on_ingest_bar(symbol: str, interval: str, bar):
+    # 子行程送回的 K 線收盤事件（drain 執行緒）：1m bar 本身由 k1m_view 從 shared memory 同步
+    _IND.update(symbol, interval, bar)
+    _notify_kline_close(symbol, interval, tuple(bar))
 
 # ==== 可選：類別介面（不破壞原本函數名稱；給未來擴充用） ====
 class WSClient:
@@ -255,8 +926,11 @@ class WSClient:
     def on_kline_1m(self, symbol, k_tuple):
         # k_tuple: (o,h,l,c,v,ts)
         s = symbol.upper()
-        with _LOCK:
-            _K1M[s].append(k_tuple)
+        ring = _K1M.ring(s)
+        with _stripe(s):
+            ring.append(*k_tuple[:6])
+        _IND.update(symbol, "1m", k_tuple)
+        _notify_kline_close(symbol.upper(), "1m", tuple(k_tuple[:6]))
 
     def on_depth5(self, symbol, bids, asks):
         s = symbol.upper()
@@ -265,26 +939,14 @@ class WSClient:
             ap = float(asks[0][0]); aq = float(asks[0][1])
             obi = bq / (bq + aq) if (bq + aq) > 0 else None
             spread = (ap - bp) / ((ap + bp) / 2.0) if (ap + bp) != 0 else None
-            with _LOCK:
-                _MICRO[s].update({"obi": obi, "spread": spread, "ts": time.time()})
+            with _stripe(s):
+                m = _MICRO.get(s, _MICRO0)
+                _MICRO[s] = Micro(obi, spread, m.trade_buy_ratio, time.time())
         except Exception:
             pass
 
     def on_agg_trade(self, symbol, price, qty, is_buyer_maker):
-        s = symbol.upper()
-        now = time.time()
-        is_aggr_buy = not bool(is_buyer_maker)
-        win = _IMB_WINDOWS.setdefault(s, deque(maxlen=200))
-        win.append((now, float(price), float(qty), is_aggr_buy))
-        cutoff = now - _IMB_LOOKBACK_S
-        buys = 0.0; sells = 0.0
-        for t, _p, _q, is_buy in win:
-            if t >= cutoff:
-                if is_buy: buys += _q
-                else: sells += _q
-        ratio = buys / (buys + sells) if (buys + sells) > 0 else None
-        with _LOCK:
-            _MICRO[s].update({"trade_buy_ratio": ratio, "ts": now})
+        _on_agg_trade(symbol.upper(), float(qty), not bool(is_buyer_maker), time.time())
 
     # 對外取數
     def get_micro(self, symbol):
@@ -0,0 +1,56 @@
+# ws_codec.py
+# WS 訊息解碼器：可插拔，優先用已安裝的快速後端（orjson / msgspec），沒有就退回標準庫 json。
+# config.WS_JSON_BACKEND = "auto" | "orjson" | "msgspec" | "json"
+# 所有後端都接受 str 或 bytes，回傳 dict/list（與 json.loads 相同的結構）。
+
+import json
+from typing import Callable, Dict, Tuple
+
+import config
+
+def _stdlib() -> Callable:
+    return json.loads
+
+def _orjson() -> Callable:
+    import orjson
+    return orjson.loads
+
+def _msgspec() -> Callable:
+    import msgspec
+    dec = msgspec.json.Decoder()
+    return dec.decode
+
+_BACKENDS: Dict[str, Callable[[], Callable]] = {
+    "orjson": _orjson,
+    "msgspec": _msgspec,
+    "json": _stdlib,
+}
+_AUTO_ORDER = ("orjson", "msgspec", "json")
+
+def available() -> Tuple[str, ...]:
+    """目前環境可用的後端名稱（依 auto 的優先順序）"""
+    out = []
+    for name in _AUTO_ORDER:
+        try:
+            _BACKENDS[name]()
+            out.append(name)
+        except Exception:
+            pass
+    return tuple(out)
+
+def make_decoder(name: str = "auto") -> Tuple[str, Callable]:
+    """回傳 (實際使用的後端名稱, decode 函式)；指定的後端沒裝時退回 auto"""
+    name = (name or "auto").lower()
+    if name in _BACKENDS:
+        try:
+            return name, _BACKENDS[name]()
+        except Exception:
+            pass
+    for cand in _AUTO_ORDER:
+        try:
+            return cand, _BACKENDS[cand]()
+        except Exception:
+            continue
+    return "json", json.loads
+
+BACKEND, decode = make_decoder(getattr(config, "WS_JSON_BACKEND", "auto"))
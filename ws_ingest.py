@@ -0,0 +1,444 @@
+# ws_ingest.py
+# 多行程 ingest（config.WS_INGEST_MODE = "process"）：
+# per-symbol WS 連線與 JSON 解析搬到子行程，交易行程不再跟解析搶 GIL。
+# 子行程把每個 symbol 的精簡狀態寫進一塊 shared memory：
+#   - micro：last price、OBI、spread、主動買量比、幾個窗口的主動買/賣量
+#     （窗口除了每筆成交時更新，也每 WS_INGEST_FLOW_S 重算一次，沒成交的 symbol 會跟執行緒模式一樣衰減到 0）
+#   - bars：已收盤 1m bar 的環形區
+# 每個 slot 各有兩個 seqlock（micro / bars 分開，depth 的高頻寫入不會讓讀 bar 重試），
+# 讀取端不加鎖：讀 seq → 複製 → 再讀 seq，相同且為偶數才算數。
+# K 線收盤事件（所有週期，量很小）走 Queue 回主行程，給指標引擎與收盤監聽用。
+# 全市場 ticker / mark price 串流仍留在主行程的執行緒（TP/SL 觸價回呼要在主行程跑）。
+
+import math
+import queue
+import struct
+import sys
+import threading
+import time
+import types
+from multiprocessing import get_context, shared_memory
+from typing import Callable, Dict, List, Optional
+
+import config
+
+SLOTS = int(getattr(config, "WS_INGEST_SLOTS", 128))            # 可同時發布的 symbol 數（shared memory 固定大小）
+BAR_CAP = int(getattr(config, "K1M_RING_CAP", 200))
+FLOW_WINDOWS = (5, 15, 60)                                       # 發布的主動買賣量窗口（秒）
+FLOW_PUBLISH_S = float(getattr(config, "WS_INGEST_FLOW_S", 0.5))  # 窗口定時重算間隔
+_READ_RETRIES = 64
+
+# ==== slot 版面（little-endian） ====
+#   0  mseq  Q          micro 區的 seqlock
+#   8  bseq  Q          bars 區的 seqlock
+#  16  sym   16s        symbol（大寫、補 0）
+#  32  micro 12d        price, price_ts, obi, spread, buy_ratio, micro_ts, (buy, sell) × 3 窗口
+# 128  nbar  Q          累計寫入的 bar 數（含覆寫不加）
+# 136  bars  cap × 6d   (o,h,l,c,v,ts) 環形，位置 = (nbar-1) % cap
+_SEQ = struct.Struct("<Q")
+_SYM = struct.Struct("<16s")
+_MICRO = struct.Struct("<12d")
+_BAR = struct.Struct("<6d")
+_OFF_MSEQ, _OFF_BSEQ, _OFF_SYM, _OFF_MICRO, _OFF_NBAR, _OFF_BARS = 0, 8, 16, 32, 128, 136
+_NAN = float("nan")
+
+def slot_size(cap: int) -> int:
+    return (_OFF_BARS + cap * _BAR.size + 63) // 64 * 64
+
+def _opt(x) -> float:
+    return _NAN if x is None else float(x)
+
+def _val(x: float) -> Optional[float]:
+    return None if math.isnan(x) else x
+
+class ShmWriter:
+    """子行程端：單一寫入者，seq 先 +1（奇數=寫入中）、寫完再 +1"""
+
+    def __init__(self, buf, nslots: int, cap: int):
+        self.buf = buf
+        self.cap = cap
+        self.size = slot_size(cap)
+        self.nslots = nslots
+        self._micro: List[list] = [[_NAN] * 12 for _ in range(nslots)]
+        self._nbar = [0] * nslots
+        self._last_ts = [None] * nslots
+
+    def _off(self, slot: int) -> int:
+        return slot * self.size
+
+    def _begin(self, off: int):
+        seq = _SEQ.unpack_from(self.buf, off)[0] + 1
+        _SEQ.pack_into(self.buf, off, seq)
+        return seq
+
+    def assign(self, slot: int, symbol: str):
+        """slot 換人：清空 micro 與 bars 再寫上新 symbol"""
+        off = self._off(slot)
+        m = self._begin(off + _OFF_MSEQ)
+        b = self._begin(off + _OFF_BSEQ)
+        self._micro[slot] = [_NAN] * 12
+        self._nbar[slot] = 0
+        self._last_ts[slot] = None
+        _SYM.pack_into(self.buf, off + _OFF_SYM, symbol.encode()[:16])
+        _MICRO.pack_into(self.buf, off + _OFF_MICRO, *self._micro[slot])
+        _SEQ.pack_into(self.buf, off + _OFF_NBAR, 0)
+        _SEQ.pack_into(self.buf, off + _OFF_BSEQ, b + 1)
+        _SEQ.pack_into(self.buf, off + _OFF_MSEQ, m + 1)
+
+    def micro(self, slot: int, **fields):
+        """只更新給定的欄位：price / obi / spread / buy_ratio / ts / flows=[(buy,sell)×3]"""
+        vals = self._micro[slot]
+        now = time.time()
+        if "price" in fields:
+            vals[0] = _opt(fields["price"])
+            vals[1] = now
+        if "obi" in fields:
+            vals[2] = _opt(fields["obi"])
+        if "spread" in fields:
+            vals[3] = _opt(fields["spread"])
+        if "buy_ratio" in fields:
+            vals[4] = _opt(fields["buy_ratio"])
+        if "ts" in fields:
+            vals[5] = _opt(fields["ts"])
+        for i, (buy, sell) in enumerate(fields.get("flows") or ()):
+            vals[6 + 2 * i] = float(buy)
+            vals[7 + 2 * i] = float(sell)
+        off = self._off(slot)
+        seq = self._begin(off + _OFF_MSEQ)
+        _MICRO.pack_into(self.buf, off + _OFF_MICRO, *vals)
+        _SEQ.pack_into(self.buf, off + _OFF_MSEQ, seq + 1)
+
+    def bar(self, slot: int, o: float, h: float, l: float, c: float, v: float, ts: float) -> bool:
+        """與 BarRing.append 相同語意：同 ts 覆寫、較舊忽略"""
+        last = self._last_ts[slot]
+        if last is not None and ts < last:
+            return False
+        n = self._nbar[slot]
+        if last is None or ts > last:
+            n += 1
+        off = self._off(slot)
+        seq = self._begin(off + _OFF_BSEQ)
+        _BAR.pack_into(self.buf, off + _OFF_BARS + ((n - 1) % self.cap) * _BAR.size, o, h, l, c, v, ts)
+        _SEQ.pack_into(self.buf, off + _OFF_NBAR, n)
+        _SEQ.pack_into(self.buf, off + _OFF_BSEQ, seq + 1)
+        self._nbar[slot] = n
+        self._last_ts[slot] = ts
+        return True
+
+class ShmReader:
+    """交易行程端：不加鎖的 seqlock 讀取；symbol 不符（slot 還沒換好）回 None"""
+
+    def __init__(self, buf, nslots: int, cap: int):
+        self.buf = buf
+        self.cap = cap
+        self.size = slot_size(cap)
+        self.nslots = nslots
+        self.retries = 0                 # seq 不一致而重讀的次數（寫入衝突指標）
+
+    def _sym_ok(self, off: int, symbol: bytes) -> bool:
+        return _SYM.unpack_from(self.buf, off + _OFF_SYM)[0].rstrip(b"\0") == symbol
+
+    def micro(self, slot: int, symbol: str) -> Optional[tuple]:
+        off = slot * self.size
+        sym = symbol.encode()
+        for _ in range(_READ_RETRIES):
+            s1 = _SEQ.unpack_from(self.buf, off + _OFF_MSEQ)[0]
+            if s1 & 1:
+                self.retries += 1
+                continue
+            ok = self._sym_ok(off, sym)
+            vals = _MICRO.unpack_from(self.buf, off + _OFF_MICRO)
+            if _SEQ.unpack_from(self.buf, off + _OFF_MSEQ)[0] == s1:
+                return vals if ok else None
+            self.retries += 1
+        return None
+
+    def bars_since(self, slot: int, symbol: str, seen: int):
+        """
+        (nbar, bars)：bars 是第 seen 根之後的新 bar（最多 cap 根），seen > 0 時開頭再帶第 seen 根。
+        nbar 為 None 表示讀不到（slot 不屬於這個 symbol 或一直在寫）。
+        """
+        off = slot * self.size
+        sym = symbol.encode()
+        for _ in range(_READ_RETRIES):
+            s1 = _SEQ.unpack_from(self.buf, off + _OFF_BSEQ)[0]
+            if s1 & 1:
+                self.retries += 1
+                continue
+            ok = self._sym_ok(off, sym)
+            n = _SEQ.unpack_from(self.buf, off + _OFF_NBAR)[0]
+            k = min(self.cap, max(1, n - seen + 1), n)
+            bars = [_BAR.unpack_from(self.buf, off + _OFF_BARS + (j % self.cap) * _BAR.size)
+                    for j in range(n - k, n)]
+            if _SEQ.unpack_from(self.buf, off + _OFF_BSEQ)[0] == s1:
+                return (n, bars) if ok else (None, [])
+            self.retries += 1
+        return None, []
+
+# ==== 子行程 ====
+def _child_main(shm_name: str, nslots: int, cap: int, use_testnet: bool, cmd_q, evt_q):
+    import multiprocessing
+    import ws_client
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    w = ShmWriter(shm.buf, nslots, cap)
+    cur = [{}]                            # [symbol -> slot]；整個 dict 換掉，WS 執行緒讀到的永遠是完整的一份
+    orig = dict(ws_client._DISPATCH)
+
+    def _ticker(data):
+        orig["24hrTicker"](data)
+        i = cur[0].get(data.get("s"))
+        if i is not None:
+            w.micro(i, price=ws_client._PRICE.get(data["s"]))
+
+    def _depth(data):
+        orig["depthUpdate"](data)
+        s = data.get("s")
+        i = cur[0].get(s)
+        if i is not None:
+            m = ws_client._MICRO.get(s, ws_client._MICRO0)
+            w.micro(i, obi=m.obi, spread=m.spread, ts=m.ts)
+
+    flows_pub: Dict[int, list] = {}      # slot -> 最後發布的窗口值（只在 WS loop 執行緒上讀寫）
+
+    def _flows(s, now):
+        fl = ws_client._FLOW.get(s)
+        if fl is None:
+            return None
+        with ws_client._stripe(s):
+            return [fl.window(x, now) for x in FLOW_WINDOWS]
+
+    def _agg(data):
+        orig["aggTrade"](data)
+        s = data.get("s")
+        i = cur[0].get(s)
+        if i is not None:
+            m = ws_client._MICRO.get(s, ws_client._MICRO0)
+            flows = _flows(s, m.ts)
+            if flows is not None:
+                flows_pub[i] = flows
+            w.micro(i, buy_ratio=m.trade_buy_ratio, ts=m.ts, flows=flows)
+
+    def _refresh_flows():
+        # 定時在 WS loop 上重算（與 handler 同一條執行緒，ShmWriter 維持單一寫入者）；值有變才寫
+        now = time.time()
+        for s, i in cur[0].items():
+            flows = _flows(s, now)
+            if flows is not None and flows != flows_pub.get(i):
+                flows_pub[i] = flows
+                w.micro(i, flows=flows)
+
+    def _bar_closed(s, iv, bar):
+        i = cur[0].get(s)
+        if i is None:
+            return
+        if iv == "1m":
+            w.bar(i, *bar)
+        try:
+            evt_q.put_nowait(("bar", s, iv, bar))
+        except Exception:
+            pass
+
+    ws_client._DISPATCH.update({"24hrTicker": _ticker, "depthUpdate": _depth, "aggTrade": _agg})
+    ws_client.on_kline_close(_bar_closed)
+
+    ws_client._start_recorder()
+    mgr = ws_client.SubscriptionManager(use_testnet)
+    mgr.start()
+    parent = multiprocessing.parent_process()
+    last_stats = last_flows = 0.0
+    try:
+        while parent is None or parent.is_alive():
+            try:
+                cmd = cmd_q.get(timeout=min(0.5, FLOW_PUBLISH_S))
+            except queue.Empty:
+                cmd = None
+            if cmd is not None:
+                if cmd[0] == "stop":
+                    break
+                if cmd[0] == "symbols":
+                    slots, extra = cmd[1], cmd[2]
+                    old = cur[0]
+                    for s, i in slots.items():
+                        if old.get(s) != i:
+                            w.assign(i, s)
+                    cur[0] = dict(slots)
+                    ws_client._EXTRA_KLINES = list(extra)
+                    mgr.set_streams(ws_client._make_streams(sorted(slots)))
+            now = time.time()
+            if now - last_flows >= FLOW_PUBLISH_S and mgr._loop is not None:
+                last_flows = now
+                try:
+                    mgr._loop.call_soon_threadsafe(_refresh_flows)
+                except RuntimeError:
+                    pass                      # loop 已關閉
+            if now - last_stats >= 1.0:
+                last_stats = now
+                try:
+                    evt_q.put_nowait(("stats", mgr.stats()))
+                except Exception:
+                    pass
+    finally:
+        try:
+            mgr.stop()
+        except Exception:
+            pass
+        ws_client._stop_recorder()
+        shm.close()
+
+# ==== 交易行程端 ====
+def _start_clean(proc):
+    """
+    spawn 會在子行程重新 import 啟動腳本（__main__ → __mp_main__），main.py 的 import 與初始化都會再跑一次。
+    start() 的瞬間把 __main__ 換成指向本模組的空殼，子行程只會載入 ws_ingest（本身沒有副作用）。
+    """
+    main = sys.modules.get("__main__")
+    stub = types.ModuleType("__main__")
+    stub.__file__ = __file__
+    stub.__spec__ = None
+    sys.modules["__main__"] = stub
+    try:
+        proc.start()
+    finally:
+        if main is not None:
+            sys.modules["__main__"] = main
+
+class IngestProcess:
+    """
+    建立 shared memory 與子行程；slot 分配由這裡決定（symbol -> slot），以命令送給子行程。
+    on_bar(symbol, interval, bar) 在本行程的 drain 執行緒上呼叫（K 線收盤事件）。
+    """
+
+    def __init__(self, use_testnet: bool, on_bar: Optional[Callable] = None,
+                 nslots: int = SLOTS, cap: int = BAR_CAP):
+        self.use_testnet = use_testnet
+        self.nslots = max(1, int(nslots))
+        self.cap = max(2, int(cap))
+        self._on_bar = on_bar
+        self._shm = shared_memory.SharedMemory(create=True, size=self.nslots * slot_size(self.cap))
+        self._shm.buf[:] = bytes(self._shm.size)
+        self.reader = ShmReader(self._shm.buf, self.nslots, self.cap)
+        self._ctx = get_context("spawn")   # 主行程有多條執行緒，不用 fork
+        self._cmd_q = self._ctx.Queue()
+        self._evt_q = self._ctx.Queue()
+        self._proc = None
+        self._drain = None
+        self._stop = False
+        self._slots: Dict[str, int] = {}
+        self._bar_seen: Dict[str, int] = {}
+        self._stats: List[dict] = []
+        self.dropped: List[str] = []       # slot 不夠而沒發布的 symbol
+
+    def start(self):
+        if self._proc is not None and self._proc.is_alive():
+            return
+        self._proc = self._ctx.Process(
+            target=_child_main, name="ws-ingest", daemon=True,
+            args=(self._shm.name, self.nslots, self.cap, self.use_testnet, self._cmd_q, self._evt_q),
+        )
+        _start_clean(self._proc)
+        self._drain = threading.Thread(target=self._drain_loop, daemon=True, name="ws-ingest-drain")
+        self._drain.start()
+
+    def alive(self) -> bool:
+        return bool(self._proc is not None and self._proc.is_alive())
+
+    def _drain_loop(self):
+        while not self._stop:
+            try:
+                evt = self._evt_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except Exception:
+                break
+            try:
+                if evt[0] == "bar" and self._on_bar is not None:
+                    self._on_bar(evt[1], evt[2], evt[3])
+                elif evt[0] == "stats":
+                    self._stats = evt[1]
+            except Exception:
+                pass
+
+    def set_symbols(self, symbols, extra_klines=()):
+        """保留既有 symbol 的 slot，移除的釋出給新的；超出 slot 數的不訂閱（記在 dropped）"""
+        want = sorted({s.upper() for s in symbols})
+        keep = {s: i for s, i in self._slots.items() if s in want}
+        free = sorted(set(range(self.nslots)) - set(keep.values()))
+        dropped = []
+        for s in want:
+            if s in keep:
+                continue
+            if not free:
+                dropped.append(s)
+                continue
+            keep[s] = free.pop(0)
+            self._bar_seen[s] = 0
+        for s in [s for s in self._bar_seen if s not in keep]:
+            self._bar_seen.pop(s, None)
+        self._slots = keep
+        self.dropped = dropped
+        self._cmd_q.put(("symbols", dict(keep), list(extra_klines)))
+
+    def slot(self, symbol: str) -> Optional[int]:
+        return self._slots.get(symbol)
+
+    def micro(self, symbol: str) -> Optional[tuple]:
+        """(price, price_ts, obi, spread, buy_ratio, ts, flows...)；NaN 表示尚無資料"""
+        i = self._slots.get(symbol)
+        return self.reader.micro(i, symbol) if i is not None else None
+
+    def price(self, symbol: str) -> Optional[float]:
+        vals = self.micro(symbol)
+        return _val(vals[0]) if vals is not None else None
+
+    def micro_dict(self, symbol: str) -> Optional[dict]:
+        vals = self.micro(symbol)
+        if vals is None:
+            return None
+        ts = _val(vals[5])
+        return {"obi": _val(vals[2]), "spread": _val(vals[3]), "trade_buy_ratio": _val(vals[4]),
+                "ts": ts if ts is not None else 0.0}
+
+    def flows(self, symbol: str) -> Dict[int, tuple]:
+        """{窗口秒數: (buy, sell)}（子行程每筆成交與每 FLOW_PUBLISH_S 重算的值）"""
+        vals = self.micro(symbol)
+        if vals is None:
+            return {}
+        out = {}
+        for k, x in enumerate(FLOW_WINDOWS):
+            buy, sell = vals[6 + 2 * k], vals[7 + 2 * k]
+            if not (math.isnan(buy) or math.isnan(sell)):
+                out[x] = (buy, sell)
+        return out
+
+    def new_bars(self, symbol: str) -> list:
+        """上次呼叫之後新收盤的 1m bar（開頭會帶上次的最後一根，append 以 ts 去重）；沒有新的回 []"""
+        i = self._slots.get(symbol)
+        if i is None:
+            return []
+        seen = self._bar_seen.get(symbol, 0)
+        n, bars = self.reader.bars_since(i, symbol, seen)
+        if n is None or n <= seen:
+            return []
+        self._bar_seen[symbol] = n
+        return bars
+
+    def stats(self) -> List[dict]:
+        return list(self._stats)
+
+    def stop(self):
+        self._stop = True
+        try:
+            self._cmd_q.put(("stop",))
+        except Exception:
+            pass
+        if self._proc is not None:
+            self._proc.join(timeout=5.0)       # 子行程收尾要把錄製的緩衝寫完
+            if self._proc.is_alive():
+                self._proc.terminate()
+            self._proc = None
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except Exception:
+            pass